@@ -1,14 +1,274 @@
 import json
 import os
 import logging
+import threading
+import time
+from collections import defaultdict
 import boto3
 
+# The Lambda is deployed as this one file, so it must not import the teardown modules next to it
 REGION = os.environ['AWS_REGION']
 sm_client = boto3.client('sagemaker', REGION)
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+DOMAIN_CACHE_TTL = int(os.environ.get('DOMAIN_CACHE_TTL', 300))
+PROFILE_INDEX_TTL = int(os.environ.get('PROFILE_INDEX_TTL', 900))
+
+def paginate(client, operation, result_key, **kwargs):
+    """Lazily yield every item returned by a paginated boto3 operation."""
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        yield from page.get(result_key, [])
+
+# Copies of metrics.LATENCY_BUCKETS and rate_limit.THROTTLING_CODES, since the Lambda ships alone
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+THROTTLING_CODES = (
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'RequestThrottled', 'SlowDown',
+)
+
+class OperationMetrics:
+    """Counters and latency histogram of one service operation, as in metrics.py."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def to_dict(self):
+        buckets = {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets)}
+        buckets['+Inf'] = self.calls
+        return {'calls': self.calls, 'errors': self.errors, 'retries': self.retries, 'throttles': self.throttles,
+                'seconds': round(self.seconds, 6), 'buckets': buckets}
+
+class ApiMetrics:
+    """
+    Per-operation call and error counts, latency histogram, retries and
+    throttles of every registered client, like metrics.ApiMetrics.
+    """
+
+    def __init__(self):
+        self.operations = defaultdict(OperationMetrics)
+        self._lock = threading.Lock()
+
+    def _key(self, event_name):
+        # Event names look like 'after-call.sagemaker.ListDomains'
+        _, service, operation = event_name.split('.', 2)
+        return service, operation
+
+    def _before_call(self, context, **kwargs):
+        context['metrics_started'] = time.monotonic()
+
+    def _after_call(self, event_name, http_response, parsed, context, **kwargs):
+        started = context.get('metrics_started')
+        seconds = time.monotonic() - started if started is not None else 0.0
+        with self._lock:
+            operation = self.operations[self._key(event_name)]
+            operation.observe(seconds)
+            operation.retries += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            if http_response.status_code >= 300:
+                operation.errors += 1
+
+    def _after_call_error(self, event_name, context, **kwargs):
+        # Connection errors and the like, raised before any response was parsed
+        started = context.get('metrics_started')
+        with self._lock:
+            operation = self.operations[self._key(event_name)]
+            operation.observe(time.monotonic() - started if started is not None else 0.0)
+            operation.errors += 1
+
+    def _needs_retry(self, event_name, response=None, **kwargs):
+        if response is None or response[1].get('Error', {}).get('Code') not in THROTTLING_CODES:
+            return
+        with self._lock:
+            self.operations[self._key(event_name)].throttles += 1
+
+    def register(self, client):
+        """Measure every call of a client."""
+        client.meta.events.register_first('before-call', self._before_call)
+        client.meta.events.register('after-call', self._after_call)
+        client.meta.events.register('after-call-error', self._after_call_error)
+        client.meta.events.register('needs-retry', self._needs_retry)
+        return client
+
+    def snapshot(self, reset=False):
+        """Return the metrics keyed by 'service.Operation', and start from zero afterwards if ``reset``."""
+        with self._lock:
+            operations = {f"{service}.{operation}": metrics.to_dict()
+                          for (service, operation), metrics in sorted(self.operations.items())}
+            if reset:
+                self.operations.clear()
+        return operations
+
+# Per-operation call counts and latencies, logged at the end of every invocation
+API_METRICS = ApiMetrics()
+API_METRICS.register(sm_client)
+
+class WarmCache:
+    """Value kept at module level, so warm invocations skip the API calls behind it."""
+
+    def __init__(self, load, ttl, name):
+        """
+        Args:
+            load: Callable returning a fresh value.
+            ttl (int): Seconds after which the value is refreshed in the background.
+            name (str): Name used in log messages.
+        """
+        self.load = load
+        self.ttl = ttl
+        self.name = name
+        self._value = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        value = self.load()
+        with self._lock:
+            self._value, self._fetched_at = value, time.monotonic()
+        return value
+
+    def _refresh(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            # The stale value keeps serving; the next invocation tries again
+            LOGGER.warning("Background refresh of the %s failed: %s", self.name, str(e))
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        """
+        Return the cached value, loading it only on a cold start.
+
+        A stale value is returned as is while a background thread loads it
+        again. Lambda freezes the thread between invocations, so a refresh
+        started late in one invocation may finish in the next.
+        """
+        with self._lock:
+            value, stale = self._value, time.monotonic() - self._fetched_at > self.ttl
+            start_refresh = value is not None and stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+        if value is None:
+            return self._fetch()
+        if start_refresh:
+            threading.Thread(target=self._refresh, name=f"{self.name}-refresh", daemon=True).start()
+        return value
+
+    def peek(self):
+        """Return the cached value without loading it, or None."""
+        with self._lock:
+            return self._value
+
+    def invalidate(self):
+        """Forget the value, so that the next invocation loads it again."""
+        with self._lock:
+            self._value = None
+
+def list_domains():
+    """
+    Returns:
+        list: Dictionaries with DomainId and DomainName of every domain.
+    """
+    LOGGER.info("Querying all domains")
+    return [{'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']}
+            for domain in paginate(sm_client, 'list_domains', 'Domains')]
+
+class UserProfileIndex:
+    """
+    User profile name -> domain ID, kept across warm invocations.
+
+    Built from one paginated list_user_profiles over every domain. A name
+    that is not in the index triggers an incremental update that lists the
+    profiles newest first and stops at the first one already seen, usually
+    after a single page.
+    """
+
+    def __init__(self, client, ttl=PROFILE_INDEX_TTL):
+        self.client = client
+        self.cache = WarmCache(self._load, ttl, 'user profile index')
+        self._lock = threading.Lock()
+
+    def _load(self):
+        LOGGER.info("Indexing all user profiles")
+        index = {'domains': {}, 'newest': None}
+        self._add(index, paginate(self.client, 'list_user_profiles', 'UserProfiles',
+                                  SortBy='CreationTime', SortOrder='Ascending'))
+        return index
+
+    def _add(self, index, user_profiles):
+        # Oldest first, so that of two profiles with one name the newest wins
+        for user_profile in user_profiles:
+            if user_profile.get('Status') not in ('Deleting', 'Delete_Failed'):
+                index['domains'][user_profile['UserProfileName']] = user_profile['DomainId']
+            if index['newest'] is None or user_profile['CreationTime'] > index['newest']:
+                index['newest'] = user_profile['CreationTime']
+
+    def _update(self, index):
+        created = []
+        for user_profile in paginate(self.client, 'list_user_profiles', 'UserProfiles',
+                                     SortBy='CreationTime', SortOrder='Descending'):
+            if index['newest'] is not None and user_profile['CreationTime'] <= index['newest']:
+                break
+            created.append(user_profile)
+        with self._lock:
+            self._add(index, reversed(created))
+
+    def domain_of(self, user_profile_name):
+        """
+        Return the ID of the domain holding a user profile.
+
+        Args:
+            user_profile_name (str): User profile name.
+
+        Returns:
+            str: Domain ID, or None if no domain has the profile.
+        """
+        index = self.cache.get()
+        if user_profile_name not in index['domains']:
+            self._update(index)
+        return index['domains'].get(user_profile_name)
+
+    def remember(self, user_profile_name, domain_id):
+        """Record the domain a profile was found in outside the index."""
+        index = self.cache.peek()
+        if index is not None:
+            with self._lock:
+                index['domains'][user_profile_name] = domain_id
+
+    def forget(self, user_profile_name):
+        """Drop a profile whose domain turned out to be wrong, e.g. after it was deleted."""
+        index = self.cache.peek()
+        if index is not None:
+            with self._lock:
+                index['domains'].pop(user_profile_name, None)
+
+# Domain list kept across warm invocations
+DOMAIN_CACHE = WarmCache(list_domains, DOMAIN_CACHE_TTL, 'domain list')
+PROFILE_INDEX = UserProfileIndex(sm_client)
+
+def presign(domain_id, user_profile_name):
+    """Create a presigned Studio URL for a user profile."""
+    return sm_client.create_presigned_domain_url(
+        DomainId=domain_id,
+        UserProfileName=user_profile_name,
+        SessionExpirationDurationInSeconds=43200,
+        ExpiresInSeconds=60
+    )
+
 def lambda_handler(event, context):
     """Handler to generate the Presigned URL."""
     LOGGER.info("Event message: %s", event)
@@ -16,28 +276,47 @@ def lambda_handler(event, context):
     
     presigned_urls = {}
     try:
-        LOGGER.info("Querying all domains")
-        sm_domains = sm_client.list_domains()
+        # Cached across warm invocations, so a login costs only create_presigned_domain_url
+        sm_domains = DOMAIN_CACHE.get()
         
         found_first_user_profile = False
-        for domain_info in sm_domains.get('Domains', []):
+        profile_unknown = False
+        user_profile = event.get('requestContext', {}).get('authorizer', {}).get('party-id')
+        if user_profile:
+            # Straight to the domain holding the profile; the loop below is the fallback
+            try:
+                indexed_domain_id = PROFILE_INDEX.domain_of(user_profile[2:])
+            except Exception as e:
+                LOGGER.error("Error looking up the domain of profile %s: %s", user_profile[2:], str(e))
+                # Unknown rather than absent: every domain is tried below
+                indexed_domain_id = False
+            # An up-to-date index without the profile means no domain has it, so no domain is tried
+            profile_unknown = indexed_domain_id is None
+            if indexed_domain_id:
+                LOGGER.info("Profile %s indexed in domain: %s", user_profile[2:], indexed_domain_id)
+                try:
+                    presigned_urls[indexed_domain_id] = presign(indexed_domain_id, user_profile[2:])
+                    found_first_user_profile = True
+                except Exception as e:
+                    LOGGER.error("Error processing domain %s: %s", indexed_domain_id, str(e))
+                    presigned_urls[indexed_domain_id] = {"error": str(e)}
+                    PROFILE_INDEX.forget(user_profile[2:])
+
+        for domain_info in sm_domains:
             domain_id = domain_info.get('DomainId')
+            if domain_id in presigned_urls:
+                continue
             
             LOGGER.info("Processing domain: %s", domain_id)
             
             try:
                 if 'requestContext' in event and 'authorizer' in event['requestContext']:
-                    user_profile = event['requestContext']['authorizer'].get('party-id')
-                    if user_profile and not found_first_user_profile:
+                    if user_profile and not found_first_user_profile and not profile_unknown:
                         modified_user_profile = user_profile[2:]
-                        response = sm_client.create_presigned_domain_url(
-                            DomainId=domain_id,
-                            UserProfileName=modified_user_profile,
-                            SessionExpirationDurationInSeconds=43200,
-                            ExpiresInSeconds=60
-                        )
+                        response = presign(domain_id, modified_user_profile)
                         presigned_urls[domain_id] = response
                         found_first_user_profile = True
+                        PROFILE_INDEX.remember(modified_user_profile, domain_id)
                     elif not found_first_user_profile:
                         presigned_urls[domain_id] = "Presigned URL not generated"
                     else:
@@ -48,6 +327,10 @@ def lambda_handler(event, context):
             except Exception as e:
                 LOGGER.error("Error processing domain %s: %s", domain_id, str(e))
                 presigned_urls[domain_id] = {"error": str(e)}
+
+        if not found_first_user_profile and not profile_unknown:
+            # The cached list may miss a new domain or hold a deleted one
+            DOMAIN_CACHE.invalidate()
     
     except Exception as exception:
         LOGGER.error("Error querying domains: %s", str(exception))
@@ -60,6 +343,8 @@ def lambda_handler(event, context):
             },
             'body': json.dumps({"error": str(exception)})
         }
+    finally:
+        LOGGER.info("AWS API metrics: %s", json.dumps(API_METRICS.snapshot(reset=True)))
     
     return {
         'statusCode': 200,
@@ -81,6 +366,12 @@ import boto3
 import csp
 import time
 import argparse
+from aws_clients import ClientFactory
+from credential_cache import cached_login
+from discovery import group_name_filter
+from efs_teardown import delete_file_systems
+from inventory import app_owner, iter_apps, iter_spaces, iter_user_profiles, paginate
+from polling import wait_deleted
 
 os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
 
@@ -127,14 +418,13 @@ def delete_lambda_functions(client, domain_id, domain_name, dry_run=False):
     Returns:
         list: List of Lambda function names that can be deleted.
     """
-    lambda_client = boto3.client('lambda')
-    functions = lambda_client.list_functions()
+    functions = client.list_functions()
     deletable_functions = []
     for function in functions['Functions']:
         if function['FunctionName'].endswith(domain_name):
             print(f"Deleting Lambda Function: {function['FunctionName']}")
             if not dry_run:
-                lambda_client.delete_function(FunctionName=function['FunctionName'])
+                client.delete_function(FunctionName=function['FunctionName'])
             else:
                 print(f"Dry-run: Would delete Lambda Function: {function['FunctionName']}")
             deletable_functions.append(function['FunctionName'])
@@ -153,21 +443,20 @@ def delete_network_interfaces(client, domain_id, domain_name, dry_run=False):
     Returns:
         list: List of network interface IDs that can be deleted.
     """
-    ec2_client = boto3.client('ec2')
-    network_interfaces = ec2_client.describe_network_interfaces()
+    # EC2 matches the security-group name, instead of us paging through every ENI of the account
+    network_interfaces = paginate(client, 'describe_network_interfaces', 'NetworkInterfaces',
+                                  Filters=[group_name_filter(domain_name)])
     deletable_interfaces = []
-    for interface in network_interfaces['NetworkInterfaces']:
-        for group in interface['Groups']:
-            if domain_name in group['GroupName']:
-                print(f"Deleting Network Interface: {interface['NetworkInterfaceId']}")
-                if not dry_run:
-                    ec2_client.delete_network_interface(NetworkInterfaceId=interface['NetworkInterfaceId'])
-                else:
-                    print(f"Dry-run: Would delete Network Interface: {interface['NetworkInterfaceId']}")
-                deletable_interfaces.append(interface['NetworkInterfaceId'])
+    for interface in network_interfaces:
+        print(f"Deleting Network Interface: {interface['NetworkInterfaceId']}")
+        if not dry_run:
+            client.delete_network_interface(NetworkInterfaceId=interface['NetworkInterfaceId'])
+        else:
+            print(f"Dry-run: Would delete Network Interface: {interface['NetworkInterfaceId']}")
+        deletable_interfaces.append(interface['NetworkInterfaceId'])
     return deletable_interfaces
 
-def delete_efs_volumes(client, domain_id, domain_name, dry_run=False):
+def delete_efs_volumes(client, domain_id, domain_name, domain_arn, dry_run=False):
     """
     Delete EFS volumes associated with the given domain ID and domain name.
 
@@ -175,25 +464,26 @@ def delete_efs_volumes(client, domain_id, domain_name, dry_run=False):
         client: Boto3 EFS client.
         domain_id (str): Domain ID.
         domain_name (str): Domain name.
+        domain_arn (str): Domain ARN the SageMaker-managed EFS volume is tagged with.
         dry_run (bool): If True, perform a dry-run and don't delete the resources.
 
     Returns:
         list: List of EFS file system IDs that can be deleted.
     """
-    efs_client = boto3.client('efs')
-    file_systems = efs_client.describe_file_systems()
+    file_systems = client.describe_file_systems()
     deletable_file_systems = []
     for file_system in file_systems['FileSystems']:
-        if f"arn:aws:sagemaker:{os.environ['AWS_REGION']}:{client.get_caller_identity()['Account']}:domain/{domain_id}" in file_system['Tags']:
+        if any(tag['Value'] == domain_arn for tag in file_system['Tags']):
             print(f"Deleting EFS Volume: {file_system['FileSystemId']}")
-            if not dry_run:
-                efs_client.delete_file_system(FileSystemId=file_system['FileSystemId'])
-            else:
+            if dry_run:
                 print(f"Dry-run: Would delete EFS Volume: {file_system['FileSystemId']}")
             deletable_file_systems.append(file_system['FileSystemId'])
+    if not dry_run:
+        # Mount targets go first, then every volume at once
+        delete_file_systems(client, deletable_file_systems)
     return deletable_file_systems
 
-def delete_domain(client, domain_id, domain_name, dry_run=False):
+def delete_domain(client, domain_id, domain_name, dry_run=False, factory=None):
     """
     Delete resources associated with the given domain ID and domain name.
 
@@ -202,6 +492,7 @@ def delete_domain(client, domain_id, domain_name, dry_run=False):
         domain_id (str): Domain ID to delete.
         domain_name (str): Domain name.
         dry_run (bool): If True, perform a dry-run and don't delete the resources.
+        factory (ClientFactory): Shared client factory for Lambda, EC2 and EFS.
 
     Returns:
         dict: Dictionary containing the lists of deletable resources.
@@ -211,7 +502,8 @@ def delete_domain(client, domain_id, domain_name, dry_run=False):
         'network_interfaces': [],
         'efs_volumes': [],
         'apps': [],
-        'user_profiles': []
+        'user_profiles': [],
+        'spaces': []
     }
 
     # Delete Apps
@@ -219,11 +511,27 @@ def delete_domain(client, domain_id, domain_name, dry_run=False):
     for app in apps['Apps']:
         print(f"Deleting App: {app['AppName']}")
         if not dry_run:
-            client.delete_app(DomainId=domain_id, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName'])
+            client.delete_app(DomainId=domain_id, AppType=app['AppType'], AppName=app['AppName'], **app_owner(app))
         else:
             print(f"Dry-run: Would delete App: {app['AppName']}")
         deletable_resources['apps'].append(app['AppName'])
 
+    # Like the graph teardown: apps, then spaces, then user profiles, each once the previous are gone
+    if not dry_run:
+        wait_deleted(lambda: iter_apps(client, domain_id))
+
+    # Delete Spaces
+    for space in iter_spaces(client, domain_id):
+        print(f"Deleting Space: {space['SpaceName']}")
+        if not dry_run:
+            client.delete_space(DomainId=domain_id, SpaceName=space['SpaceName'])
+        else:
+            print(f"Dry-run: Would delete Space: {space['SpaceName']}")
+        deletable_resources['spaces'].append(space['SpaceName'])
+
+    if not dry_run:
+        wait_deleted(lambda: iter_spaces(client, domain_id))
+
     # Delete User Profiles
     user_profiles = client.list_user_profiles(DomainIdEquals=domain_id)
     for user_profile in user_profiles['UserProfiles']:
@@ -234,14 +542,18 @@ def delete_domain(client, domain_id, domain_name, dry_run=False):
             print(f"Dry-run: Would delete User Profile: {user_profile['UserProfileName']}")
         deletable_resources['user_profiles'].append(user_profile['UserProfileName'])
 
+    if not dry_run:
+        wait_deleted(lambda: iter_user_profiles(client, domain_id))
+
     # Delete Lambda Functions
-    deletable_resources['lambda_functions'] = delete_lambda_functions(client, domain_id, domain_name, dry_run)
+    factory = factory or ClientFactory()
+    deletable_resources['lambda_functions'] = delete_lambda_functions(factory.client('lambda'), domain_id, domain_name, dry_run)
 
     # Delete Network Interfaces
-    deletable_resources['network_interfaces'] = delete_network_interfaces(client, domain_id, domain_name, dry_run)
+    deletable_resources['network_interfaces'] = delete_network_interfaces(factory.client('ec2'), domain_id, domain_name, dry_run)
 
     # Delete EFS Volumes
-    deletable_resources['efs_volumes'] = delete_efs_volumes(client, domain_id, domain_name, dry_run)
+    deletable_resources['efs_volumes'] = delete_efs_volumes(factory.client('efs'), domain_id, domain_name, factory.domain_arn(domain_id), dry_run)
 
     # Delete Domain
     if not dry_run:
@@ -254,9 +566,10 @@ def delete_domain(client, domain_id, domain_name, dry_run=False):
 
 if __name__ == '__main__':
     # Assuming csp.login() is defined elsewhere
-    csp.login()
+    cached_login(csp.login)
 
-    client = boto3.client('sagemaker')
+    factory = ClientFactory()
+    client = factory.client('sagemaker')
 
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description='Delete SageMaker domains and associated resources.')
@@ -276,7 +589,7 @@ if __name__ == '__main__':
         # Proceed with deletion for each filtered domain
         for domain in filtered_domains:
             print(f"Preparing to delete Domain ID: {domain['DomainId']}, Domain Name: {domain['DomainName']}")
-            deletable_resources = delete_domain(client, domain['DomainId'], domain['DomainName'], args.dry_run)
+            deletable_resources = delete_domain(client, domain['DomainId'], domain['DomainName'], args.dry_run, factory)
 
             if args.dry_run:
                 print(f"Dry-run: Domain ID {domain['DomainId']} can be deleted with the following resources:")
@@ -297,7 +610,7 @@ if __name__ == '__main__':
                     domain_name = domain['DomainName']
                     break
             print(f"Preparing to delete Domain ID: {domain_id}, Domain Name: {domain_name}")
-            deletable_resources = delete_domain(client, domain_id, domain_name, args.dry_run)
+            deletable_resources = delete_domain(client, domain_id, domain_name, args.dry_run, factory)
 
             if args.dry_run:
                 print(f"Dry-run: Domain ID {domain_id} can be deleted with the following resources:")
@@ -3,18 +3,20 @@
 import boto3
 import argparse
 import botocore.exceptions
+from aws_clients import add_client_arguments, factory_from_args
+from discovery import find_network_interfaces
+from efs_teardown import delete_file_systems
+from inventory import DEFAULT_PAGE_SIZE, app_owner, iter_apps, iter_domains, iter_spaces, iter_user_profiles
+from polling import wait_deleted
 
-def list_all_domains(client):
+def list_all_domains(client, page_size=DEFAULT_PAGE_SIZE):
     print("All Domain IDs and Domain Names:")
-    domains = client.list_domains()
-    for domain in domains['Domains']:
+    for domain in iter_domains(client, page_size):
         print(f"Domain ID: {domain['DomainId']}, Domain Name: {domain['DomainName']}")
 
-def filter_domain_id_with_project_id(client, project_id):
+def filter_domain_id_with_project_id(client, project_id, page_size=DEFAULT_PAGE_SIZE):
     filtered_domain_ids = []
-    client = boto3.client('sagemaker')
-    domains = client.list_domains()
-    for domain in domains['Domains']:
+    for domain in iter_domains(client, page_size):
         if domain['DomainName'].endswith(project_id):
             filtered_domain_ids.append({'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']})
     return filtered_domain_ids
@@ -28,38 +30,54 @@ def delete_lambda_functions(client, project_id):
             client.delete_function(FunctionName=func['FunctionName'])
 
 def delete_network_interfaces(client, domain_id):
-    interfaces = client.describe_network_interfaces()
-    for interface in interfaces['NetworkInterfaces']:
-        for group in interface['Groups']:
-            if domain_id in group['Groupname']:
-                print(f"Deleting Network Interface: {interface['NetworkInterfaceId']}")
-                client.delete_network_interface(NetworkInterfaceId=interface['NetworkInterfaceId'])
+    # EC2 matches the security-group name, instead of us paging through every ENI of the account
+    for interface_id in find_network_interfaces(client, domain_id):
+        print(f"Deleting Network Interface: {interface_id}")
+        client.delete_network_interface(NetworkInterfaceId=interface_id)
 
 def delete_efs_volumes(client, domain_id):
     volumes = client.describe_file_systems()
+    file_system_ids = []
     for volume in volumes['FileSystems']:
         for tag in volume['Tags']:
             if domain_id in tag['Value']:
                 print(f"Deleting EFS Volume: {volume['FileSystemId']}")
-                client.delete_file_system(FileSystemId=volume['FileSystemId'])
+                file_system_ids.append(volume['FileSystemId'])
+    # Mount targets go first, then every volume at once
+    delete_file_systems(client, file_system_ids)
 
-def delete_domain(client, domain_id, domain_name, dry_run=False):
+def delete_domain(client, domain_id, domain_name, dry_run=False, page_size=DEFAULT_PAGE_SIZE):
     # Delete Apps
-    apps = client['sagemaker'].list_apps(DomainIdEquals=domain_id)
-    for app in apps['Apps']:
+    for app in iter_apps(client['sagemaker'], domain_id, page_size):
         print(f"Deleting App: {app['AppName']}")
         if not dry_run:
             print(f"Deleting App: {app['AppName']}")
-            client.delete_app(DomainId=domain_id, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName'])
+            client.delete_app(DomainId=domain_id, AppType=app['AppType'], AppName=app['AppName'], **app_owner(app))
+
+    # Like the graph teardown: apps, then spaces, then user profiles, each once the previous are gone
+    if not dry_run:
+        wait_deleted(lambda: iter_apps(client['sagemaker'], domain_id, page_size))
+
+    # Delete Spaces
+    for space in iter_spaces(client['sagemaker'], domain_id, page_size):
+        print(f"Deleting Space: {space['SpaceName']}")
+        if not dry_run:
+            print(f"Deleting Space: {space['SpaceName']}")
+            client.delete_space(DomainId=domain_id, SpaceName=space['SpaceName'])
+
+    if not dry_run:
+        wait_deleted(lambda: iter_spaces(client['sagemaker'], domain_id, page_size))
 
     # Delete User Profiles
-    user_profiles = client['sagemaker'].list_user_profiles(DomainIdEquals=domain_id)
-    for user_profile in user_profiles['UserProfiles']:
+    for user_profile in iter_user_profiles(client['sagemaker'], domain_id, page_size):
         print(f"Deleting User Profile: {user_profile['UserProfileName']}")
         if not dry_run:
             print(f"Deleting User Profile: {user_profile['UserProfileName']}")
             client.delete_user_profile(DomainId=domain_id, UserProfileName=user_profile['UserProfileName'])
 
+    if not dry_run:
+        wait_deleted(lambda: iter_user_profiles(client['sagemaker'], domain_id, page_size))
+
     # Delete Domain Resources
     print(f"Deleting Resources Associated with Domain: {domain_id}")
     delete_domain_resources(client, domain_id, domain_name)
@@ -90,7 +108,7 @@ def get_domain_name(client, domain_id):
     try:
         response=client.describe_domain(DomainId=domain_id)
         print("describe domain response", response)
-        return response['DomainName'] if 'DomaiName' in response else None
+        return response['DomainName'] if 'DomainName' in response else None
     except Exception as e:
         print(f"Error reterving domain name for domain ID '{domain_id}': {e}")
         return None
@@ -100,11 +118,14 @@ def parse_arguments():
     parser.add_argument('--project-id', default=None, help="Project ID suffix to filter domains")
     parser.add_argument('--domain-ids', default=None, help="Comma-separated list of domain IDs to delete")
     parser.add_argument('--dry-run', action='store_true', help="Perform a dry run without deleting resources")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help="Number of items requested per list page")
+    add_client_arguments(parser)
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_arguments()
-    client = boto3.client('sagemaker')
+    factory = factory_from_args(args)
+    client = factory.client('sagemaker')
     project_id = args.project_id
     domain_ids = args.domain_ids
 
@@ -139,17 +160,12 @@ if __name__ == "__main__":
         print("Neither Project ID nor domain IDs are provided")
 
 
-    client = {
-        'sagemaker': boto3.client('sagemaker'),
-        'lambda': boto3.client('lambda'),
-        'ec2': boto3.client('ec2'),
-        'efs': boto3.client('efs')
-    }
+    client = factory.clients('sagemaker', 'lambda', 'ec2', 'efs')
 
-    list_all_domains(client['sagemaker'])
+    list_all_domains(client['sagemaker'], args.page_size)
 
     if args.project_id:
-        filtered_domains = filter_domain_id_with_project_id(client['sagemaker'], args.project_id)
+        filtered_domains = filter_domain_id_with_project_id(client['sagemaker'], args.project_id, args.page_size)
         if not filtered_domains:
             print(f"No domains found with project ID '{args.project_id}' as suffix.")
             exit(0)
@@ -168,7 +184,7 @@ if __name__ == "__main__":
         print("Domain Name:", domain_name)  # Debug statement
         print(f"Preparing to delete Domain ID: {domain['DomainId']}")
         delete_domain_resources(client, domain_id, domain_name)
-        delete_domain(client, domain_id, domain_name, dry_run=False)
+        delete_domain(client, domain_id, domain_name, page_size=args.page_size, dry_run=False)
         
         
 
@@ -2,6 +2,13 @@ import os
 import boto3
 import csp
 import argparse
+from aws_clients import add_client_arguments, factory_from_args
+from credential_cache import cached_login
+from discovery import group_name_filter
+from efs_teardown import delete_file_systems
+from inventory import app_owner, iter_apps, iter_domains, iter_spaces, iter_user_profiles, paginate
+from manifest import add_manifest_arguments, manifest_domains, read_manifest
+from polling import wait_deleted
 
 os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
 
@@ -31,21 +38,24 @@ def delete_lambda_functions(client, domain_name):
 
 def delete_network_interfaces(client, domain_name):
     
-    interfaces = client.describe_network_interfaces()
-    for interface in interfaces['NetworkInterfaces']:
-        for group in interface['Groups']:
-            if domain_name in group['GroupName']:
-                print(f"Deleting Network Interface: {interface['NetworkInterfaceId']}")
-                client.delete_network_interface(NetworkInterfaceId=interface['NetworkInterfaceId'])
+    # EC2 matches the security-group name, instead of us paging through every ENI of the account
+    interfaces = paginate(client, 'describe_network_interfaces', 'NetworkInterfaces',
+                          Filters=[group_name_filter(domain_name)])
+    for interface in interfaces:
+        print(f"Deleting Network Interface: {interface['NetworkInterfaceId']}")
+        client.delete_network_interface(NetworkInterfaceId=interface['NetworkInterfaceId'])
 
 def delete_efs_volumes(client, domain_id):
     
     volumes = client.describe_file_systems()
+    file_system_ids = []
     for volume in volumes['FileSystems']:
         for tag in volume['Tags']:
             if domain_id in tag['Value']:
                 print(f"Deleting EFS Volume: {volume['FileSystemId']}")
-                client.delete_file_system(FileSystemId=volume['FileSystemId'])
+                file_system_ids.append(volume['FileSystemId'])
+    # Mount targets go first, then every volume at once
+    delete_file_systems(client, file_system_ids)
 
 def delete_domain_resources(client, domain_id, domain_name):
     
@@ -60,7 +70,20 @@ def delete_domain(client, domain_id, domain_name, dry_run=False):
     for app in apps['Apps']:
         print(f"Deleting App: {app['AppName']}")
         if not dry_run:
-            client.delete_app(DomainId=domain_id, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName'])
+            client.delete_app(DomainId=domain_id, AppType=app['AppType'], AppName=app['AppName'], **app_owner(app))
+
+    # Like the graph teardown: apps, then spaces, then user profiles, each once the previous are gone
+    if not dry_run:
+        wait_deleted(lambda: iter_apps(client, domain_id))
+
+    # Delete Spaces
+    for space in iter_spaces(client, domain_id):
+        print(f"Deleting Space: {space['SpaceName']}")
+        if not dry_run:
+            client.delete_space(DomainId=domain_id, SpaceName=space['SpaceName'])
+
+    if not dry_run:
+        wait_deleted(lambda: iter_spaces(client, domain_id))
 
     # Delete User Profiles
     user_profiles = client.list_user_profiles(DomainIdEquals=domain_id)
@@ -69,6 +92,9 @@ def delete_domain(client, domain_id, domain_name, dry_run=False):
         if not dry_run:
             client.delete_user_profile(DomainId=domain_id, UserProfileName=user_profile['UserProfileName'])
 
+    if not dry_run:
+        wait_deleted(lambda: iter_user_profiles(client, domain_id))
+
     # Delete Domain Resources
     print(f"Deleting Resources Associated with Domain: {domain_id}")
     delete_domain_resources(client, domain_id, domain_name)
@@ -89,24 +115,32 @@ def parse_arguments():
     parser.add_argument('--project-id', help="Project ID suffix to filter domains")
     parser.add_argument('--domain-ids', help="Comma-separated list of domain IDs to delete")
     parser.add_argument('--dry-run', action='store_true', help="Perform a dry run without deleting resources")
+    add_manifest_arguments(parser)
+    add_client_arguments(parser)
     return parser.parse_args()
 
 if __name__ == '__main__':
     # Assuming csp.login() is defined elsewhere
-    csp.login()
+    cached_login(csp.login)
 
     args = parse_arguments()
-    client = {
-        'sagemaker': boto3.client('sagemaker'),
-        'lambda': boto3.client('lambda'),
-        'ec2': boto3.client('ec2'),
-        'efs': boto3.client('efs')
-    }
+    factory = factory_from_args(args)
+    client = factory.clients('sagemaker', 'lambda', 'ec2', 'efs')
 
     # List all domain IDs and names
     list_all_domains(client['sagemaker'])
 
-    if args.project_id:
+    if args.manifest:
+        def list_target_domains(target):
+            role_arn, region = target
+            if role_arn or region != factory.region:
+                raise ValueError("only the current account and region are torn down here, use ss.py for other targets")
+            return iter_domains(client['sagemaker'])
+
+        # Rows are resolved as the manifest is read, so deletion starts before the whole file is parsed
+        filtered_domains = manifest_domains(read_manifest(args.manifest, args.manifest_format), list_target_domains,
+                                            factory.region)
+    elif args.project_id:
         # Filter domain IDs with project_id as suffix
         filtered_domains = filter_domain_id_with_project_id(client['sagemaker'], args.project_id)
         if not filtered_domains:
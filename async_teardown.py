@@ -0,0 +1,472 @@
+"""
+Asyncio teardown of SageMaker domains.
+
+Runs the same dependency-graph teardown as ss.py, but every delete and
+status poll is a coroutine on one event loop instead of a thread per domain,
+so thousands of resources can be polled at once. The number of API calls in
+flight is bounded by --concurrency, and concurrent pollers of one domain's
+apps, user profiles or spaces share one list call per polling interval.
+
+Needs aiobotocore, which the other entry points do not:
+
+    pip install aiobotocore
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import time
+
+import botocore.exceptions
+import csp
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    AioConfig = get_session = None
+
+from aws_clients import add_client_arguments
+from credential_cache import cached_login
+from discovery import (BACKENDS, DOMAIN_ARN_TAG, RESOURCE_TYPES, SCAN, TAG_FILTER_MAX_VALUES, TAGGING_PAGE_SIZE,
+                       TAGS, ResourceIndex, boundary_group_id, network_interface_filters, untagged_domains)
+from events import (ALREADY_DELETING, DELETE_FAILED, DELETE_ISSUED, DELETED, add_event_arguments,
+                    events_from_args)
+from inventory import DEFAULT_PAGE_SIZE
+from metrics import run_metrics
+from plan import print_plan
+from polling import DEFAULT_BASE_DELAY, DEFAULT_DEADLINE, DELETED_STATUSES, GONE, Backoff
+from rate_limit import rate_limiter_from_args
+from teardown_graph import (DELETING_STATUSES, FAILED, MAX_DELETE_ATTEMPTS, PENDING, RETRY_STATUSES, dependency_waves,
+                            domain_resources, is_not_found)
+from teardown_pool import print_summary
+
+os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
+
+DEFAULT_CONCURRENCY = 200
+SERVICES = ('sagemaker', 'ec2', 'efs', 'resourcegroupstaggingapi', 'sts')
+
+DELETE_OPERATIONS = {
+    'app': ('sagemaker', 'delete_app'),
+    'user_profile': ('sagemaker', 'delete_user_profile'),
+    'space': ('sagemaker', 'delete_space'),
+    'domain': ('sagemaker', 'delete_domain'),
+    'eni': ('ec2', 'delete_network_interface'),
+    'mount_target': ('efs', 'delete_mount_target'),
+    'efs': ('efs', 'delete_file_system'),
+    'lambda': ('lambda', 'delete_function'),
+}
+
+LISTINGS = {
+    'app': ('list_apps', 'Apps',
+            lambda app: (app.get('SpaceName') or app.get('UserProfileName'), app['AppType'], app['AppName'])),
+    'user_profile': ('list_user_profiles', 'UserProfiles', lambda user_profile: user_profile['UserProfileName']),
+    'space': ('list_spaces', 'Spaces', lambda space: space['SpaceName']),
+}
+
+
+class AsyncDomainStatus:
+    """Statuses of a domain's apps, user profiles and spaces, listed at most once per interval."""
+
+    def __init__(self, engine, domain_id, max_age=DEFAULT_BASE_DELAY):
+        """
+        Args:
+            engine (AsyncTeardown): Engine issuing the list calls.
+            domain_id (str): Domain ID.
+            max_age (float): Seconds a listing is reused for by other pollers.
+        """
+        self.engine = engine
+        self.domain_id = domain_id
+        self.max_age = max_age
+        self._listings = {}
+        self._locks = {kind: asyncio.Lock() for kind in LISTINGS}
+
+    async def status(self, kind, key):
+        """Return the status of an app, user profile or space, or GONE."""
+        operation, result_key, item_key = LISTINGS[kind]
+        async with self._locks[kind]:
+            listed = self._listings.get(kind)
+            if listed is None or time.monotonic() - listed[0] >= self.max_age:
+                items = await self.engine.list('sagemaker', operation, result_key, DomainIdEquals=self.domain_id)
+                self._listings[kind] = (time.monotonic(), {item_key(item): item['Status'] for item in items})
+        status = self._listings[kind][1].get(key, GONE)
+        return GONE if status in DELETED_STATUSES else status
+
+
+class AsyncTeardown:
+    """Tears down domains on one event loop with a bounded number of API calls in flight."""
+
+    def __init__(self, clients, page_size=DEFAULT_PAGE_SIZE, deadline=DEFAULT_DEADLINE,
+                 concurrency=DEFAULT_CONCURRENCY, events=None):
+        """
+        Args:
+            clients (dict): aiobotocore clients keyed by service name.
+            page_size (int): Number of items requested per list page.
+            deadline (int): Seconds to wait for a domain's resources to be deleted.
+            concurrency (int): Maximum number of API calls in flight.
+            events (EventStream): Stream recording every resource state change, if any.
+        """
+        self.clients = clients
+        self.page_size = page_size
+        self.deadline = deadline
+        self.events = events
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(self, service, operation, **kwargs):
+        """Call an API operation once a concurrency slot is free."""
+        async with self._semaphore:
+            return await getattr(self.clients[service], operation)(**kwargs)
+
+    async def list(self, service, operation, result_key, page_size=None, **kwargs):
+        """Return every item of a paginated operation."""
+        paginator = self.clients[service].get_paginator(operation)
+        items = []
+        async with self._semaphore:
+            async for page in paginator.paginate(PaginationConfig={'PageSize': page_size or self.page_size},
+                                                 **kwargs):
+                items.extend(page.get(result_key, []))
+        return items
+
+    async def select_domains(self, project_id=None, domain_ids=None):
+        """
+        Return the domains to tear down.
+
+        Args:
+            project_id (str): Keep domains whose name ends with the project ID.
+            domain_ids: Domain IDs to describe instead of listing every domain.
+
+        Returns:
+            list: Dictionaries with DomainId and DomainName.
+        """
+        if project_id:
+            return [{'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']}
+                    for domain in await self.list('sagemaker', 'list_domains', 'Domains')
+                    if domain['DomainName'].endswith(project_id)]
+
+        async def describe(domain_id):
+            try:
+                response = await self.call('sagemaker', 'describe_domain', DomainId=domain_id)
+            except botocore.exceptions.ClientError as e:
+                print(f"Error retrieving domain information for domain ID {domain_id}: {e}")
+                return None
+            return {'DomainId': domain_id, 'DomainName': response.get('DomainName')}
+
+        domains = await asyncio.gather(*(describe(domain_id) for domain_id in domain_ids))
+        return [domain for domain in domains if domain is not None]
+
+    async def build_index(self, domain_ids, backend=SCAN):
+        """
+        Find the ENIs and EFS volumes of all domains at once, like discovery.build_index.
+
+        ENIs are found with server-side EC2 filters, scoped by the VPCs and
+        subnets describe_domain reports. With the tagging backend the EFS
+        scan is still merged in when a domain has no tagged volume.
+
+        Args:
+            domain_ids: IDs of the target domains.
+            backend (str): 'tags' or 'scan'.
+
+        Returns:
+            ResourceIndex: The populated index.
+        """
+        index = ResourceIndex()
+        domains = await self.describe_domain_networks(domain_ids)
+        await self.index_network_interfaces(index, domains)
+        if backend == TAGS:
+            try:
+                domain_arns = [domain['DomainArn'] for domain in domains]
+                resource_types = [RESOURCE_TYPES['efs']]
+                chunks = await asyncio.gather(*(
+                    self.list('resourcegroupstaggingapi', 'get_resources', 'ResourceTagMappingList',
+                              TAGGING_PAGE_SIZE,
+                              TagFilters=[{'Key': DOMAIN_ARN_TAG, 'Values': domain_arns[i:i + TAG_FILTER_MAX_VALUES]}],
+                              ResourceTypeFilters=resource_types)
+                    for i in range(0, len(domain_arns), TAG_FILTER_MAX_VALUES)))
+                for mappings in chunks:
+                    for mapping in mappings:
+                        index.add_tagged_resource(mapping)
+                untagged = untagged_domains(index, domain_arns)
+                if not untagged:
+                    return index
+                print(f"Warning: no EFS volumes are tagged {DOMAIN_ARN_TAG} for domains {', '.join(untagged)}; "
+                      f"scanning the account as well")
+            except botocore.exceptions.ClientError as e:
+                print(f"Tag-based discovery failed, falling back to scanning the account: {e}")
+        scanned = ResourceIndex()
+        for volume in await self.list('efs', 'describe_file_systems', 'FileSystems'):
+            scanned.add_efs_volume(volume)
+        index.update(scanned)
+        return index
+
+    async def describe_domain_networks(self, domain_ids):
+        """Describe the domains' VPCs and subnets, like discovery.describe_domain_networks."""
+        account_id = (await self.call('sts', 'get_caller_identity'))['Account']
+        region = self.clients['sagemaker'].meta.region_name
+
+        async def describe(domain_id):
+            domain = {'DomainId': domain_id,
+                      'DomainArn': f"arn:aws:sagemaker:{region}:{account_id}:domain/{domain_id}"}
+            try:
+                response = await self.call('sagemaker', 'describe_domain', DomainId=domain_id)
+            except botocore.exceptions.ClientError as e:
+                print(f"Could not describe domain {domain_id}, searching its ENIs in every VPC: {e}")
+            else:
+                domain.update({key: response[key] for key in ('VpcId', 'SubnetIds', 'DomainSettings') if key in response})
+            return domain
+
+        return await asyncio.gather(*(describe(domain_id) for domain_id in domain_ids))
+
+    async def index_network_interfaces(self, index, domains):
+        """Index the domains' ENIs, found with the filters of discovery.network_interface_filters."""
+        domains_by_group_id = {boundary_group_id(domain): domain['DomainId']
+                               for domain in domains if boundary_group_id(domain)}
+        listings = await asyncio.gather(*(
+            self.list('ec2', 'describe_network_interfaces', 'NetworkInterfaces', Filters=filters)
+            for filters in network_interface_filters(domains)))
+        interfaces = {interface['NetworkInterfaceId']: interface for listing in listings for interface in listing}
+        for interface in interfaces.values():
+            index.add_network_interface(interface, domains_by_group_id)
+
+    async def discover_domain_resources(self, domain_id, index):
+        """List a domain's resources, see teardown_graph.domain_resources."""
+        user_profiles, spaces, apps = await asyncio.gather(
+            self.list('sagemaker', 'list_user_profiles', 'UserProfiles', DomainIdEquals=domain_id),
+            self.list('sagemaker', 'list_spaces', 'Spaces', DomainIdEquals=domain_id),
+            self.list('sagemaker', 'list_apps', 'Apps', DomainIdEquals=domain_id))
+        file_system_ids = index.efs_volumes(domain_id)
+        mount_targets = await asyncio.gather(*(self.list_mount_targets(file_system_id)
+                                               for file_system_id in file_system_ids))
+        return domain_resources(domain_id, user_profiles, spaces, apps,
+                                index.network_interfaces(domain_id), file_system_ids,
+                                mount_targets=[mount_target for chunk in mount_targets for mount_target in chunk])
+
+    async def list_mount_targets(self, file_system_id):
+        """Return the mount targets of an EFS file system, none if it is already gone."""
+        try:
+            return await self.list('efs', 'describe_mount_targets', 'MountTargets', FileSystemId=file_system_id)
+        except botocore.exceptions.ClientError as e:
+            if is_not_found(e):
+                return []
+            raise
+
+    async def _describe_status(self, service, operation, extract, **kwargs):
+        try:
+            status = extract(await self.call(service, operation, **kwargs))
+        except botocore.exceptions.ClientError as e:
+            if is_not_found(e):
+                return GONE
+            raise
+        return GONE if status in DELETED_STATUSES else status
+
+    async def _status(self, resource, domain_status):
+        kind, key = resource['kind'], resource['key']
+        if kind == 'app':
+            owner = key.get('SpaceName') or key.get('UserProfileName')
+            return await domain_status.status(kind, (owner, key['AppType'], key['AppName']))
+        if kind == 'user_profile':
+            return await domain_status.status(kind, key['UserProfileName'])
+        if kind == 'space':
+            return await domain_status.status(kind, key['SpaceName'])
+        if kind == 'domain':
+            return await self._describe_status('sagemaker', 'describe_domain', lambda r: r['Status'], **key)
+        if kind == 'mount_target':
+            return await self._describe_status(
+                'efs', 'describe_mount_targets',
+                lambda r: r['MountTargets'][0]['LifeCycleState'] if r['MountTargets'] else GONE,
+                MountTargetId=key['MountTargetId'])
+        if kind == 'efs':
+            return await self._describe_status(
+                'efs', 'describe_file_systems',
+                lambda r: r['FileSystems'][0]['LifeCycleState'] if r['FileSystems'] else GONE, **key)
+        return GONE
+
+    def _emit(self, event, domain_id, resource, **fields):
+        if self.events is not None:
+            self.events.emit(event, domain_id, resource['id'], resource['kind'], **fields)
+
+    async def _delete(self, resource):
+        """Issue the delete call; return False if the resource was already gone."""
+        service, operation = DELETE_OPERATIONS[resource['kind']]
+        kwargs = dict(resource['key'])
+        if resource['kind'] == 'domain':
+            kwargs['RetentionPolicy'] = {'HomeEfsFileSystem': 'Delete'}
+        elif resource['kind'] == 'mount_target':
+            # FileSystemId is only in the key for polling
+            kwargs.pop('FileSystemId')
+        print(f"Deleting {resource['id']}")
+        try:
+            await self.call(service, operation, **kwargs)
+        except botocore.exceptions.ClientError as e:
+            if is_not_found(e):
+                return False
+            raise
+        return True
+
+    async def _delete_and_wait(self, resource, domain_status, expires_at):
+        status = resource['status']
+        if status == GONE or status in DELETED_STATUSES:
+            return
+        attempts = 0
+        if status not in DELETING_STATUSES:
+            if not await self._delete(resource):
+                return
+            attempts = 1
+            self._emit(DELETE_ISSUED, domain_status.domain_id, resource)
+        else:
+            self._emit(ALREADY_DELETING, domain_status.domain_id, resource)
+        backoff = Backoff(deadline=max(expires_at - time.monotonic(), 0.001))
+        while True:
+            await asyncio.sleep(backoff.next_wait())
+            status = await self._status(resource, domain_status)
+            if status == GONE:
+                print(f"Deleted {resource['id']}")
+                return
+            if status in RETRY_STATUSES:
+                if attempts >= MAX_DELETE_ATTEMPTS:
+                    raise RuntimeError(f"status {status} after {attempts} delete attempts")
+                await self._delete(resource)
+                attempts += 1
+                self._emit(DELETE_ISSUED, domain_status.domain_id, resource)
+
+    async def _teardown_node(self, resource, states, errors, done, domain_status, expires_at):
+        node_id = resource['id']
+        try:
+            after = [dep for dep in resource['after'] if dep in done]
+            await asyncio.gather(*(done[dep].wait() for dep in after))
+            if any(states[dep] != GONE for dep in after):
+                # A predecessor failed; the node stays pending and is reported as blocked
+                return
+            await self._delete_and_wait(resource, domain_status, expires_at)
+            states[node_id] = GONE
+            self._emit(DELETED, domain_status.domain_id, resource)
+        except Exception as e:
+            # Any error fails this node only, as in the threaded engine; its siblings carry on
+            states[node_id] = FAILED
+            errors[node_id] = str(e)
+            self._emit(DELETE_FAILED, domain_status.domain_id, resource, error=str(e))
+        finally:
+            done[node_id].set()
+
+    async def teardown_domain(self, domain, index, dry_run=False):
+        """
+        Tear down one domain, starting every resource as soon as its predecessors are gone.
+
+        Args:
+            domain (dict): Domain with DomainId and DomainName.
+            index (ResourceIndex): ENIs and EFS volumes of the target domains.
+            dry_run (bool): If True, only print what would be deleted.
+
+        Returns:
+            dict: 'deleted' node IDs, 'failed' (node ID -> error) and 'blocked' node IDs.
+        """
+        domain_id = domain['DomainId']
+        resources = await self.discover_domain_resources(domain_id, index)
+        if self.events is not None:
+            self.events.discovered(domain_id, resources)
+        if dry_run:
+            print_plan({
+                'DomainId': domain_id,
+                'DomainName': domain.get('DomainName'),
+                'order': dependency_waves({resource['id']: resource['after'] for resource in resources}),
+                'resources': resources,
+            })
+            return {'deleted': [], 'failed': {}, 'blocked': []}
+
+        states = {resource['id']: PENDING for resource in resources}
+        errors = {}
+        done = {resource['id']: asyncio.Event() for resource in resources}
+        domain_status = AsyncDomainStatus(self, domain_id)
+        expires_at = time.monotonic() + self.deadline
+        await asyncio.gather(*(self._teardown_node(resource, states, errors, done, domain_status, expires_at)
+                               for resource in resources))
+        result = {
+            'deleted': [node_id for node_id, state in states.items() if state == GONE],
+            'failed': errors,
+            'blocked': [node_id for node_id, state in states.items() if state == PENDING],
+        }
+        if result['failed'] or result['blocked']:
+            raise RuntimeError(f"{len(result['failed'])} resources failed, {len(result['blocked'])} blocked: {result['failed']}")
+        return result
+
+    async def run_teardowns(self, domains, index, dry_run=False):
+        """
+        Tear down every domain concurrently; a failure in one never stops the others.
+
+        Returns:
+            dict: Summary in the format of teardown_pool.run_teardowns.
+        """
+        results = await asyncio.gather(*(self.teardown_domain(domain, index, dry_run) for domain in domains),
+                                       return_exceptions=True)
+        summary = {'succeeded': {}, 'failed': {}}
+        for domain, result in zip(domains, results):
+            if isinstance(result, Exception):
+                print(f"Error tearing down domain {domain['DomainId']}: {result}")
+                summary['failed'][domain['DomainId']] = str(result)
+            else:
+                summary['succeeded'][domain['DomainId']] = result
+        return summary
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Delete SageMaker domains on an asyncio event loop")
+    parser.add_argument('--project-id', default=os.getenv('PROJECT_ID'), help="Project ID suffix to filter domains (defaults to $PROJECT_ID)")
+    parser.add_argument('--domain-ids', type=str, default=None, help="Comma-separated list of domain IDs to delete")
+    parser.add_argument('--dry-run', action='store_true', help="List what would be deleted, in dependency order, without deleting anything")
+    parser.add_argument('--page-size', type=int, default=int(os.getenv('PAGE_SIZE', DEFAULT_PAGE_SIZE)), help="Number of items requested per list page")
+    parser.add_argument('--poll-deadline', type=int, default=DEFAULT_DEADLINE, help="Seconds to wait for a domain's resources to be deleted")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Maximum number of AWS API calls in flight")
+    parser.add_argument('--discovery', choices=BACKENDS, default=SCAN, help="Find ENIs and EFS volumes by scanning the account ('scan') or through the tagging API ('tags'), which scans as well when a domain has nothing tagged")
+    add_client_arguments(parser)
+    add_event_arguments(parser)
+    return parser.parse_args()
+
+
+async def main(args):
+    config = AioConfig(
+        max_pool_connections=args.max_pool_connections,
+        retries={'mode': args.retry_mode, 'max_attempts': args.max_attempts},
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+    )
+    session = get_session()
+    rate_limiter = rate_limiter_from_args(args)
+    metrics = run_metrics(args.metrics_out)
+    async with contextlib.AsyncExitStack() as stack:
+        clients = {service: await stack.enter_async_context(session.create_client(
+            service, region_name=os.environ['AWS_DEFAULT_REGION'], config=config)) for service in SERVICES}
+        if rate_limiter is not None:
+            for client in clients.values():
+                rate_limiter.register(client, asynchronous=True)
+        if metrics is not None:
+            for client in clients.values():
+                metrics.register(client)
+        engine = AsyncTeardown(clients, args.page_size, args.poll_deadline, args.concurrency, events_from_args(args))
+
+        domain_ids = [domain_id.strip() for domain_id in args.domain_ids.split(',')] if args.domain_ids else None
+        domains = await engine.select_domains(args.project_id, domain_ids)
+        if not domains:
+            print("No domains found to delete.")
+            return True
+
+        index = await engine.build_index([domain['DomainId'] for domain in domains], args.discovery)
+        summary = await engine.run_teardowns(domains, index, args.dry_run)
+        print_summary(summary)
+        if rate_limiter is not None:
+            rate_limiter.print_report()
+        if args.dry_run:
+            print("Dry run completed. No resources were deleted.")
+        return not summary['failed']
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if get_session is None:
+        print("Error: the asyncio engine needs aiobotocore (pip install aiobotocore).")
+        exit(1)
+    if not args.project_id and not args.domain_ids:
+        print("Please provide either --project-id or --domain-ids argument.")
+        exit(1)
+
+    cached_login(csp.login)
+    if not asyncio.run(main(args)):
+        exit(1)
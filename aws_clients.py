@@ -0,0 +1,264 @@
+"""
+Shared boto3 session and client factory for the teardown entry points.
+
+One factory is created per run. It caches a client per service and region,
+resolves the account ID and region once, and applies the run-level botocore
+settings (connection pool size, retry mode, timeouts) to every client so that
+parallel workers reuse warm HTTPS connections. Every client also goes through
+the run's shared rate limiter, if one is configured.
+
+Other accounts are reached through assume_role(), which returns a factory per
+role whose temporary credentials botocore refreshes shortly before they
+expire.
+
+Every client is also measured by the run's API metrics collector, if
+--metrics-out or $METRICS_OUT names an output file.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
+
+from metrics import add_metrics_arguments, run_metrics
+from rate_limit import add_rate_limit_arguments, rate_limiter_from_args
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+DEFAULT_RETRY_MODE = 'adaptive'
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+ALL_REGIONS = 'all'
+DEFAULT_ROLE_SESSION_NAME = 'sagemaker-teardown'
+DEFAULT_ROLE_DURATION = 3600
+
+
+class ClientFactory:
+    """Creates and caches boto3 clients that share one session and config."""
+
+    def __init__(self, region=None, session=None,
+                 max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+                 retry_mode=DEFAULT_RETRY_MODE,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 rate_limiter=None,
+                 metrics=None):
+        """
+        Args:
+            region (str): Default region; falls back to the session's region.
+            session: Boto3 session to use; a new one is created if None.
+            max_pool_connections (int): HTTPS connections kept per client.
+            retry_mode (str): botocore retry mode ('adaptive', 'standard' or 'legacy').
+            max_attempts (int): Maximum attempts per API call, retries included.
+            connect_timeout (int): Seconds to wait for a connection.
+            read_timeout (int): Seconds to wait for a response.
+            rate_limiter (RateLimiter): Limiter every client's requests go through, if any.
+            metrics (ApiMetrics): Collector measuring every client's calls; defaults
+                to the run's shared one, if an output file is configured.
+        """
+        self.session = session or boto3.session.Session(region_name=region)
+        self.region = region or self.session.region_name
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={'mode': retry_mode, 'max_attempts': max_attempts},
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+        )
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics if metrics is not None else run_metrics()
+        self._clients = {}
+        self._account_id = None
+        self._limiter_account = None
+        self._limiter_resolved = False
+        self._assumed = {}
+        self._lock = threading.Lock()
+        self._assume_lock = threading.Lock()
+        self._limiter_lock = threading.Lock()
+
+    def client(self, service, region=None):
+        """
+        Return the cached client for a service and region, creating it once.
+
+        Args:
+            service (str): Service name, e.g. 'sagemaker'.
+            region (str): Region; defaults to the factory's region.
+        """
+        key = (service, region or self.region)
+        with self._lock:
+            if key in self._clients:
+                return self._clients[key]
+        # Resolved before the first client is registered, so all of them share the account's buckets
+        account_id = self._limiter_account_id() if self.rate_limiter is not None else None
+        with self._lock:
+            if key not in self._clients:
+                client = self.session.client(service, region_name=key[1], config=self.config)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.register(client, account_id)
+                if self.metrics is not None:
+                    self.metrics.register(client)
+                self._clients[key] = client
+            return self._clients[key]
+
+    def clients(self, *services, region=None):
+        """Return a dictionary of clients for one region keyed by service name."""
+        return {service: self.client(service, region) for service in services}
+
+    @property
+    def account_id(self):
+        """AWS account ID of the session, resolved once."""
+        if self._account_id is None:
+            # A client of its own, since client() needs the account to register with the rate limiter
+            sts = self.session.client('sts', region_name=self.region, config=self.config)
+            if self.metrics is not None:
+                self.metrics.register(sts)
+            account_id = sts.get_caller_identity()['Account']
+            with self._lock:
+                self._account_id = account_id
+        return self._account_id
+
+    def _limiter_account_id(self):
+        # The rate limiter scope of every client: the account, or None for all of them if it cannot be resolved
+        with self._limiter_lock:
+            if not self._limiter_resolved:
+                try:
+                    self._limiter_account = self.account_id
+                except Exception as e:
+                    print(f"Could not resolve the account ID, rate limiting without it: {e}")
+                    self._limiter_account = None
+                self._limiter_resolved = True
+            return self._limiter_account
+
+    def assume_role(self, role_arn, session_name=DEFAULT_ROLE_SESSION_NAME, duration=DEFAULT_ROLE_DURATION):
+        """
+        Return a factory whose clients act as the given role, created once per role.
+
+        The role's temporary credentials are cached and refreshed by botocore
+        shortly before they expire, so a long teardown never runs on expired
+        credentials and short ones assume each role only once.
+
+        Args:
+            role_arn (str): ARN of the role to assume, e.g. in another account.
+            session_name (str): Role session name recorded in CloudTrail.
+            duration (int): Lifetime of each set of credentials, in seconds.
+
+        Returns:
+            ClientFactory: Factory sharing this one's region, config, rate limiter and metrics.
+        """
+        with self._assume_lock:
+            if role_arn not in self._assumed:
+                sts = self.client('sts')
+
+                def refresh():
+                    credentials = sts.assume_role(RoleArn=role_arn, RoleSessionName=session_name,
+                                                  DurationSeconds=duration)['Credentials']
+                    return {
+                        'access_key': credentials['AccessKeyId'],
+                        'secret_key': credentials['SecretAccessKey'],
+                        'token': credentials['SessionToken'],
+                        'expiry_time': credentials['Expiration'].isoformat(),
+                    }
+
+                botocore_session = botocore.session.get_session()
+                botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+                    refresh(), refresh, 'sts-assume-role')
+                factory = ClientFactory(self.region, boto3.session.Session(botocore_session=botocore_session),
+                                        rate_limiter=self.rate_limiter, metrics=self.metrics)
+                factory.config = self.config
+                factory._account_id = role_arn.split(':')[4]
+                self._assumed[role_arn] = factory
+            return self._assumed[role_arn]
+
+    def domain_arn(self, domain_id, region=None):
+        """Return the ARN of a SageMaker domain in this account and the given or default region."""
+        return f"arn:aws:sagemaker:{region or self.region}:{self.account_id}:domain/{domain_id}"
+
+    def enabled_regions(self):
+        """Return the regions enabled for the account."""
+        response = self.client('ec2').describe_regions(
+            Filters=[{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}])
+        return sorted(region['RegionName'] for region in response['Regions'])
+
+    def regions(self, value=None):
+        """
+        Resolve a --regions value.
+
+        Args:
+            value (str): Comma-separated regions, 'all' for every enabled
+                region, or None for the factory's region.
+
+        Returns:
+            list: Region names.
+        """
+        if not value:
+            return [self.region]
+        if value == ALL_REGIONS:
+            return self.enabled_regions()
+        return [region.strip() for region in value.split(',') if region.strip()]
+
+
+def fan_out(func, items):
+    """
+    Call ``func(item)`` for every item, e.g. region or account, concurrently.
+
+    Returns:
+        dict: Item -> result, in the order of ``items``.
+    """
+    items = list(items)
+    with ThreadPoolExecutor(max_workers=max(1, len(items))) as executor:
+        return dict(zip(items, executor.map(func, items)))
+
+
+def add_client_arguments(parser):
+    """Add the run-level botocore settings to an argparse parser."""
+    parser.add_argument('--max-pool-connections', type=int, default=DEFAULT_MAX_POOL_CONNECTIONS, help="HTTPS connections kept open per AWS client")
+    parser.add_argument('--retry-mode', default=DEFAULT_RETRY_MODE, choices=['adaptive', 'standard', 'legacy'], help="botocore retry mode")
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help="Maximum attempts per AWS API call")
+    parser.add_argument('--connect-timeout', type=int, default=DEFAULT_CONNECT_TIMEOUT, help="Seconds to wait for a connection to AWS")
+    parser.add_argument('--read-timeout', type=int, default=DEFAULT_READ_TIMEOUT, help="Seconds to wait for an AWS response")
+    add_rate_limit_arguments(parser)
+    add_metrics_arguments(parser)
+
+
+def add_region_arguments(parser):
+    """Add the --regions option to an argparse parser."""
+    parser.add_argument('--regions', default=os.getenv('REGIONS'), help=f"Comma-separated regions to process concurrently, or '{ALL_REGIONS}' for every enabled region (defaults to $REGIONS, else $AWS_REGION)")
+
+
+def add_account_arguments(parser):
+    """Add the multi-account options to an argparse parser."""
+    parser.add_argument('--role-arns', default=os.getenv('ROLE_ARNS'), help="Comma-separated ARNs of roles to assume, one per account, or @FILE with one ARN per line (defaults to $ROLE_ARNS, else the current account only)")
+    parser.add_argument('--role-session-name', default=DEFAULT_ROLE_SESSION_NAME, help="Session name used when assuming the roles")
+
+
+def parse_role_arns(value):
+    """
+    Parse a --role-arns value.
+
+    Returns:
+        list: Role ARNs, or [None] for the current account only.
+    """
+    if not value:
+        return [None]
+    if value.startswith('@'):
+        with open(value[1:]) as f:
+            lines = [line.split('#', 1)[0].strip() for line in f]
+        return [line for line in lines if line]
+    return [role_arn.strip() for role_arn in value.split(',') if role_arn.strip()]
+
+
+def factory_from_args(args, region=None):
+    """Create a ClientFactory from arguments added by add_client_arguments."""
+    return ClientFactory(
+        region=region,
+        max_pool_connections=args.max_pool_connections,
+        retry_mode=args.retry_mode,
+        max_attempts=args.max_attempts,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        rate_limiter=rate_limiter_from_args(args),
+        metrics=run_metrics(args.metrics_out),
+    )
@@ -0,0 +1,548 @@
+"""
+Local benchmark of the teardown workflow against a simulated AWS account.
+
+SimulatedAccount keeps a synthetic account in memory: domains with user
+profiles, spaces and apps, plus the Lambda functions, network interfaces and
+EFS volumes that belong to them. It answers real boto3 clients through
+botocore's before-call event, the hook botocore's Stubber uses, so the
+teardown modules run unchanged, paginators and ClientErrors included, but
+nothing leaves the machine. Unlike Stubber it keeps state: deletes put a
+resource into 'Deleting' for a simulated latency before it disappears, and
+deleting a resource whose dependants still exist fails the way AWS does.
+
+Each scenario runs the same steps as ss.py, listing and filtering domains,
+indexing their ENIs, EFS volumes and Lambda functions, then either planning
+every domain (--dry-run) or tearing them all down on the worker pool, and
+reports wall time, API calls per operation and peak traced memory:
+
+    python benchmark.py --domains 20 --user-profiles 5 --apps 3 --deleting-latency 5
+"""
+import argparse
+import contextlib
+import fnmatch
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+from aws_clients import ClientFactory
+from discovery import BACKENDS, DOMAIN_ARN_TAG, SCAN, build_index
+from inventory import DEFAULT_PAGE_SIZE, iter_domains
+from plan import domain_plan
+from polling import DEFAULT_BASE_DELAY, DEFAULT_DEADLINE, DEFAULT_MAX_DELAY, Backoff
+from teardown_graph import discover_domain_resources, graph_from_resources
+from teardown_pool import DEFAULT_WORKERS, run_teardowns
+
+SERVICES = ('sagemaker', 'ec2', 'efs', 'lambda', 'resourcegroupstaggingapi')
+DEFAULT_REGION = 'us-east-1'
+DEFAULT_ACCOUNT_ID = '123456789012'
+DEFAULT_PROJECT_ID = 'bench'
+
+# Operation -> (request token, request page size, response token, result key)
+PAGING = {
+    'ListDomains': ('NextToken', 'MaxResults', 'NextToken', 'Domains'),
+    'ListApps': ('NextToken', 'MaxResults', 'NextToken', 'Apps'),
+    'ListUserProfiles': ('NextToken', 'MaxResults', 'NextToken', 'UserProfiles'),
+    'ListSpaces': ('NextToken', 'MaxResults', 'NextToken', 'Spaces'),
+    'DescribeNetworkInterfaces': ('NextToken', 'MaxResults', 'NextToken', 'NetworkInterfaces'),
+    'DescribeFileSystems': ('Marker', 'MaxItems', 'NextMarker', 'FileSystems'),
+    'DescribeMountTargets': ('Marker', 'MaxItems', 'NextMarker', 'MountTargets'),
+    'ListFunctions': ('Marker', 'MaxItems', 'NextMarker', 'Functions'),
+    'GetResources': ('PaginationToken', 'ResourcesPerPage', 'PaginationToken', 'ResourceTagMappingList'),
+}
+DEFAULT_PAGE_LIMIT = 50
+
+# Tables whose deletes go through 'Deleting' first, and the field holding their status
+STATUS_FIELDS = {
+    'domains': 'Status',
+    'user_profiles': 'Status',
+    'spaces': 'Status',
+    'apps': 'Status',
+    'file_systems': 'LifeCycleState',
+    'mount_targets': 'LifeCycleState',
+}
+# EFS spells its lifecycle states in lower case
+LOWER_CASE_STATUS_TABLES = ('file_systems', 'mount_targets')
+
+
+class SimulatedError(Exception):
+    """An AWS error response returned by the simulated account."""
+
+    def __init__(self, code, message, status_code=400):
+        super().__init__(message)
+        self.code = code
+        self.status_code = status_code
+
+
+class SimulatedAccount:
+    """In-memory SageMaker account that answers boto3 clients through botocore events."""
+
+    def __init__(self, region=DEFAULT_REGION, account_id=DEFAULT_ACCOUNT_ID, deleting_latency=0.0, seed=0):
+        """
+        Args:
+            region (str): Region the resources live in.
+            account_id (str): Account ID used in ARNs and by sts.get_caller_identity.
+            deleting_latency (float): Upper bound in seconds a delete stays 'Deleting';
+                each delete draws its latency from the upper half of it.
+            seed (int): Seed of the latency draws, so runs are repeatable.
+        """
+        self.region = region
+        self.account_id = account_id
+        self.deleting_latency = deleting_latency
+        self.calls = Counter()
+        self.tables = {name: {} for name in ('domains', 'user_profiles', 'spaces', 'apps',
+                                             'network_interfaces', 'file_systems', 'mount_targets', 'functions')}
+        self._gone_at = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def arn(self, service, resource):
+        return f"arn:aws:{service}:{self.region}:{self.account_id}:{resource}"
+
+    def populate(self, domains, user_profiles=0, spaces=0, apps=0, functions=0, network_interfaces=0,
+                 file_systems=0, mount_targets=0, unrelated_domains=0, unrelated_network_interfaces=0,
+                 project_id=DEFAULT_PROJECT_ID):
+        """
+        Create the synthetic account.
+
+        Args:
+            domains (int): Domains whose name ends with ``project_id``.
+            user_profiles (int): User profiles per domain.
+            spaces (int): Spaces per domain.
+            apps (int): Apps per user profile and per space.
+            functions (int): Lambda functions per domain.
+            network_interfaces (int): Network interfaces per domain.
+            file_systems (int): EFS volumes per domain.
+            mount_targets (int): Mount targets per EFS volume, one per subnet of the domain.
+            unrelated_domains (int): Empty domains of other projects, listed but never torn down.
+            unrelated_network_interfaces (int): Network interfaces of the account that belong to no domain.
+            project_id (str): Project ID suffix of the target domains.
+        """
+        names = [f"domain-{i}-{project_id}" for i in range(domains)]
+        names += [f"other-{i}-unrelated" for i in range(unrelated_domains)]
+        for i, domain_name in enumerate(names):
+            domain_id = f"d-bench{i:07d}"
+            domain_arn = self.arn('sagemaker', f"domain/{domain_id}")
+            vpc_id, subnet_id = f"vpc-{i:017x}", f"subnet-{i:017x}"
+            self.tables['domains'][domain_id] = {
+                'DomainId': domain_id, 'DomainName': domain_name, 'DomainArn': domain_arn, 'Status': 'InService',
+                'VpcId': vpc_id, 'SubnetIds': [subnet_id],
+                'DomainSettings': {'SecurityGroupIdForDomainBoundary': f"sg-b{i:016x}"}}
+            if i >= domains:
+                continue
+            owners = [('UserProfileName', f"user-{j}") for j in range(user_profiles)]
+            owners += [('SpaceName', f"space-{j}") for j in range(spaces)]
+            for owner_key, owner in owners:
+                table = 'user_profiles' if owner_key == 'UserProfileName' else 'spaces'
+                self.tables[table][(domain_id, owner)] = {'DomainId': domain_id, owner_key: owner, 'Status': 'InService'}
+                for k in range(apps):
+                    app_type = 'JupyterServer' if k == 0 else 'KernelGateway'
+                    app_name = 'default' if k == 0 else f"kernel-{k}"
+                    self.tables['apps'][(domain_id, owner, app_type, app_name)] = {
+                        'DomainId': domain_id, owner_key: owner, 'AppType': app_type, 'AppName': app_name,
+                        'Status': 'InService'}
+            domain_tag = [{'Key': DOMAIN_ARN_TAG, 'Value': domain_arn}]
+            for j in range(functions):
+                name = f"{domain_id}-function-{j}"
+                self.tables['functions'][name] = {
+                    'FunctionName': name, 'FunctionArn': self.arn('lambda', f"function:{name}"), 'Tags': domain_tag}
+            for j in range(network_interfaces):
+                interface_id = f"eni-{i:08x}{j:09x}"
+                self.tables['network_interfaces'][interface_id] = {
+                    'NetworkInterfaceId': interface_id, 'Status': 'in-use', 'TagSet': domain_tag,
+                    'VpcId': vpc_id, 'SubnetId': subnet_id,
+                    'Groups': [{'GroupId': f"sg-{i:017x}", 'GroupName': f"security-group-for-inbound-nfs-{domain_id}"}]}
+            for j in range(file_systems):
+                file_system_id = f"fs-{i:08x}{j:09x}"
+                self.tables['file_systems'][file_system_id] = {
+                    'FileSystemId': file_system_id, 'LifeCycleState': 'available',
+                    'Tags': [{'Key': 'ManagedByAmazonSageMakerResource', 'Value': domain_arn}] + domain_tag}
+                for k in range(mount_targets):
+                    mount_target_id = f"fsmt-{i:08x}{j:05x}{k:04x}"
+                    self.tables['mount_targets'][mount_target_id] = {
+                        'MountTargetId': mount_target_id, 'FileSystemId': file_system_id,
+                        'SubnetId': f"subnet-{k:017x}", 'LifeCycleState': 'available'}
+        for j in range(unrelated_network_interfaces):
+            interface_id = f"eni-ffffffff{j:09x}"
+            self.tables['network_interfaces'][interface_id] = {
+                'NetworkInterfaceId': interface_id, 'Status': 'in-use', 'TagSet': [],
+                'VpcId': 'vpc-shared', 'SubnetId': f"subnet-shared{j % 16:04x}",
+                'Groups': [{'GroupId': 'sg-shared', 'GroupName': 'shared-workloads'}]}
+
+    def attach(self, session):
+        """
+        Answer every client later created from a boto3 session from this account.
+
+        Args:
+            session: Boto3 session; clients copy its event handlers when created.
+        """
+        session.events.register('before-parameter-build', self._remember_params)
+        session.events.register('before-call', self._answer)
+
+    def session(self):
+        """Return a boto3 session with dummy credentials whose clients talk to this account."""
+        session = boto3.session.Session(aws_access_key_id='benchmark', aws_secret_access_key='benchmark',
+                                        region_name=self.region)
+        self.attach(session)
+        return session
+
+    def _remember_params(self, params, context, **kwargs):
+        # before-call only sees the serialised request, so keep the API parameters
+        context['simulated_params'] = dict(params)
+
+    def _answer(self, model, context, **kwargs):
+        service, operation = model.service_model.service_name, model.name
+        params = context.get('simulated_params', {})
+        with self._lock:
+            self.calls[f"{service}.{operation}"] += 1
+            try:
+                handler = getattr(self, f"_{service}_{operation}", None)
+                if handler is None:
+                    raise SimulatedError('UnsupportedOperation', f"{service}.{operation} is not simulated")
+                self._settle()
+                parsed = handler(params)
+                if operation in PAGING:
+                    parsed = self._page(operation, params, parsed)
+                status_code = 200
+            except SimulatedError as e:
+                parsed = {'Error': {'Code': e.code, 'Message': str(e)}}
+                status_code = e.status_code
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': status_code, 'RequestId': 'simulated'}
+        return AWSResponse(None, status_code, {}, None), parsed
+
+    def _page(self, operation, params, items):
+        token_in, limit_in, token_out, result_key = PAGING[operation]
+        start = int(params.get(token_in) or 0)
+        limit = params.get(limit_in) or DEFAULT_PAGE_LIMIT
+        response = {result_key: [dict(item) for item in items[start:start + limit]]}
+        if start + limit < len(items):
+            response[token_out] = str(start + limit)
+        return response
+
+    def _settle(self):
+        """Finish every delete whose latency has passed."""
+        now = time.monotonic()
+        for (table, key), gone_at in list(self._gone_at.items()):
+            if gone_at <= now:
+                del self._gone_at[(table, key)]
+                if table == 'apps':
+                    # Deleted apps stay listed for a while, as in AWS
+                    self.tables[table][key]['Status'] = 'Deleted'
+                else:
+                    del self.tables[table][key]
+
+    def _start_delete(self, table, key):
+        record = self.tables[table][key]
+        if record[STATUS_FIELDS[table]] in ('Deleting', 'deleting'):
+            return
+        record[STATUS_FIELDS[table]] = 'deleting' if table in LOWER_CASE_STATUS_TABLES else 'Deleting'
+        latency = self._random.uniform(self.deleting_latency / 2, self.deleting_latency)
+        self._gone_at[(table, key)] = time.monotonic() + latency
+
+    def _live(self, table, domain_id, owner=None):
+        """Return the domain's records in a table that are not deleted, optionally of one owner."""
+        return [record for key, record in self.tables[table].items()
+                if key[0] == domain_id and record.get('Status') != 'Deleted'
+                and (owner is None or owner in (record.get('UserProfileName'), record.get('SpaceName')))]
+
+    def _sagemaker_record(self, table, key, kind):
+        if key not in self.tables[table] or self.tables[table][key].get('Status') == 'Deleted':
+            raise SimulatedError('ResourceNotFound', f"{kind} {key} does not exist")
+        return self.tables[table][key]
+
+    def _by_domain(self, table, params):
+        return [record for key, record in self.tables[table].items() if key[0] == params.get('DomainIdEquals')]
+
+    def _sts_GetCallerIdentity(self, params):
+        return {'Account': self.account_id, 'Arn': self.arn('iam', 'user/benchmark'), 'UserId': 'benchmark'}
+
+    def _sagemaker_ListDomains(self, params):
+        return list(self.tables['domains'].values())
+
+    def _sagemaker_DescribeDomain(self, params):
+        return dict(self._sagemaker_record('domains', params['DomainId'], 'Domain'))
+
+    def _sagemaker_DeleteDomain(self, params):
+        domain_id = params['DomainId']
+        self._sagemaker_record('domains', domain_id, 'Domain')
+        if self._live('user_profiles', domain_id) or self._live('spaces', domain_id):
+            raise SimulatedError('ResourceInUse', f"Domain {domain_id} still has user profiles or spaces")
+        self._start_delete('domains', domain_id)
+        return {}
+
+    def _sagemaker_ListUserProfiles(self, params):
+        return self._by_domain('user_profiles', params)
+
+    def _sagemaker_ListSpaces(self, params):
+        return self._by_domain('spaces', params)
+
+    def _sagemaker_ListApps(self, params):
+        return self._by_domain('apps', params)
+
+    def _delete_owner(self, table, params, name_key, kind):
+        key = (params['DomainId'], params[name_key])
+        self._sagemaker_record(table, key, kind)
+        if self._live('apps', *key):
+            raise SimulatedError('ResourceInUse', f"{kind} {key[1]} still has apps")
+        self._start_delete(table, key)
+        return {}
+
+    def _sagemaker_DeleteUserProfile(self, params):
+        return self._delete_owner('user_profiles', params, 'UserProfileName', 'User profile')
+
+    def _sagemaker_DeleteSpace(self, params):
+        return self._delete_owner('spaces', params, 'SpaceName', 'Space')
+
+    def _sagemaker_DeleteApp(self, params):
+        owner = params.get('SpaceName') or params.get('UserProfileName')
+        key = (params['DomainId'], owner, params['AppType'], params['AppName'])
+        self._sagemaker_record('apps', key, 'App')
+        self._start_delete('apps', key)
+        return {}
+
+    def _ec2_DescribeNetworkInterfaces(self, params):
+        interface_ids = params.get('NetworkInterfaceIds')
+        if interface_ids:
+            missing = [interface_id for interface_id in interface_ids
+                       if interface_id not in self.tables['network_interfaces']]
+            if missing:
+                raise SimulatedError('InvalidNetworkInterfaceID.NotFound',
+                                     f"Network interfaces {', '.join(missing)} do not exist")
+            interfaces = [self.tables['network_interfaces'][interface_id] for interface_id in interface_ids]
+        else:
+            interfaces = self.tables['network_interfaces'].values()
+        return [interface for interface in interfaces
+                if all(self._matches(interface, f) for f in params.get('Filters', []))]
+
+    def _matches(self, interface, ec2_filter):
+        """Apply one EC2 filter: any of its values, with '*' and '?' wildcards, matches."""
+        name = ec2_filter['Name']
+        if name == 'group-name':
+            fields = [group['GroupName'] for group in interface['Groups']]
+        elif name == 'group-id':
+            fields = [group['GroupId'] for group in interface['Groups']]
+        elif name == 'vpc-id':
+            fields = [interface['VpcId']]
+        elif name == 'subnet-id':
+            fields = [interface['SubnetId']]
+        elif name.startswith('tag:'):
+            fields = [tag['Value'] for tag in interface['TagSet'] if tag['Key'] == name[len('tag:'):]]
+        else:
+            raise SimulatedError('InvalidParameterValue', f"The filter '{name}' is not simulated")
+        return any(fnmatch.fnmatchcase(field, value) for field in fields for value in ec2_filter['Values'])
+
+    def _ec2_DeleteNetworkInterface(self, params):
+        interface_id = params['NetworkInterfaceId']
+        interface = self.tables['network_interfaces'].get(interface_id)
+        if interface is None:
+            raise SimulatedError('InvalidNetworkInterfaceID.NotFound', f"Network interface {interface_id} does not exist")
+        if self._owning_domain(interface['TagSet']) in self.tables['domains']:
+            raise SimulatedError('InvalidNetworkInterface.InUse', f"Network interface {interface_id} is in use")
+        del self.tables['network_interfaces'][interface_id]
+        return {}
+
+    def _efs_DescribeFileSystems(self, params):
+        if 'FileSystemId' in params:
+            if params['FileSystemId'] not in self.tables['file_systems']:
+                raise SimulatedError('FileSystemNotFound', f"File system {params['FileSystemId']} does not exist", 404)
+            return [self.tables['file_systems'][params['FileSystemId']]]
+        return list(self.tables['file_systems'].values())
+
+    def _efs_DeleteFileSystem(self, params):
+        file_system_id = params['FileSystemId']
+        file_system = self.tables['file_systems'].get(file_system_id)
+        if file_system is None:
+            raise SimulatedError('FileSystemNotFound', f"File system {file_system_id} does not exist", 404)
+        if self._owning_domain(file_system['Tags']) in self.tables['domains']:
+            raise SimulatedError('FileSystemInUse', f"File system {file_system_id} is mounted by its domain", 409)
+        if any(mount_target['FileSystemId'] == file_system_id for mount_target in self.tables['mount_targets'].values()):
+            raise SimulatedError('FileSystemInUse', f"File system {file_system_id} still has mount targets", 409)
+        self._start_delete('file_systems', file_system_id)
+        return {}
+
+    def _efs_DescribeMountTargets(self, params):
+        if 'MountTargetId' in params:
+            if params['MountTargetId'] not in self.tables['mount_targets']:
+                raise SimulatedError('MountTargetNotFound', f"Mount target {params['MountTargetId']} does not exist", 404)
+            return [self.tables['mount_targets'][params['MountTargetId']]]
+        if params.get('FileSystemId') not in self.tables['file_systems']:
+            raise SimulatedError('FileSystemNotFound', f"File system {params.get('FileSystemId')} does not exist", 404)
+        return [mount_target for mount_target in self.tables['mount_targets'].values()
+                if mount_target['FileSystemId'] == params['FileSystemId']]
+
+    def _efs_DeleteMountTarget(self, params):
+        mount_target_id = params['MountTargetId']
+        if mount_target_id not in self.tables['mount_targets']:
+            raise SimulatedError('MountTargetNotFound', f"Mount target {mount_target_id} does not exist", 404)
+        self._start_delete('mount_targets', mount_target_id)
+        return {}
+
+    def _lambda_ListFunctions(self, params):
+        return [{'FunctionName': function['FunctionName'], 'FunctionArn': function['FunctionArn']}
+                for function in self.tables['functions'].values()]
+
+    def _lambda_GetFunction(self, params):
+        function = self.tables['functions'].get(params['FunctionName'])
+        if function is None:
+            raise SimulatedError('ResourceNotFoundException', f"Function {params['FunctionName']} does not exist", 404)
+        return {'Configuration': {'FunctionName': function['FunctionName'], 'FunctionArn': function['FunctionArn'],
+                                  'State': 'Active'}}
+
+    def _lambda_DeleteFunction(self, params):
+        if self.tables['functions'].pop(params['FunctionName'], None) is None:
+            raise SimulatedError('ResourceNotFoundException', f"Function {params['FunctionName']} does not exist", 404)
+        return {}
+
+    def _resourcegroupstaggingapi_GetResources(self, params):
+        domain_arns = {value for tag_filter in params.get('TagFilters', []) if tag_filter['Key'] == DOMAIN_ARN_TAG
+                       for value in tag_filter.get('Values', [])}
+        resource_types = params.get('ResourceTypeFilters') or []
+        tagged = []
+        if 'lambda:function' in resource_types:
+            tagged += [(function['FunctionArn'], function['Tags']) for function in self.tables['functions'].values()]
+        if 'ec2:network-interface' in resource_types:
+            tagged += [(self.arn('ec2', f"network-interface/{interface['NetworkInterfaceId']}"), interface['TagSet'])
+                       for interface in self.tables['network_interfaces'].values()]
+        if 'elasticfilesystem:file-system' in resource_types:
+            tagged += [(self.arn('elasticfilesystem', f"file-system/{volume['FileSystemId']}"), volume['Tags'])
+                       for volume in self.tables['file_systems'].values()]
+        return [{'ResourceARN': arn, 'Tags': tags} for arn, tags in tagged
+                if any(tag['Key'] == DOMAIN_ARN_TAG and tag['Value'] in domain_arns for tag in tags)]
+
+    def _owning_domain(self, tags):
+        return next((tag['Value'].rsplit('/', 1)[-1] for tag in tags if tag['Key'] == DOMAIN_ARN_TAG), None)
+
+    def remaining(self):
+        """Return how many resources of each kind are left, deleted apps and unrelated interfaces excluded."""
+        counts = {table: len(records) for table, records in self.tables.items()}
+        counts['apps'] = sum(1 for app in self.tables['apps'].values() if app['Status'] != 'Deleted')
+        counts['network_interfaces'] = sum(1 for interface in self.tables['network_interfaces'].values()
+                                           if self._owning_domain(interface['TagSet']))
+        return counts
+
+
+def find_target_domains(factory, args):
+    # Same listing and suffix filter as filter_domain_id_with_project_id in ss.py
+    return [{'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']}
+            for domain in iter_domains(factory.client('sagemaker'), args.page_size)
+            if domain['DomainName'].endswith(args.project_id)]
+
+
+def run_scenario(args, dry_run):
+    """
+    Build a fresh simulated account and run one scenario against it.
+
+    Returns:
+        dict: 'scenario', 'wall_time' (seconds), 'peak_memory' (bytes),
+        'calls' (operation -> count), 'domains' and, for teardowns, 'failed'
+        and the resources 'remaining' per kind.
+    """
+    account = SimulatedAccount(args.region, deleting_latency=args.deleting_latency, seed=args.seed)
+    account.populate(args.domains, args.user_profiles, args.spaces, args.apps, args.functions,
+                     args.network_interfaces, args.file_systems, args.mount_targets, args.unrelated_domains,
+                     args.unrelated_network_interfaces, args.project_id)
+    factory = ClientFactory(args.region, session=account.session())
+    clients = factory.clients(*SERVICES)
+    output = None if args.verbose else open(os.devnull, 'w')
+
+    tracemalloc.start()
+    started = time.monotonic()
+    with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+        domains = find_target_domains(factory, args)
+        index = build_index(clients, [factory.domain_arn(domain['DomainId']) for domain in domains],
+                            args.discovery, args.page_size)
+        if dry_run:
+            for domain in domains:
+                domain_plan(clients, domain, args.page_size, index)
+            summary = None
+        else:
+            def teardown(domain):
+                # Same steps as delete_domain in ss.py
+                resources = discover_domain_resources(clients, domain['DomainId'], args.page_size, index)
+                graph = graph_from_resources(clients, domain['DomainId'], resources, args.page_size)
+                result = graph.run(Backoff(args.poll_base_delay, args.poll_max_delay, args.poll_deadline))
+                if result['failed'] or result['blocked']:
+                    raise RuntimeError(f"{len(result['failed'])} resources failed, {len(result['blocked'])} blocked")
+                return result
+
+            summary = run_teardowns(domains, teardown, args.workers)
+    wall_time = time.monotonic() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if output:
+        output.close()
+
+    result = {
+        'scenario': 'dry-run' if dry_run else 'teardown',
+        'domains': len(domains),
+        'wall_time': round(wall_time, 3),
+        'peak_memory': peak_memory,
+        'calls': dict(sorted(account.calls.items())),
+    }
+    if summary is not None:
+        result['failed'] = summary['failed']
+        result['remaining'] = account.remaining()
+    return result
+
+
+def print_result(result):
+    """Print one scenario's measurements."""
+    print(f"{result['scenario']}: {result['domains']} domains in {result['wall_time']:.2f}s, "
+          f"peak memory {result['peak_memory'] / 1024 / 1024:.1f} MiB, {sum(result['calls'].values())} API calls")
+    for operation, count in result['calls'].items():
+        print(f"  {count:8d}  {operation}")
+    if 'failed' in result:
+        print(f"  failed domains: {len(result['failed'])}, remaining resources: "
+              f"{sum(count for table, count in result['remaining'].items() if table != 'domains')} "
+              f"(+{result['remaining']['domains']} domains)")
+        for domain_id, error in result['failed'].items():
+            print(f"  FAILED {domain_id}: {error}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the SageMaker teardown against a simulated account")
+    parser.add_argument('--domains', type=int, default=10, help="Domains of the project to tear down")
+    parser.add_argument('--unrelated-domains', type=int, default=0, help="Domains of other projects, listed but not torn down")
+    parser.add_argument('--user-profiles', type=int, default=3, help="User profiles per domain")
+    parser.add_argument('--spaces', type=int, default=0, help="Spaces per domain")
+    parser.add_argument('--apps', type=int, default=2, help="Apps per user profile and per space")
+    parser.add_argument('--functions', type=int, default=1, help="Lambda functions per domain")
+    parser.add_argument('--network-interfaces', type=int, default=2, help="Network interfaces per domain")
+    parser.add_argument('--unrelated-network-interfaces', type=int, default=0, help="Network interfaces of the account that belong to no domain")
+    parser.add_argument('--file-systems', type=int, default=1, help="EFS volumes per domain")
+    parser.add_argument('--mount-targets', type=int, default=2, help="Mount targets per EFS volume")
+    parser.add_argument('--deleting-latency', type=float, default=1.0, help="Upper bound in seconds a deleted resource stays 'Deleting'")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the simulated latencies")
+    parser.add_argument('--project-id', default=DEFAULT_PROJECT_ID, help="Project ID suffix of the simulated domains")
+    parser.add_argument('--region', default=DEFAULT_REGION, help="Region of the simulated account")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of domains torn down in parallel")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help="Number of items requested per list page")
+    parser.add_argument('--discovery', choices=BACKENDS, default=SCAN, help="Find ENIs, EFS volumes and functions by scanning ('scan') or through the tagging API ('tags')")
+    parser.add_argument('--poll-base-delay', type=float, default=DEFAULT_BASE_DELAY, help="Seconds before the first status poll")
+    parser.add_argument('--poll-max-delay', type=float, default=DEFAULT_MAX_DELAY, help="Upper bound of a single poll delay")
+    parser.add_argument('--poll-deadline', type=int, default=DEFAULT_DEADLINE, help="Seconds to wait for a domain's resources to be deleted")
+    parser.add_argument('--scenario', choices=['dry-run', 'teardown', 'all'], default='all', help="Which scenario to run")
+    parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="Show the output of the teardown itself")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    scenarios = {'dry-run': [True], 'teardown': [False], 'all': [True, False]}[args.scenario]
+    results = []
+    for dry_run in scenarios:
+        result = run_scenario(args, dry_run)
+        print_result(result)
+        results.append(result)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'parameters': vars(args), 'results': results}, f, indent=2)
+        print(f"Wrote benchmark results to {args.json_path}")
+    exit(1 if any(result.get('failed') for result in results) else 0)
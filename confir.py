@@ -1,20 +1,22 @@
 import os
 import boto3
 import csp
-import time
+from aws_clients import ClientFactory
+from credential_cache import cached_login
+from inventory import app_owner, iter_apps, iter_domains, iter_spaces, iter_user_profiles
+from polling import drain
 
 os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
 
 if __name__ == '__main__':
     # Assuming csp.login() is defined elsewhere
-    csp.login()
+    cached_login(csp.login)
     
-    client = boto3.client('sagemaker')
+    client = ClientFactory().client('sagemaker')
     
     # Print all domain IDs
-    domains = client.list_domains()
     print("Available Domain IDs:")
-    for domain in domains['Domains']:
+    for domain in iter_domains(client):
         print(domain['DomainId'])
     
     # Wait for domain ID input
@@ -29,39 +31,18 @@ if __name__ == '__main__':
     # Continue with deletion
     SM_DOMAIN_ID = domain_id
     
-    work_to_do = True
-    retry_time = 5
-
-    while work_to_do:
-        work_to_do = False
-        apps = client.list_apps(DomainIdEquals=SM_DOMAIN_ID)
-        
-        for app in apps['Apps']:
-            if app['Status'] == 'InService' or app['Status'] == 'Delete_Failed':
-                print(client.delete_app(DomainId=SM_DOMAIN_ID, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName']))
-            elif app['Status'] == 'Deleting':
-                work_to_do = True
-                time.sleep(retry_time)
-                retry_time *= 3
-
-    work_to_do = True
-    retry_time = 5
-
-    while work_to_do:
-        work_to_do = False
-        user_profiles = client.list_user_profiles(DomainIdEquals=SM_DOMAIN_ID)
-        
-        for user_profile in user_profiles['UserProfiles']:
-            if user_profile['Status'] == 'InService':
-                print(client.delete_user_profile(DomainId=SM_DOMAIN_ID, UserProfileName=user_profile['UserProfileName']))
-            elif user_profile['Status'] == 'Deleting':
-                work_to_do = True
-                time.sleep(retry_time)
-                retry_time *= 3
-
-    # Uncomment if needed
-    # sm_spaces = client.list_spaces(DomainIdEquals=SM_DOMAIN_ID)
-    # for sm_space in sm_spaces['Spaces']:
-    #     print(client.delete_space(DomainId=SM_DOMAIN_ID, SpaceName=sm_space['SpaceName']))
+    # Each tick lists once, then waits with jittered, capped backoff; apps of
+    # user profiles and of shared spaces alike
+    drain(lambda: iter_apps(client, SM_DOMAIN_ID),
+          lambda app: print(client.delete_app(DomainId=SM_DOMAIN_ID, AppType=app['AppType'], AppName=app['AppName'], **app_owner(app))),
+          ('InService', 'Delete_Failed'))
+
+    # Spaces go first, since a user profile cannot be deleted while it owns a private space
+    drain(lambda: iter_spaces(client, SM_DOMAIN_ID),
+          lambda space: print(client.delete_space(DomainId=SM_DOMAIN_ID, SpaceName=space['SpaceName'])),
+          ('InService', 'Delete_Failed'))
+    drain(lambda: iter_user_profiles(client, SM_DOMAIN_ID),
+          lambda user_profile: print(client.delete_user_profile(DomainId=SM_DOMAIN_ID, UserProfileName=user_profile['UserProfileName'])),
+          ('InService', 'Delete_Failed'))
 
     print(client.delete_domain(DomainId=SM_DOMAIN_ID, RetentionPolicy={'HomeEfsFileSystem': 'Delete'}))
@@ -0,0 +1,270 @@
+"""
+Encrypted on-disk cache of the temporary credentials from csp.login().
+
+Every entry point logs in at startup, which costs several STS and SSO round
+trips even for a pure listing run. cached_login() stores the credentials the
+login produced in a local file, encrypted and guarded by a file lock so that
+concurrent jobs on one runner log in only once. Later invocations reuse them
+until shortly before they expire; when they are close to expiry a background
+thread logs in again while the run carries on with the cached ones.
+
+Runner jobs of different environments and accounts share the cache directory,
+so each login identity ($RUNTIME_ENV, $AWS_ACCOUNT_ID and $AWS_ROLE_ARN) gets
+its own cache and key file, and cached credentials are only exported after
+sts.get_caller_identity() confirms they still belong to the expected account.
+
+Encryption needs the optional ``cryptography`` package; without it, or with
+CREDENTIAL_CACHE=off, cached_login() simply calls the login function.
+"""
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+import boto3
+import botocore.exceptions
+import botocore.session
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = InvalidToken = None
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'sagemaker-teardown', 'credentials')
+DEFAULT_TTL = 3600
+MIN_REMAINING = 300
+REFRESH_BEFORE = 900
+DISABLED = 'off'
+
+# Environment variables naming the login identity each cache file belongs to
+IDENTITY_ENV = ('RUNTIME_ENV', 'AWS_ACCOUNT_ID', 'AWS_ROLE_ARN')
+
+ENV_KEYS = {
+    'access_key': 'AWS_ACCESS_KEY_ID',
+    'secret_key': 'AWS_SECRET_ACCESS_KEY',
+    'token': 'AWS_SESSION_TOKEN',
+}
+
+
+class CredentialCache:
+    """Encrypted, file-locked store of the temporary AWS credentials of one login identity."""
+
+    def __init__(self, path=DEFAULT_PATH, key=None, ttl=DEFAULT_TTL, account=None):
+        """
+        Args:
+            path (str): Cache file; a '.lock' and, without ``key``, a '.key' file sit next to it.
+            key (bytes): Fernet key; defaults to $CREDENTIAL_CACHE_KEY, else a
+                key file created with owner-only permissions.
+            ttl (int): Lifetime assumed for credentials whose expiry is unknown, in seconds.
+            account (str): Account the credentials must belong to; if None, the
+                account the login landed in when they were cached.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.account = account
+        os.makedirs(os.path.dirname(path) or '.', mode=0o700, exist_ok=True)
+        self._fernet = Fernet(key or os.getenv('CREDENTIAL_CACHE_KEY') or self._key_file())
+
+    def _key_file(self):
+        key_path = self.path + '.key'
+        with self._locked():
+            if not os.path.exists(key_path):
+                fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(Fernet.generate_key())
+        with open(key_path, 'rb') as f:
+            return f.read()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def load(self):
+        """Return the cached credentials, or None if missing or unreadable."""
+        try:
+            with open(self.path, 'rb') as f:
+                return json.loads(self._fernet.decrypt(f.read()))
+        except (OSError, ValueError, InvalidToken):
+            return None
+
+    def save(self, credentials):
+        """Encrypt and atomically replace the cached credentials."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self._fernet.encrypt(json.dumps(credentials).encode()))
+        os.replace(tmp_path, self.path)
+
+    def capture(self, result=None, use_environment=True):
+        """
+        Read the credentials a login produced.
+
+        Args:
+            result: Return value of the login; used if it is a boto3 session,
+                botocore credentials or an STS-style credentials dictionary.
+            use_environment (bool): Also read the AWS_* environment variables.
+                The background refresh passes False, since by then they hold
+                the cached credentials this process exported itself.
+
+        Returns:
+            dict: 'access_key', 'secret_key', 'token' and 'expires_at' (epoch
+            seconds), or None if the login produced no credentials.
+        """
+        if isinstance(result, dict):
+            result = result.get('Credentials', result)
+            if 'AccessKeyId' in result:
+                expiration = result.get('Expiration')
+                if isinstance(expiration, str):
+                    expiration = datetime.datetime.fromisoformat(expiration.replace('Z', '+00:00'))
+                return {'access_key': result['AccessKeyId'], 'secret_key': result['SecretAccessKey'],
+                        'token': result.get('SessionToken'),
+                        'expires_at': expiration.timestamp() if expiration else time.time() + self.ttl}
+        if isinstance(result, boto3.session.Session):
+            credentials = result.get_credentials()
+        elif hasattr(result, 'get_frozen_credentials'):
+            credentials = result
+        elif use_environment:
+            credentials = boto3.session.Session().get_credentials()
+        else:
+            # The shared credentials file, SSO cache or instance role the login wrote to
+            session = botocore.session.Session()
+            session.get_component('credential_provider').remove('env')
+            credentials = session.get_credentials()
+        if credentials is None:
+            return None
+        frozen = credentials.get_frozen_credentials()
+        expires_at = time.time() + self.ttl
+        if use_environment and os.getenv('AWS_CREDENTIAL_EXPIRATION'):
+            expiration = os.environ['AWS_CREDENTIAL_EXPIRATION'].replace('Z', '+00:00')
+            expires_at = datetime.datetime.fromisoformat(expiration).timestamp()
+        elif getattr(credentials, '_expiry_time', None) is not None:
+            expires_at = credentials._expiry_time.timestamp()
+        return {'access_key': frozen.access_key, 'secret_key': frozen.secret_key, 'token': frozen.token,
+                'expires_at': expires_at}
+
+    @staticmethod
+    def caller_account(credentials):
+        """Return the account of a set of cached credentials, as reported by sts.get_caller_identity()."""
+        session = boto3.session.Session(aws_access_key_id=credentials['access_key'],
+                                        aws_secret_access_key=credentials['secret_key'],
+                                        aws_session_token=credentials.get('token'))
+        return session.client('sts').get_caller_identity()['Account']
+
+    def verify(self, credentials):
+        """
+        Check that cached credentials still work and belong to the expected account.
+
+        Returns:
+            bool: False if they are rejected, or if the account is neither the
+            configured one nor the one recorded when they were cached.
+        """
+        expected = self.account or credentials.get('account')
+        try:
+            account = self.caller_account(credentials)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            print(f"Cached credentials were rejected, logging in again: {e}")
+            return False
+        if expected is None or account != expected:
+            print(f"Cached credentials belong to account {account}, expected {expected}; logging in again")
+            return False
+        return True
+
+    def _login_and_save(self, login, use_environment=True, stale=None):
+        credentials = self.capture(login(), use_environment)
+        if credentials is None:
+            return None
+        if stale is not None and credentials['access_key'] == stale['access_key']:
+            # Saving them again would only push out the expiry of the old credentials
+            print("Background credential refresh found no new credentials; the cache is left to expire")
+            return None
+        credentials['account'] = self.caller_account(credentials)
+        if self.account and credentials['account'] != self.account:
+            raise RuntimeError(f"Login returned credentials for account {credentials['account']}, "
+                               f"expected {self.account}")
+        self.save(credentials)
+        return credentials
+
+    def _refresh_in_background(self, login):
+        def refresh():
+            try:
+                with self._locked():
+                    cached = self.load()
+                    # Another job may have refreshed while this one waited for the lock
+                    if cached is None or cached['expires_at'] - time.time() < REFRESH_BEFORE:
+                        # Never touches os.environ: the run keeps the credentials it exported
+                        self._login_and_save(login, use_environment=False, stale=cached)
+            except Exception as e:
+                print(f"Background credential refresh failed: {e}")
+
+        threading.Thread(target=refresh, name='credential-refresh', daemon=True).start()
+
+    def login(self, login):
+        """
+        Export cached credentials if they are still valid, otherwise call ``login``.
+
+        Cached credentials are only exported once sts.get_caller_identity()
+        confirms they belong to the expected account.
+
+        Args:
+            login: Callable performing the real login, e.g. csp.login.
+        """
+        with self._locked():
+            cached = self.load()
+            remaining = cached['expires_at'] - time.time() if cached else 0
+            if remaining < MIN_REMAINING or not self.verify(cached):
+                cached = self._login_and_save(login)
+                remaining = None
+        if cached is None:
+            return
+        for name, env_key in ENV_KEYS.items():
+            if cached.get(name):
+                os.environ[env_key] = cached[name]
+        if remaining is not None and remaining < REFRESH_BEFORE:
+            self._refresh_in_background(login)
+
+
+def cache_path(path, environment=None, account=None, role_arn=None):
+    """
+    Return the cache file of one login identity.
+
+    Args:
+        path (str): Base cache file, e.g. DEFAULT_PATH.
+        environment (str): Runtime environment, e.g. $RUNTIME_ENV.
+        account (str): Account the login targets.
+        role_arn (str): Role the login assumes.
+
+    Returns:
+        str: ``path`` suffixed with the environment and a digest of the identity.
+    """
+    digest = hashlib.sha256(json.dumps([environment, account, role_arn]).encode()).hexdigest()[:16]
+    label = ''.join(c if c.isalnum() or c in '-_' else '_' for c in environment or 'default')
+    return f"{path}-{label}-{digest}"
+
+
+def cached_login(login, path=None, environment=None, account=None, role_arn=None):
+    """
+    Log in through the credential cache, falling back to ``login`` alone if it is unavailable.
+
+    Args:
+        login: Callable performing the real login, e.g. csp.login.
+        path (str): Base cache file; defaults to $CREDENTIAL_CACHE, else DEFAULT_PATH.
+        environment (str): Runtime environment; defaults to $RUNTIME_ENV.
+        account (str): Expected account; defaults to $AWS_ACCOUNT_ID.
+        role_arn (str): Role the login assumes; defaults to $AWS_ROLE_ARN.
+    """
+    path = path or os.getenv('CREDENTIAL_CACHE') or DEFAULT_PATH
+    if Fernet is None or path == DISABLED:
+        return login()
+    environment, account, role_arn = [value or os.getenv(name) for value, name
+                                      in zip((environment, account, role_arn), IDENTITY_ENV)]
+    return CredentialCache(cache_path(path, environment, account, role_arn), account=account).login(login)
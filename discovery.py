@@ -0,0 +1,418 @@
+"""
+Discovery of the Lambda functions, network interfaces and EFS volumes that
+belong to a SageMaker domain.
+
+The find_* matchers scan the whole account for one domain, the same way the
+original delete_* helpers did. ResourceIndex scans each service once per run
+so that matching many domains is a dictionary lookup; this is the default.
+With the 'tags' backend the index is instead filled from the Resource Groups
+Tagging API, asking only for resources tagged with the target domains' ARNs.
+Resources created before the tag was applied are only found by the scan, so
+the scan still runs, and is merged in, whenever a domain has nothing tagged.
+
+find_mount_targets describes the mount targets of file systems already
+found, which have to go before the file systems can.
+
+Network interfaces are never scanned account-wide by build_index: shared VPC
+accounts hold tens of thousands of them. EC2 filters them server-side
+instead, by security-group name, domain-arn tag and the domain's boundary
+security group. Each batch of domains takes a few paginated calls, scoped to
+the domains' VPCs and subnets when describe_domain reports them.
+"""
+import hashlib
+import json
+import re
+from collections import defaultdict
+
+import botocore.exceptions
+
+from inventory import DEFAULT_PAGE_SIZE, paginate
+from snapshot import cached
+
+TAGS = 'tags'
+SCAN = 'scan'
+BACKENDS = (TAGS, SCAN)
+
+DOMAIN_ARN_TAG = 'sagemaker:domain-arn'
+TAG_FILTER_MAX_VALUES = 20
+TAGGING_PAGE_SIZE = 100
+RESOURCE_TYPES = {
+    'lambda': 'lambda:function',
+    'ec2': 'ec2:network-interface',
+    'efs': 'elasticfilesystem:file-system',
+}
+# Domains per describe_network_interfaces call; keeps every filter well under EC2's value limit
+ENI_FILTER_MAX_VALUES = 50
+
+
+def group_name_filter(*parts):
+    """Return an EC2 filter matching security-group names that contain any of the given strings."""
+    return {'Name': 'group-name', 'Values': [f"*{part}*" for part in parts]}
+
+
+def find_network_interfaces(client, domain_id, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Find network interfaces attached to one of the domain's security groups.
+
+    Args:
+        client: Boto3 EC2 client.
+        domain_id (str): Domain ID.
+        page_size (int): Number of interfaces requested per page.
+
+    Returns:
+        list: Network interface IDs.
+    """
+    return [interface['NetworkInterfaceId']
+            for interface in paginate(client, 'describe_network_interfaces', 'NetworkInterfaces', page_size,
+                                      Filters=[group_name_filter(domain_id)])]
+
+
+def describe_domain_networks(client, domain_arns):
+    """
+    Describe where the domains' network interfaces can live.
+
+    Args:
+        client: Boto3 SageMaker client, or None to skip describe_domain.
+        domain_arns: ARNs of the target domains.
+
+    Returns:
+        list: Per domain, a dictionary with DomainId and DomainArn, plus VpcId,
+        SubnetIds and DomainSettings where describe_domain answered.
+    """
+    domains = []
+    for domain_arn in domain_arns:
+        domain = {'DomainId': domain_arn.rsplit('/', 1)[-1], 'DomainArn': domain_arn}
+        if client is not None:
+            try:
+                response = client.describe_domain(DomainId=domain['DomainId'])
+            except botocore.exceptions.ClientError as e:
+                print(f"Could not describe domain {domain['DomainId']}, searching its ENIs in every VPC: {e}")
+            else:
+                domain.update({key: response[key] for key in ('VpcId', 'SubnetIds', 'DomainSettings') if key in response})
+        domains.append(domain)
+    return domains
+
+
+def boundary_group_id(domain):
+    """Return the security group SageMaker created for the domain's boundary, if any."""
+    return domain.get('DomainSettings', {}).get('SecurityGroupIdForDomainBoundary')
+
+
+def network_interface_filters(domains):
+    """
+    Yield the Filters of the describe_network_interfaces calls that find the domains' ENIs.
+
+    Each batch of domains is searched by security-group name containing the
+    domain ID, by the domain-arn tag and by the boundary security groups. The
+    calls are restricted to the batch's VPCs and subnets when every domain of
+    the batch reports them, since only then is nothing of theirs left out.
+
+    Args:
+        domains (list): Dictionaries as returned by describe_domain_networks.
+
+    Yields:
+        list: EC2 filters of one call.
+    """
+    for i in range(0, len(domains), ENI_FILTER_MAX_VALUES):
+        batch = domains[i:i + ENI_FILTER_MAX_VALUES]
+        scope = []
+        if all(domain.get('VpcId') for domain in batch):
+            scope.append({'Name': 'vpc-id', 'Values': sorted({domain['VpcId'] for domain in batch})})
+        subnet_ids = sorted({subnet_id for domain in batch for subnet_id in domain.get('SubnetIds', [])})
+        if all(domain.get('SubnetIds') for domain in batch) and len(subnet_ids) <= ENI_FILTER_MAX_VALUES:
+            scope.append({'Name': 'subnet-id', 'Values': subnet_ids})
+        yield scope + [group_name_filter(*(domain['DomainId'] for domain in batch))]
+        yield scope + [{'Name': f"tag:{DOMAIN_ARN_TAG}", 'Values': [domain['DomainArn'] for domain in batch]}]
+        group_ids = [boundary_group_id(domain) for domain in batch if boundary_group_id(domain)]
+        if group_ids:
+            yield scope + [{'Name': 'group-id', 'Values': group_ids}]
+
+
+def find_domain_network_interfaces(client, domains, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
+    """
+    Find the network interfaces of many domains with server-side filters.
+
+    Args:
+        client: Boto3 EC2 client.
+        domains (list): Dictionaries as returned by describe_domain_networks.
+        page_size (int): Number of interfaces requested per page.
+        snapshot (InventorySnapshot): Snapshot to read the filtered listings from, if any.
+        scope (str): Snapshot scope of the listings, e.g. the region.
+
+    Returns:
+        list: Network interfaces as returned by describe_network_interfaces,
+        each listed once.
+    """
+    interfaces = {}
+    for filters in network_interface_filters(domains):
+        # A listing is only reusable for the very same filters
+        digest = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+        for interface in cached(snapshot, 'network_interfaces', f"{scope}/{digest}", lambda: paginate(
+                client, 'describe_network_interfaces', 'NetworkInterfaces', page_size, Filters=filters)):
+            interfaces[interface['NetworkInterfaceId']] = interface
+    return list(interfaces.values())
+
+
+def find_efs_volumes(client, domain_id, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Find EFS file systems tagged with the domain ID.
+
+    Args:
+        client: Boto3 EFS client.
+        domain_id (str): Domain ID.
+        page_size (int): Number of file systems requested per page.
+
+    Returns:
+        list: EFS file system IDs.
+    """
+    file_system_ids = []
+    for volume in paginate(client, 'describe_file_systems', 'FileSystems', page_size):
+        if any(domain_id in tag['Value'] for tag in volume.get('Tags', [])):
+            file_system_ids.append(volume['FileSystemId'])
+    return file_system_ids
+
+
+def find_mount_targets(client, file_system_ids, page_size=DEFAULT_PAGE_SIZE):
+    """
+    List the mount targets of EFS file systems.
+
+    Args:
+        client: Boto3 EFS client.
+        file_system_ids: IDs of the file systems.
+        page_size (int): Number of mount targets requested per page.
+
+    Returns:
+        list: Mount targets as returned by describe_mount_targets, of every file
+        system that still exists.
+    """
+    mount_targets = []
+    for file_system_id in file_system_ids:
+        try:
+            mount_targets.extend(paginate(client, 'describe_mount_targets', 'MountTargets', page_size,
+                                          FileSystemId=file_system_id))
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'FileSystemNotFound':
+                raise
+    return mount_targets
+
+
+DOMAIN_ID_PATTERN = re.compile(r'd-[a-z0-9]{12}')
+
+
+class ResourceIndex:
+    """
+    Lambda functions, network interfaces and EFS volumes of the whole account,
+    scanned once per run and indexed for per-domain dictionary lookups.
+
+    Resources are keyed by every domain ID that appears in a function name,
+    security-group name or EFS tag value, by security-group name, and
+    functions additionally by each '-'-delimited suffix of their name so
+    that a domain name resolves to the functions ending with it.
+    """
+
+    def __init__(self):
+        self.functions_by_domain = defaultdict(list)
+        self.functions_by_suffix = defaultdict(list)
+        self.interfaces_by_domain = defaultdict(list)
+        self.interfaces_by_group = defaultdict(list)
+        self.file_systems_by_domain = defaultdict(list)
+
+    @classmethod
+    def build(cls, client, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
+        """
+        Scan every service present in ``client`` once and index the results.
+
+        Args:
+            client (dict): Boto3 clients keyed by 'lambda', 'ec2' and/or 'efs'.
+            page_size (int): Number of items requested per page.
+            snapshot (InventorySnapshot): Snapshot to read listings from, if any.
+            scope (str): Snapshot scope of the listings, e.g. the region.
+
+        Returns:
+            ResourceIndex: The populated index.
+        """
+        index = cls()
+        if 'lambda' in client:
+            for func in cached(snapshot, 'functions', scope, lambda: paginate(
+                    client['lambda'], 'list_functions', 'Functions', page_size)):
+                index.add_function(func['FunctionName'])
+        if 'ec2' in client:
+            for interface in cached(snapshot, 'network_interfaces', scope, lambda: paginate(
+                    client['ec2'], 'describe_network_interfaces', 'NetworkInterfaces', page_size)):
+                index.add_network_interface(interface)
+        if 'efs' in client:
+            for volume in cached(snapshot, 'file_systems', scope, lambda: paginate(
+                    client['efs'], 'describe_file_systems', 'FileSystems', page_size)):
+                index.add_efs_volume(volume)
+        return index
+
+    @classmethod
+    def from_tags(cls, client, domain_arns, services=tuple(RESOURCE_TYPES)):
+        """
+        Fill an index from resources tagged with one of the domain ARNs.
+
+        Args:
+            client: Boto3 Resource Groups Tagging API client.
+            domain_arns: ARNs of the target domains.
+            services: Services to look up, among 'lambda', 'ec2' and 'efs'.
+
+        Returns:
+            ResourceIndex: The populated index.
+        """
+        index = cls()
+        domain_arns = list(domain_arns)
+        resource_types = [RESOURCE_TYPES[service] for service in services if service in RESOURCE_TYPES]
+        for i in range(0, len(domain_arns), TAG_FILTER_MAX_VALUES):
+            tag_filters = [{'Key': DOMAIN_ARN_TAG, 'Values': domain_arns[i:i + TAG_FILTER_MAX_VALUES]}]
+            for mapping in paginate(client, 'get_resources', 'ResourceTagMappingList', TAGGING_PAGE_SIZE,
+                                    TagFilters=tag_filters, ResourceTypeFilters=resource_types):
+                index.add_tagged_resource(mapping)
+        return index
+
+    def add_tagged_resource(self, mapping):
+        """Index a resource returned by the tagging API under its domain ID."""
+        domain_arn = next(tag['Value'] for tag in mapping['Tags'] if tag['Key'] == DOMAIN_ARN_TAG)
+        domain_id = domain_arn.rsplit('/', 1)[-1]
+        arn = mapping['ResourceARN']
+        service = arn.split(':')[2]
+        if service == 'lambda':
+            self.functions_by_domain[domain_id].append(arn.split(':')[6])
+        elif service == 'ec2':
+            self.interfaces_by_domain[domain_id].append(arn.rsplit('/', 1)[-1])
+        elif service == 'elasticfilesystem':
+            self.file_systems_by_domain[domain_id].append(arn.rsplit('/', 1)[-1])
+
+    def update(self, other):
+        """Add the resources of another index, skipping those already indexed."""
+        for name in ('functions_by_domain', 'functions_by_suffix', 'interfaces_by_domain', 'interfaces_by_group',
+                     'file_systems_by_domain'):
+            mine = getattr(self, name)
+            for key, values in getattr(other, name).items():
+                mine[key].extend(value for value in values if value not in mine[key])
+
+    def tagged_domains(self):
+        """Return the IDs of domains with at least one Lambda function or EFS volume indexed."""
+        return {domain_id for domain_id, values in self.functions_by_domain.items() if values} | \
+            {domain_id for domain_id, values in self.file_systems_by_domain.items() if values}
+
+    def add_function(self, function_name):
+        """Index a Lambda function by name."""
+        for domain_id in set(DOMAIN_ID_PATTERN.findall(function_name)):
+            self.functions_by_domain[domain_id].append(function_name)
+        parts = function_name.split('-')
+        for i in range(len(parts)):
+            self.functions_by_suffix['-'.join(parts[i:])].append(function_name)
+
+    def add_network_interface(self, interface, domains_by_group_id=None):
+        """
+        Index a network interface by its security groups and domain-arn tag.
+
+        Args:
+            interface (dict): Network interface as returned by describe_network_interfaces.
+            domains_by_group_id (dict): Domain ID per boundary security group ID, if known.
+        """
+        interface_id = interface['NetworkInterfaceId']
+        domain_ids = set()
+        for group in interface['Groups']:
+            self.interfaces_by_group[group['GroupName']].append(interface_id)
+            domain_ids.update(DOMAIN_ID_PATTERN.findall(group['GroupName']))
+            if domains_by_group_id and group['GroupId'] in domains_by_group_id:
+                domain_ids.add(domains_by_group_id[group['GroupId']])
+        for tag in interface.get('TagSet', []):
+            if tag['Key'] == DOMAIN_ARN_TAG:
+                domain_ids.add(tag['Value'].rsplit('/', 1)[-1])
+        for domain_id in domain_ids:
+            self.interfaces_by_domain[domain_id].append(interface_id)
+
+    def add_domain_network_interfaces(self, client, domains, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
+        """
+        Index the domains' network interfaces, found with server-side filters.
+
+        Args:
+            client: Boto3 EC2 client.
+            domains (list): Dictionaries as returned by describe_domain_networks.
+            page_size (int): Number of interfaces requested per page.
+            snapshot (InventorySnapshot): Snapshot to read the filtered listings from, if any.
+            scope (str): Snapshot scope of the listings, e.g. the region.
+        """
+        domains_by_group_id = {boundary_group_id(domain): domain['DomainId']
+                               for domain in domains if boundary_group_id(domain)}
+        for interface in find_domain_network_interfaces(client, domains, page_size, snapshot, scope):
+            self.add_network_interface(interface, domains_by_group_id)
+
+    def add_efs_volume(self, volume):
+        """Index an EFS file system by its tags."""
+        domain_ids = set()
+        for tag in volume.get('Tags', []):
+            domain_ids.update(DOMAIN_ID_PATTERN.findall(tag['Value']))
+        for domain_id in domain_ids:
+            self.file_systems_by_domain[domain_id].append(volume['FileSystemId'])
+
+    def lambda_functions(self, domain_id=None, domain_name=None):
+        """Return function names containing the domain ID or ending with the domain name."""
+        if domain_name:
+            return list(self.functions_by_suffix.get(domain_name, []))
+        return list(self.functions_by_domain.get(domain_id, []))
+
+    def network_interfaces(self, domain_id=None, group_name=None):
+        """Return interface IDs in a security group named after the domain, or in the given group."""
+        if group_name:
+            return list(self.interfaces_by_group.get(group_name, []))
+        return list(self.interfaces_by_domain.get(domain_id, []))
+
+    def efs_volumes(self, domain_id):
+        """Return EFS file system IDs tagged with the domain ID."""
+        return list(self.file_systems_by_domain.get(domain_id, []))
+
+
+def untagged_domains(index, domain_arns):
+    """Return the IDs of the domains the tagging API found no resources for."""
+    tagged = index.tagged_domains()
+    return [domain_id for domain_id in (arn.rsplit('/', 1)[-1] for arn in domain_arns) if domain_id not in tagged]
+
+
+def build_index(client, domain_arns, backend=SCAN, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
+    """
+    Build the run's resource index with the chosen discovery backend.
+
+    The tagging backend falls back to scanning the account if the tagging
+    API call is rejected, e.g. for missing tag:GetResources permissions, and
+    merges the scan in, with a warning, when any domain has no tagged
+    resources, so that untagged Lambda functions and EFS volumes are never
+    silently left behind. Either way, network interfaces are found with
+    server-side EC2 filters, scoped by the VPCs and subnets describe_domain
+    reports if 'sagemaker' is among the clients.
+
+    Args:
+        client (dict): Boto3 clients keyed by service; 'resourcegroupstaggingapi'
+            is required for the tagging backend.
+        domain_arns: ARNs of the target domains.
+        backend (str): 'tags' or 'scan'.
+        page_size (int): Number of items requested per page when scanning.
+        snapshot (InventorySnapshot): Snapshot the account scan reads from, if any.
+        scope (str): Snapshot scope of the scan, e.g. the region.
+
+    Returns:
+        ResourceIndex: The populated index.
+    """
+    domain_arns = list(domain_arns)
+    services = [service for service in ('lambda', 'efs') if service in client]
+    index = None
+    if backend == TAGS:
+        try:
+            index = ResourceIndex.from_tags(client['resourcegroupstaggingapi'], domain_arns, services)
+        except botocore.exceptions.ClientError as e:
+            print(f"Tag-based discovery failed, falling back to scanning the account: {e}")
+        else:
+            untagged = untagged_domains(index, domain_arns) if services else []
+            if untagged:
+                print(f"Warning: no Lambda functions or EFS volumes are tagged {DOMAIN_ARN_TAG} for domains "
+                      f"{', '.join(untagged)}; scanning the account as well")
+                index.update(ResourceIndex.build({service: client[service] for service in services},
+                                                 page_size, snapshot, scope))
+    if index is None:
+        index = ResourceIndex.build({service: client[service] for service in services}, page_size, snapshot, scope)
+    if 'ec2' in client:
+        domains = describe_domain_networks(client.get('sagemaker'), domain_arns)
+        index.add_domain_network_interfaces(client['ec2'], domains, page_size, snapshot, scope)
+    return index
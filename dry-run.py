@@ -1,56 +1,52 @@
 import boto3
 import argparse
 import botocore.exceptions
-
-def list_all_domains(client):
+from aws_clients import add_client_arguments, factory_from_args
+from discovery import BACKENDS, SCAN, build_index
+from efs_teardown import delete_file_systems
+from inventory import DEFAULT_PAGE_SIZE, iter_domains
+from snapshot import add_snapshot_arguments, cached, invalidate_teardown, snapshot_from_args
+from teardown_pool import DEFAULT_WORKERS, print_summary, run_teardowns
+
+def list_all_domains(client, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
     print("All Domain IDs and Domain Names:")
-    domains = client.list_domains()
-    for domain in domains['Domains']:
+    for domain in cached(snapshot, 'domains', scope, lambda: iter_domains(client, page_size)):
         print(f"Domain ID: {domain['DomainId']}, Domain Name: {domain['DomainName']}")
 
-def filter_domain_id_with_project_id(client, project_id):
+def filter_domain_id_with_project_id(client, project_id, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
     filtered_domain_ids = []
-    client = boto3.client('sagemaker')
-    domains = client.list_domains()
-    for domain in domains['Domains']:
+    for domain in cached(snapshot, 'domains', scope, lambda: iter_domains(client, page_size)):
         if domain['DomainName'].endswith(project_id):
             filtered_domain_ids.append({'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']})
     return filtered_domain_ids
 
-def delete_lambda_functions(client, project_id, dry_run=False):
+def delete_lambda_functions(client, project_id, index, dry_run=False):
     print(f"Filtering Lambda functions for project ID: {project_id} (Dry Run: {dry_run})")
     if not dry_run:
-        lambdas = client.list_functions()
-        for func in lambdas['Functions']:
-            if project_id in func['FunctionName']:
-                print(f"Deleting Lambda Function: {func['FunctionName']}")
-                client.delete_function(FunctionName=func['FunctionName'])
+        for function_name in index.lambda_functions(project_id):
+            print(f"Deleting Lambda Function: {function_name}")
+            client.delete_function(FunctionName=function_name)
     else:
         print("Performing dry run for Lambda functions...")
         print("Dry run completed. No Lambda functions were deleted.")
 
-def delete_network_interfaces(client, domain_id, dry_run=False):
+def delete_network_interfaces(client, domain_id, index, dry_run=False):
     print(f"Filtering Network Interfaces for domain ID: {domain_id} (Dry Run: {dry_run})")
     if not dry_run:
-        interfaces = client.describe_network_interfaces()
-        for interface in interfaces['NetworkInterfaces']:
-            for group in interface['Groups']:
-                if domain_id in group['Groupname']:
-                    print(f"Deleting Network Interface: {interface['NetworkInterfaceId']}")
-                    client.delete_network_interface(NetworkInterfaceId=interface['NetworkInterfaceId'])
+        for interface_id in index.network_interfaces(domain_id):
+            print(f"Deleting Network Interface: {interface_id}")
+            client.delete_network_interface(NetworkInterfaceId=interface_id)
     else:
         print("Performing dry run for Network Interfaces...")
         print("Dry run completed. No Network Interfaces were deleted.")
 
-def delete_efs_volumes(client, domain_id, dry_run=False):
+def delete_efs_volumes(client, domain_id, index, dry_run=False):
     print(f"Filtering EFS Volumes for domain ID: {domain_id} (Dry Run: {dry_run})")
     if not dry_run:
-        volumes = client.describe_file_systems()
-        for volume in volumes['FileSystems']:
-            for tag in volume['Tags']:
-                if domain_id in tag['Value']:
-                    print(f"Deleting EFS Volume: {volume['FileSystemId']}")
-                    client.delete_file_system(FileSystemId=volume['FileSystemId'])
+        for file_system_id in index.efs_volumes(domain_id):
+            print(f"Deleting EFS Volume: {file_system_id}")
+        # Mount targets go first, then every volume at once
+        delete_file_systems(client, index.efs_volumes(domain_id))
     else:
         print("Performing dry run for EFS Volumes...")
         print("Dry run completed. No EFS Volumes were deleted.")
@@ -66,13 +62,13 @@ def delete_domain(client, domain_id, domain_name, dry_run=False):
         # Check for dependencies and print them without deleting
         print("Dry run completed. No resources were deleted.")
 
-def delete_domain_resources(client, domain_id, domain_name, dry_run=False):
+def delete_domain_resources(client, domain_id, domain_name, index, dry_run=False):
     print(f"Deleting Resources Associated with Domain: {domain_id} (Dry Run: {dry_run})")
 
     if not dry_run:
-        delete_lambda_functions(client['lambda'], domain_id, dry_run)
-        delete_network_interfaces(client['ec2'], domain_id, dry_run)
-        delete_efs_volumes(client['efs'], domain_id, dry_run)
+        delete_lambda_functions(client['lambda'], domain_id, index, dry_run)
+        delete_network_interfaces(client['ec2'], domain_id, index, dry_run)
+        delete_efs_volumes(client['efs'], domain_id, index, dry_run)
     else:
         print("Performing dry run for domain resources...")
         # Check for dependencies and print them without deleting
@@ -89,7 +85,7 @@ def get_domain_name(client, domain_id):
     try:
         response=client.describe_domain(DomainId=domain_id)
         print("describe domain response", response)
-        return response['DomainName'] if 'DomaiName' in response else None
+        return response['DomainName'] if 'DomainName' in response else None
     except Exception as e:
         print(f"Error reterving domain name for domain ID '{domain_id}': {e}")
         return None
@@ -99,14 +95,21 @@ def parse_arguments():
     parser.add_argument('--project-id', default=None, help="Project ID suffix to filter domains")
     parser.add_argument('--domain-ids', default=None, help="Comma-separated list of domain IDs to delete")
     parser.add_argument('--dry-run', action='store_true', help="Perform a dry run without deleting resources")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help="Number of items requested per list page")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of domains torn down in parallel")
+    parser.add_argument('--discovery', choices=BACKENDS, default=SCAN, help="Find Lambda functions, ENIs and EFS volumes by scanning the account ('scan') or through the tagging API ('tags'), which scans as well when a domain has nothing tagged")
+    add_client_arguments(parser)
+    add_snapshot_arguments(parser)
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_arguments()
-    client = boto3.client('sagemaker')
+    factory = factory_from_args(args)
+    client = factory.client('sagemaker')
+    snapshot = snapshot_from_args(args)
 
     if args.project_id:
-        filtered_domains = filter_domain_id_with_project_id(client, args.project_id)
+        filtered_domains = filter_domain_id_with_project_id(client, args.project_id, args.page_size, snapshot, factory.region)
         if not filtered_domains:
             print(f"No domains found with project ID '{args.project_id}' as suffix.")
             exit(0)
@@ -117,20 +120,34 @@ if __name__ == "__main__":
         print("Please provide either --project-id or --domain-ids argument.")
         exit(1)
 
-    for domain in filtered_domains:
+    clients = factory.clients('sagemaker', 'lambda', 'ec2', 'efs', 'resourcegroupstaggingapi')
+
+    # Discover Lambda functions, ENIs and EFS volumes once for all domains
+    index = None if args.dry_run else build_index(
+        clients, [factory.domain_arn(domain['DomainId']) for domain in filtered_domains], args.discovery, args.page_size,
+        snapshot, factory.region)
+
+    def teardown(domain):
         domain_id = domain.get('DomainId')
         domain_name = get_domain_name(client, domain_id)
         if not domain_name:
-            print(f"Error: Unable to retrieve domain name for domain ID '{domain_id}'. Skipping deletion.")
-            continue
+            raise RuntimeError(f"Unable to retrieve domain name for domain ID '{domain_id}'. Skipping deletion.")
 
         print(f"Processing deletion for Domain ID: {domain_id}, Domain Name: {domain_name}")
 
         # Delete Domain Resources
-        delete_domain_resources(client, domain_id, domain_name, args.dry_run)
+        delete_domain_resources(clients, domain_id, domain_name, index, args.dry_run)
 
         # Delete Domain
         delete_domain(client, domain_id, domain_name, args.dry_run)
+        if not args.dry_run:
+            # Deleted resources must not be served to the next run
+            invalidate_teardown(snapshot, factory.region, [domain_id])
+
+    summary = run_teardowns(filtered_domains, teardown, args.workers)
+    print_summary(summary)
+    if summary['failed']:
+        exit(1)
 
     if args.dry_run:
         print("Dry run completed. No resources were deleted.")
@@ -0,0 +1,71 @@
+"""
+EFS teardown stage for the scripts that delete a domain's volumes directly.
+
+EFS rejects delete_file_system while a file system still has mount targets,
+and a SageMaker home volume has one per subnet of its domain. This stage
+deletes the mount targets of all the given file systems at once, waits until
+they are gone, describing each file system's mount targets once per tick,
+and only then deletes the file systems, again all at once.
+
+The teardown graph in teardown_graph.py does the same with mount_target
+nodes; this module serves the scripts that delete resources in fixed steps.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import botocore.exceptions
+
+from discovery import find_mount_targets
+from inventory import DEFAULT_PAGE_SIZE
+from polling import DELETED_STATUSES, GONE, Backoff, MountTargetStatus
+from teardown_graph import is_not_found
+
+DEFAULT_EFS_WORKERS = 10
+
+
+def _delete(call, **kwargs):
+    """Issue a delete call; a resource that is already gone counts as deleted."""
+    try:
+        call(**kwargs)
+    except botocore.exceptions.ClientError as e:
+        if not is_not_found(e):
+            raise
+
+
+def delete_file_systems(client, file_system_ids, page_size=DEFAULT_PAGE_SIZE, backoff=None, workers=DEFAULT_EFS_WORKERS):
+    """
+    Delete EFS file systems once their mount targets are gone.
+
+    Args:
+        client: Boto3 EFS client.
+        file_system_ids: IDs of the file systems to delete.
+        page_size (int): Number of mount targets requested per page.
+        backoff (Backoff): Polling schedule while mount targets are deleting; a default one is used if None.
+        workers (int): Maximum number of delete calls in flight.
+
+    Raises:
+        PollTimeout: If mount targets are still deleting at the backoff's deadline.
+    """
+    file_system_ids = list(file_system_ids)
+    if not file_system_ids:
+        return
+    pending = [mount_target for mount_target in find_mount_targets(client, file_system_ids, page_size)
+               if mount_target['LifeCycleState'] not in DELETED_STATUSES]
+
+    def delete_mount_target(mount_target):
+        if mount_target['LifeCycleState'] != 'deleting':
+            print(f"Deleting EFS Mount Target: {mount_target['MountTargetId']} of {mount_target['FileSystemId']}")
+            _delete(client.delete_mount_target, MountTargetId=mount_target['MountTargetId'])
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(delete_mount_target, pending))
+
+        backoff = backoff or Backoff()
+        status = MountTargetStatus(client, page_size)
+        while pending:
+            backoff.sleep()
+            status.refresh()
+            pending = [mount_target for mount_target in pending
+                       if status.mount_target(mount_target['FileSystemId'], mount_target['MountTargetId']) != GONE]
+
+        list(executor.map(lambda file_system_id: _delete(client.delete_file_system, FileSystemId=file_system_id),
+                          file_system_ids))
@@ -0,0 +1,141 @@
+"""
+Machine-readable teardown progress as newline-delimited JSON.
+
+With ``--events ndjson`` every resource state transition is written as one
+compact JSON record instead of being left to the free-text log:
+
+    {"at":1700000000.123,"event":"delete_issued","domain":"d-abc","resource":"app:alice/JupyterServer/default","kind":"app"}
+
+Events are 'discovered' (with the listed status), 'delete_issued', 'deleting'
+(already deleting when found or resumed), 'deleted' and 'failed' (with the
+error). Records are buffered and flushed every second, when the buffer
+fills and at exit. When the records go to stdout, the free-text output is
+moved to stderr so that stdout carries nothing but records.
+"""
+import atexit
+import json
+import sys
+import threading
+import time
+
+from polling import GONE
+from teardown_graph import DELETING, FAILED
+
+TEXT = 'text'
+NDJSON = 'ndjson'
+FORMATS = (TEXT, NDJSON)
+STDOUT = '-'
+
+DISCOVERED = 'discovered'
+DELETE_ISSUED = 'delete_issued'
+ALREADY_DELETING = 'deleting'
+DELETED = 'deleted'
+DELETE_FAILED = 'failed'
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_BUFFER_SIZE = 500
+
+
+class EventStream:
+    """Buffered writer of teardown progress records, one JSON object per line."""
+
+    def __init__(self, out, flush_interval=DEFAULT_FLUSH_INTERVAL, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        Args:
+            out: Text file the records are written to.
+            flush_interval (float): Seconds a record may wait in the buffer.
+            buffer_size (int): Number of buffered records that triggers a flush.
+        """
+        self.out = out
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,),
+                                         name='event-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_periodically(self, interval):
+        while not self._closed.wait(interval):
+            self.flush()
+
+    def emit(self, event, domain_id, resource_id=None, kind=None, **fields):
+        """
+        Buffer one record.
+
+        Args:
+            event (str): One of DISCOVERED, DELETE_ISSUED, ALREADY_DELETING, DELETED or DELETE_FAILED.
+            domain_id (str): Domain the resource belongs to.
+            resource_id (str): Node ID of the resource, e.g. 'user_profile:alice'.
+            kind (str): Resource kind, e.g. 'app' or 'eni'.
+            **fields: Extra fields such as 'status' or 'error'; None values are omitted.
+        """
+        record = {'at': round(time.time(), 3), 'event': event, 'domain': domain_id,
+                  'resource': resource_id, 'kind': kind}
+        record.update(fields)
+        line = json.dumps({key: value for key, value in record.items() if value is not None},
+                          separators=(',', ':'), default=str)
+        with self._lock:
+            self._buffer.append(line)
+            full = len(self._buffer) >= self.buffer_size
+        if full:
+            self.flush()
+
+    def discovered(self, domain_id, resources):
+        """Record every resource listed for a domain, as returned by discover_domain_resources."""
+        for resource in resources:
+            self.emit(DISCOVERED, domain_id, resource['id'], resource['kind'], status=resource['status'])
+
+    def node_changed(self, domain_id, node):
+        """Record a TeardownGraph node's new state."""
+        if node.state == DELETING:
+            # A node only counts delete attempts it made itself
+            event = DELETE_ISSUED if node.attempts else ALREADY_DELETING
+        elif node.state == GONE:
+            event = DELETED
+        elif node.state == FAILED:
+            event = DELETE_FAILED
+        else:
+            return
+        self.emit(event, domain_id, node.node_id, node.kind, error=node.error)
+
+    def listener(self, domain_id):
+        """Return a TeardownGraph listener that records every node state change."""
+        return lambda node: self.node_changed(domain_id, node)
+
+    def flush(self):
+        """Write out the buffered records."""
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            if lines:
+                self.out.write('\n'.join(lines) + '\n')
+                self.out.flush()
+
+    def close(self):
+        """Stop the periodic flush and write out what is left."""
+        self._closed.set()
+        self.flush()
+
+
+def add_event_arguments(parser):
+    """Add the --events options to an argparse parser."""
+    parser.add_argument('--events', choices=FORMATS, default=TEXT, help="Also emit one NDJSON record per resource state change ('ndjson'), or only the text log ('text')")
+    parser.add_argument('--events-out', default=STDOUT, help="File the NDJSON records are appended to, or '-' for stdout, in which case the text log moves to stderr")
+
+
+def events_from_args(args):
+    """
+    Create the EventStream named on the command line, closed at exit.
+
+    Returns:
+        EventStream: The stream, or None for the plain text log.
+    """
+    if args.events != NDJSON:
+        return None
+    if args.events_out == STDOUT:
+        stream = EventStream(sys.stdout)
+        sys.stdout = sys.stderr
+    else:
+        stream = EventStream(open(args.events_out, 'a'))
+    atexit.register(stream.close)
+    return stream
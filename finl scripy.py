@@ -3,98 +3,113 @@ import os
 import boto3
 import argparse
 import botocore
+from aws_clients import add_client_arguments, factory_from_args
+from discovery import BACKENDS, SCAN, build_index
+from efs_teardown import delete_file_systems
+from inventory import DEFAULT_PAGE_SIZE, app_owner, iter_apps, iter_domains, iter_spaces, iter_user_profiles
+from plan import domain_plan, graph_from_plan, print_plan, read_plan, write_plan
+from polling import DEFAULT_DEADLINE, Backoff, wait_deleted
+from snapshot import add_snapshot_arguments, cached, invalidate_teardown, snapshot_from_args
 
 os.environ["AWS_DEFAULT_REGION"] = os.environ.get("AWS_REGION", "us-east-1")
 
-def list_all_domains(client):
+def list_all_domains(client, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
     print("All Domain IDs and Domain Names:")
-    domains = client.list_domains()
-    for domain in domains['Domains']:
+    for domain in cached(snapshot, 'domains', scope, lambda: iter_domains(client, page_size)):
         print(f"Domain ID: {domain['DomainId']}, Domain Name: {domain['DomainName']}")
 
-def filter_domain_id_with_project_id(client, project_id):
+def filter_domain_id_with_project_id(client, project_id, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
     print(f"printing project-is in filetering domains: {project_id}")
-    client = boto3.client('sagemaker')
-    domains = client.list_domains()
-    print("Domains response", domains)
     filtered_domain_ids = []
-    for domain in domains['Domains']:
+    for domain in cached(snapshot, 'domains', scope, lambda: iter_domains(client, page_size)):
         if domain['DomainName'].endswith(project_id):
             filtered_domain_ids.append({'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']})
     return filtered_domain_ids
 
-def delete_domain_resources(client, domain_id, domain_name, dry_run=False):
+def delete_domain_resources(client, domain_id, domain_name, index, dry_run=False):
     print("Domain ID:", domain_id)
     print("Domain Name:", domain_name)
     
     if dry_run:
         print("Performing dry run. Listing resources to be deleted:")
     
-    delete_lambda_functions(client['lambda'], domain_id, dry_run=dry_run)
-    delete_network_interfaces(client['ec2'], domain_id, dry_run=dry_run)
-    delete_efs_volumes(client['efs'], domain_id, dry_run=dry_run)
+    delete_lambda_functions(client['lambda'], domain_id, index, dry_run=dry_run)
+    delete_network_interfaces(client['ec2'], domain_id, index, dry_run=dry_run)
+    delete_efs_volumes(client['efs'], domain_id, index, dry_run=dry_run)
 
 
-def delete_lambda_functions(client, domain_id, dry_run=False):
+def delete_lambda_functions(client, domain_id, index, dry_run=False):
     print(f"Filtering Lambda functions for domain ID: {domain_id}")
-    lambdas = client.list_functions()
-    for func in lambdas['Functions']:
-        if domain_id in func['FunctionName']:
-            if dry_run:
-                print(f"Dry-run: Lambda Function to be deleted: {func['FunctionName']}")
-            else:
-                print(f"Deleting Lambda Function: {func['FunctionName']}")
-                client.delete_function(FunctionName=func['FunctionName'])
-
-def delete_network_interfaces(client, domain_id, dry_run=False):
+    for function_name in index.lambda_functions(domain_id):
+        if dry_run:
+            print(f"Dry-run: Lambda Function to be deleted: {function_name}")
+        else:
+            print(f"Deleting Lambda Function: {function_name}")
+            client.delete_function(FunctionName=function_name)
+
+def delete_network_interfaces(client, domain_id, index, dry_run=False):
     print(f"Filtering Network interfaces for domain ID: {domain_id}")
-    interfaces = client.describe_network_interfaces()
-    for interface in interfaces['NetworkInterfaces']:
-        for group in interface['Groups']:
-            if domain_id in group['GroupName']:
-                if dry_run:
-                    print(f"Dry-run: Network Interface to be deleted: {interface['NetworkInterfaceId']}")
-                else:
-                    print(f"Deleting Network Interface: {interface['NetworkInterfaceId']}")
-                    client.delete_network_interface(NetworkInterfaceId=interface['NetworkInterfaceId'])
+    for interface_id in index.network_interfaces(domain_id):
+        if dry_run:
+            print(f"Dry-run: Network Interface to be deleted: {interface_id}")
+        else:
+            print(f"Deleting Network Interface: {interface_id}")
+            client.delete_network_interface(NetworkInterfaceId=interface_id)
 
-def delete_efs_volumes(client, domain_id, dry_run=False):
+def delete_efs_volumes(client, domain_id, index, dry_run=False):
     print(f"Filtering EFS volumes for domain ID: {domain_id}")
-    volumes = client.describe_file_systems()
-    for volume in volumes['FileSystems']:
-        for tag in volume['Tags']:
-            if domain_id in tag['Value']:
-                if dry_run:
-                    print(f"Dry-run: EFS Volume to be deleted: {volume['FileSystemId']}")
-                else:
-                    print(f"Deleting EFS Volume: {volume['FileSystemId']}")
-                    client.delete_file_system(FileSystemId=volume['FileSystemId'])
+    file_system_ids = []
+    for file_system_id in index.efs_volumes(domain_id):
+        if dry_run:
+            print(f"Dry-run: EFS Volume to be deleted: {file_system_id}")
+        else:
+            print(f"Deleting EFS Volume: {file_system_id}")
+            file_system_ids.append(file_system_id)
+    # Mount targets go first, then every volume at once
+    delete_file_systems(client, file_system_ids)
 
 
-def delete_domain(client, domain_id, domain_name, dry_run=False):
+def delete_domain(client, domain_id, domain_name, dry_run=False, page_size=DEFAULT_PAGE_SIZE, index=None, snapshot=None):
     # Delete Apps
-    apps = client['sagemaker'].list_apps(DomainIdEquals=domain_id)
-    for app in apps['Apps']:
+    for app in cached(snapshot, 'apps', domain_id, lambda: iter_apps(client['sagemaker'], domain_id, page_size)):
         if dry_run:
             print(f"Dry-run: Deleting App: {app['AppName']}")
         else:
             print(f"Deleting App: {app['AppName']}")
-            client.delete_app(DomainId=domain_id, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName'])
+            client.delete_app(DomainId=domain_id, AppType=app['AppType'], AppName=app['AppName'], **app_owner(app))
 
 
+    # Like the graph teardown: apps, then spaces, then user profiles, each once the previous are gone
+    if not dry_run:
+        wait_deleted(lambda: iter_apps(client['sagemaker'], domain_id, page_size))
+
+    # Delete Spaces
+    for space in cached(snapshot, 'spaces', domain_id, lambda: iter_spaces(client['sagemaker'], domain_id, page_size)):
+        if dry_run:
+            print(f"Dry-run: Deleting Space: {space['SpaceName']}")
+        else:
+            print(f"Deleting Space: {space['SpaceName']}")
+            client.delete_space(DomainId=domain_id, SpaceName=space['SpaceName'])
+
+    if not dry_run:
+        wait_deleted(lambda: iter_spaces(client['sagemaker'], domain_id, page_size))
+
     # Delete User Profiles
-    user_profiles = client['sagemaker'].list_user_profiles(DomainIdEquals=domain_id)
-    for user_profile in user_profiles['UserProfiles']:
+    for user_profile in cached(snapshot, 'user_profiles', domain_id,
+                               lambda: iter_user_profiles(client['sagemaker'], domain_id, page_size)):
         if dry_run:
             print(f"Dry-run: Deleting User Profile: {user_profile['UserProfileName']}")
         else:
             print(f"Deleting User Profile: {user_profile['UserProfileName']}")
             client.delete_user_profile(DomainId=domain_id, UserProfileName=user_profile['UserProfileName'])
 
+    if not dry_run:
+        wait_deleted(lambda: iter_user_profiles(client['sagemaker'], domain_id, page_size))
+
 
     # Delete Domain Resources
     print(f"Deleting Resources Associated with Domain: {domain_id}")
-    delete_domain_resources(client, domain_id, domain_name, dry_run=dry_run)
+    delete_domain_resources(client, domain_id, domain_name, index, dry_run=dry_run)
 
     # Delete Domain
     if dry_run:
@@ -116,7 +131,7 @@ def get_domain_name(client, domain_id):
     try:
         response=client.describe_domain(DomainId=domain_id)
         print("describe domain response", response)
-        return response['DomainName'] if 'DomaiName' in response else None
+        return response['DomainName'] if 'DomainName' in response else None
     except Exception as e:
         print(f"Error reterving domain name for domain ID '{domain_id}': {e}")
         return None
@@ -126,11 +141,46 @@ def parse_arguments():
     parser.add_argument('--project-id', default=None, help="Project ID suffix to filter domains")
     parser.add_argument('--domain-ids', type=str, default=None, help="Comma-separated list of domain IDs to delete")
     parser.add_argument('--dry-run', action='store_true', help="Perform a dry run without deleting resources")
-    return parser.parse_args()
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help="Number of items requested per list page")
+    parser.add_argument('--discovery', choices=BACKENDS, default=SCAN, help="Find Lambda functions, ENIs and EFS volumes by scanning the account ('scan') or through the tagging API ('tags'), which scans as well when a domain has nothing tagged")
+    parser.add_argument('--plan-out', help="With --dry-run, write the teardown plan to this JSON file")
+    parser.add_argument('--apply', metavar='PLAN', help="Delete exactly the resources in a plan written by --plan-out")
+    parser.add_argument('--poll-deadline', type=int, default=DEFAULT_DEADLINE, help="Seconds to wait for a domain's resources to be deleted when applying a plan")
+    add_client_arguments(parser)
+    add_snapshot_arguments(parser)
+    args = parser.parse_args()
+    if args.plan_out and not args.dry_run:
+        parser.error("--plan-out requires --dry-run")
+    if args.apply and args.dry_run:
+        parser.error("--apply cannot be combined with --dry-run")
+    return args
+
+def apply_plan(path, args):
+    # Deletes exactly what a previous --dry-run --plan-out recorded, without listing again
+    plan = read_plan(path)
+    factory = factory_from_args(args, plan['region'])
+    client = factory.clients('sagemaker', 'lambda', 'ec2', 'efs')
+    snapshot = snapshot_from_args(args)
+    failed = False
+    for domain in plan['domains']:
+        print(f"Applying plan for Domain ID: {domain['DomainId']}")
+        result = graph_from_plan(client, domain, args.page_size).run(Backoff(deadline=args.poll_deadline))
+        invalidate_teardown(snapshot, factory.region, [domain['DomainId']])
+        if result['failed'] or result['blocked']:
+            print(f"Domain {domain['DomainId']}: {len(result['failed'])} resources failed, {len(result['blocked'])} blocked: {result['failed']}")
+            failed = True
+    return not failed
 
 if __name__ == "__main__":
     args = parse_arguments()
-    client = boto3.client('sagemaker')
+    if args.apply:
+        if not apply_plan(args.apply, args):
+            exit(1)
+        print("Deletion completed successfully.")
+        exit(0)
+
+    factory = factory_from_args(args)
+    client = factory.client('sagemaker')
     project_id = args.project_id
     domain_ids = args.domain_ids
 
@@ -168,17 +218,13 @@ if __name__ == "__main__":
         print("Neither Project ID nor domain IDs are provided")
 
 
-    client = {
-        'sagemaker': boto3.client('sagemaker'),
-        'lambda': boto3.client('lambda'),
-        'ec2': boto3.client('ec2'),
-        'efs': boto3.client('efs')
-    }
+    client = factory.clients('sagemaker', 'lambda', 'ec2', 'efs', 'resourcegroupstaggingapi')
+    snapshot = snapshot_from_args(args)
 
-    list_all_domains(client['sagemaker'])
+    list_all_domains(client['sagemaker'], args.page_size, snapshot, factory.region)
 
     if args.project_id:
-        filtered_domains = filter_domain_id_with_project_id(client['sagemaker'], args.project_id)
+        filtered_domains = filter_domain_id_with_project_id(client['sagemaker'], args.project_id, args.page_size, snapshot, factory.region)
         print(f"printing args project-id {project_id}")
         if not filtered_domains:
             print(f"No domains found with project ID '{args.project_id}' as suffix.")
@@ -191,6 +237,18 @@ if __name__ == "__main__":
         print("Please provide either --project-id or --domain-ids argument.")
         exit(1)
 
+    # Discover Lambda functions, ENIs and EFS volumes once for all domains
+    index = build_index(client, [factory.domain_arn(domain['DomainId']) for domain in filtered_domains],
+                        args.discovery, args.page_size, snapshot, factory.region)
+
+    if args.dry_run and args.plan_out:
+        plans = [domain_plan(client, domain, args.page_size, index, snapshot) for domain in filtered_domains]
+        for plan in plans:
+            print_plan(plan)
+        write_plan(args.plan_out, plans, factory.region)
+        print("Dry run completed. No resources were deleted.")
+        exit(0)
+
     for domain in filtered_domains:
         # print("Processing domain:", domain)  # Debug statement
         # print("Number of filtered domain", len(filtered_domains))
@@ -200,7 +258,10 @@ if __name__ == "__main__":
         # print("Domain Name:", domain_name)  # Debug statement
         print(f"Preparing to delete Domain ID: {domain['DomainId']}")
         #delete_domain_resources(client, domain_id, domain_name)
-        delete_domain(client, domain_id, domain_name, dry_run=args.dry_run)
+        delete_domain(client, domain_id, domain_name, page_size=args.page_size, index=index, snapshot=snapshot, dry_run=args.dry_run)
+        if not args.dry_run:
+            # Deleted resources must not be served to the next run
+            invalidate_teardown(snapshot, factory.region, [domain_id])
         
         
 
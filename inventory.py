@@ -0,0 +1,87 @@
+"""
+Paginated inventory of SageMaker domains, apps, user profiles and spaces.
+
+Every listing used by the teardown scripts goes through these generators so
+that nothing past the first page is silently dropped. Items are yielded one
+page at a time, so callers only ever hold a single page in memory.
+"""
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def paginate(client, operation, result_key, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+    """
+    Lazily yield every item returned by a paginated boto3 operation.
+
+    Args:
+        client: Boto3 client that owns the operation.
+        operation (str): Paginated operation name, e.g. 'list_apps'.
+        result_key (str): Response key holding the items, e.g. 'Apps'.
+        page_size (int): Number of items requested per page.
+        **kwargs: Request parameters sent with every page.
+
+    Yields:
+        dict: One item of the response.
+    """
+    paginator = client.get_paginator(operation)
+    for page in paginator.paginate(PaginationConfig={'PageSize': page_size}, **kwargs):
+        yield from page.get(result_key, [])
+
+
+def iter_domains(client, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Yield every SageMaker domain in the account.
+
+    Args:
+        client: Boto3 SageMaker client.
+        page_size (int): Number of domains requested per page.
+    """
+    return paginate(client, 'list_domains', 'Domains', page_size)
+
+
+def iter_apps(client, domain_id, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Yield every app of the given domain.
+
+    Args:
+        client: Boto3 SageMaker client.
+        domain_id (str): Domain ID.
+        page_size (int): Number of apps requested per page.
+    """
+    return paginate(client, 'list_apps', 'Apps', page_size, DomainIdEquals=domain_id)
+
+
+def iter_user_profiles(client, domain_id, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Yield every user profile of the given domain.
+
+    Args:
+        client: Boto3 SageMaker client.
+        domain_id (str): Domain ID.
+        page_size (int): Number of user profiles requested per page.
+    """
+    return paginate(client, 'list_user_profiles', 'UserProfiles', page_size, DomainIdEquals=domain_id)
+
+
+def iter_spaces(client, domain_id, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Yield every space of the given domain.
+
+    Args:
+        client: Boto3 SageMaker client.
+        domain_id (str): Domain ID.
+        page_size (int): Number of spaces requested per page.
+    """
+    return paginate(client, 'list_spaces', 'Spaces', page_size, DomainIdEquals=domain_id)
+
+
+def app_owner(item):
+    """
+    Return the request parameters naming the owner of a listed app, or a listed user profile or space itself.
+
+    Apps run either in a user profile or in a shared space, so delete_app
+    needs whichever of UserProfileName and SpaceName the listing returned.
+    """
+    if item.get('SpaceName'):
+        return {'SpaceName': item['SpaceName']}
+    return {'UserProfileName': item['UserProfileName']}
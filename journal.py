@@ -0,0 +1,121 @@
+"""
+Append-only teardown journal for resuming an interrupted run.
+
+Every run writes one JSON line per event: the domains it will tear down
+(listed up front, or queued one by one when they are streamed from a
+manifest), the resources discovered in each domain, every node that starts or finishes
+deleting and every domain that finishes. When a CI job is killed mid-run,
+``--resume`` replays the journal: finished domains are skipped, finished
+resources are not touched again and in-flight deletes go straight back to
+polling, without listing domains or their resources again.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+RUN = 'run'
+QUEUED = 'queued'
+PLANNED = 'planned'
+NODE = 'node'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+
+class TeardownJournal:
+    """Append-only JSON-lines record of a teardown run."""
+
+    def __init__(self, path, resume=False):
+        """
+        Args:
+            path (str): Journal file, created if missing.
+            resume (bool): If True, replay the existing journal before appending.
+        """
+        self.path = path
+        self.domains = None
+        self.region = None
+        self._resources = {}
+        self._states = collections.defaultdict(dict)
+        self._finished = set()
+        self._lock = threading.Lock()
+        if resume:
+            self._replay()
+        self._file = open(path, 'a')
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by the interrupted run
+                    continue
+                event, domain_id = entry['event'], entry.get('domain')
+                if event == RUN:
+                    self.domains = entry['domains']
+                    self.region = entry.get('region')
+                    self._resources.clear()
+                    self._states.clear()
+                    self._finished.clear()
+                elif event == QUEUED:
+                    self.domains.append(entry['target'])
+                elif event == PLANNED:
+                    self._resources[domain_id] = entry['resources']
+                    self._states[domain_id].clear()
+                elif event == NODE:
+                    self._states[domain_id][entry['node']] = entry['state']
+                elif event == FINISHED:
+                    self._finished.add(domain_id)
+
+    def _record(self, event, domain_id=None, **fields):
+        entry = dict(fields, event=event, domain=domain_id, at=time.time())
+        with self._lock:
+            self._file.write(json.dumps(entry, default=str) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def start(self, domains, region=None):
+        """Record the domains, and the region, a new run will tear down."""
+        self.domains = [dict(domain) for domain in domains]
+        self.region = region
+        self._record(RUN, domains=self.domains, region=region)
+
+    def queued(self, domain):
+        """Record a domain added to the run after it started."""
+        self.domains.append(dict(domain))
+        self._record(QUEUED, domain['DomainId'], target=dict(domain))
+
+    def planned(self, domain_id, resources):
+        """Record the resources discovered in a domain."""
+        self._record(PLANNED, domain_id, resources=resources)
+
+    def listener(self, domain_id):
+        """Return a TeardownGraph listener that records every node state change."""
+        return lambda node: self._record(NODE, domain_id, node=node.node_id, state=node.state, error=node.error)
+
+    def finished(self, domain_id, failed=False):
+        """Record that a domain's teardown completed or failed."""
+        self._record(FAILED if failed else FINISHED, domain_id)
+
+    def pending_domains(self):
+        """Return the journalled domains that have not finished yet."""
+        return [domain for domain in self.domains or [] if domain['DomainId'] not in self._finished]
+
+    def resumed(self, domain_id):
+        """
+        Return what the journal knows about an unfinished domain.
+
+        Returns:
+            dict: 'resources' as discovered and 'states' (node ID -> last
+            recorded state), or None if the domain was never planned.
+        """
+        if domain_id not in self._resources:
+            return None
+        return {'resources': self._resources[domain_id], 'states': dict(self._states[domain_id])}
+
+    def close(self):
+        """Close the journal file."""
+        self._file.close()
@@ -0,0 +1,181 @@
+"""
+Streaming manifests of teardown targets.
+
+A batch decommission lists its targets in a file, or pipes them on stdin,
+instead of squeezing them into --domain-ids or $PROJECT_ID. Each row names
+either a domain ID or a project ID, optionally with the account and region
+the domain lives in:
+
+    domain_id,project_id,role_arn,account,role_name,region
+    d-abc123def456,,,,,eu-west-1
+    ,proj42,arn:aws:iam::111122223333:role/Teardown,,,
+    ,proj43,,444455556666,Teardown,us-east-1
+
+CSV manifests need a header row; JSON Lines manifests hold one object per
+line with the same keys (DomainId, ProjectId, RoleArn, Account, RoleName and
+Region are accepted too). Rows are read one at a time and resolved as they
+come: each account and region's domain list is fetched once, on its first
+row, and project IDs are looked up in a reversed-name suffix index of it, so
+the first teardowns start long before a file of thousands of rows is parsed.
+"""
+import csv
+import itertools
+import json
+import sys
+
+from projects import DomainSuffixIndex
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FORMATS = (CSV, JSONL)
+STDIN = '-'
+EXTENSIONS = {'.csv': CSV, '.jsonl': JSONL, '.ndjson': JSONL}
+
+# Manifest keys, lower-cased without '_' and '-', and the target field they fill
+FIELDS = {
+    'domainid': 'DomainId',
+    'projectid': 'ProjectId',
+    'rolearn': 'RoleArn',
+    'account': 'Account',
+    'accountid': 'Account',
+    'rolename': 'RoleName',
+    'region': 'Region',
+}
+
+
+def _format_of(path, first_line):
+    for extension, manifest_format in EXTENSIONS.items():
+        if path.endswith(extension):
+            return manifest_format
+    # stdin and unknown extensions: JSON Lines start with an object
+    return JSONL if first_line.lstrip().startswith('{') else CSV
+
+
+def read_manifest(path, manifest_format=None):
+    """
+    Lazily yield the rows of a CSV or JSON Lines manifest.
+
+    Args:
+        path (str): Manifest file, or '-' for stdin.
+        manifest_format (str): 'csv' or 'jsonl'; guessed from the extension or first line if None.
+
+    Yields:
+        tuple: (line number, row dictionary) for every non-blank row.
+    """
+    f = sys.stdin if path == STDIN else open(path, newline='')
+    try:
+        first_line = f.readline()
+        lines = itertools.chain([first_line], f)
+        if (manifest_format or _format_of(path, first_line)) == CSV:
+            reader = csv.DictReader(lines)
+            for row in reader:
+                if any(value and value.strip() for value in row.values() if isinstance(value, str)):
+                    yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    print(f"Skipping manifest line {line_number}: {e}")
+                    continue
+                yield line_number, row
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def manifest_target(row):
+    """
+    Normalise a manifest row into a target.
+
+    Args:
+        row (dict): One manifest row.
+
+    Returns:
+        dict: DomainId or ProjectId, and RoleArn and Region where given.
+
+    Raises:
+        ValueError: If the row names neither a domain nor a project, or an
+            account without the role to assume in it.
+    """
+    fields = {}
+    for key, value in row.items():
+        field = FIELDS.get(str(key).lower().replace('_', '').replace('-', ''))
+        if field and value is not None and str(value).strip():
+            fields[field] = str(value).strip()
+    target = {key: fields[key] for key in ('DomainId', 'ProjectId', 'RoleArn', 'Region') if key in fields}
+    if 'Account' in fields and 'RoleArn' not in fields:
+        if 'RoleName' not in fields:
+            raise ValueError(f"account {fields['Account']} needs a role_arn or role_name")
+        target['RoleArn'] = f"arn:aws:iam::{fields['Account']}:role/{fields['RoleName']}"
+    if 'DomainId' not in target and 'ProjectId' not in target:
+        raise ValueError("neither domain_id nor project_id is set")
+    return target
+
+
+def manifest_domains(rows, list_domains, default_region):
+    """
+    Resolve manifest rows into the domains to tear down, as they are read.
+
+    Args:
+        rows: (line number, row) pairs as yielded by read_manifest.
+        list_domains: Callable taking a (role ARN, region) target and returning
+            its domains with DomainId and DomainName; called once per target.
+        default_region (str): Region of rows that do not name one.
+
+    Yields:
+        dict: Domain with DomainId, DomainName, Region, the RoleArn of other
+        accounts and the manifest's ProjectId where given; each domain once.
+    """
+    indexes = {}
+    seen = {}
+    for line_number, row in rows:
+        try:
+            target = manifest_target(row)
+        except (ValueError, AttributeError) as e:
+            print(f"Skipping manifest line {line_number}: {e}")
+            continue
+        key = (target.get('RoleArn'), target.get('Region') or default_region)
+        if key not in indexes:
+            try:
+                indexes[key] = DomainSuffixIndex(list_domains(key))
+            except Exception as e:
+                # The target's other rows are skipped too, without listing it again
+                print(f"Error listing domains in {key[1]} for {key[0] or 'the current account'}: {e}")
+                indexes[key] = None
+        index = indexes[key]
+        if index is None:
+            print(f"Skipping manifest line {line_number}: its domains could not be listed")
+            continue
+        if 'DomainId' in target:
+            domain = index.domains_by_id.get(target['DomainId'])
+            domains = [domain] if domain else []
+            if not domains:
+                print(f"Skipping manifest line {line_number}: domain {target['DomainId']} not found")
+        else:
+            domains = index.ending_with(target['ProjectId'])
+            if not domains:
+                print(f"No domains found with project ID '{target['ProjectId']}' as suffix.")
+        for domain in domains:
+            domain_key = (key, domain['DomainId'])
+            if domain_key in seen:
+                if seen[domain_key] and target.get('ProjectId') not in (None, seen[domain_key]):
+                    # e.g. 'team-xproj1' named by both 'xproj1' and 'proj1'
+                    print(f"Ambiguous manifest line {line_number}: domain {domain['DomainName']} ({domain['DomainId']}) "
+                          f"is already queued for project {seen[domain_key]}")
+                continue
+            seen[domain_key] = target.get('ProjectId')
+            extra = {'Region': key[1]}
+            if key[0]:
+                extra['RoleArn'] = key[0]
+            if 'ProjectId' in target:
+                extra['ProjectId'] = target['ProjectId']
+            yield dict(domain, **extra)
+
+
+def add_manifest_arguments(parser):
+    """Add the --manifest options to an argparse parser."""
+    parser.add_argument('--manifest', help="CSV or JSON Lines file of domain IDs, project IDs, accounts and regions to tear down, or '-' for stdin; read as the teardown runs")
+    parser.add_argument('--manifest-format', choices=FORMATS, help="Format of --manifest (guessed from the extension or first line by default)")
@@ -0,0 +1,208 @@
+"""
+Per-operation metrics of every AWS API call a teardown makes.
+
+ApiMetrics hooks into botocore's event system the same way the rate limiter
+does, so every call of a registered client is measured without the call
+sites knowing about it: call and error counts, a latency histogram (retries
+and rate-limiter waits included, i.e. the time the caller spent blocked),
+retry attempts and throttling errors, per service and operation.
+
+The run-wide collector returned by run_metrics() is written when the process
+exits, as a Prometheus textfile (for node_exporter's textfile collector) if
+the path ends in '.prom', otherwise as JSON.
+"""
+import atexit
+import datetime
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from rate_limit import THROTTLING_CODES
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_SUFFIX = '.prom'
+METRIC_PREFIX = 'sagemaker_teardown_aws_api'
+
+_run_metrics = None
+_run_metrics_lock = threading.Lock()
+
+
+class OperationMetrics:
+    """Counters and latency histogram of one service operation."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def to_dict(self):
+        buckets = {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets)}
+        buckets['+Inf'] = self.calls
+        return {'calls': self.calls, 'errors': self.errors, 'retries': self.retries, 'throttles': self.throttles,
+                'seconds': round(self.seconds, 6), 'buckets': buckets}
+
+
+class ApiMetrics:
+    """API call metrics keyed by (service, operation), shared by every client of a run."""
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): File written by write(); '.prom' selects the Prometheus text format.
+        """
+        self.path = path
+        self.operations = defaultdict(OperationMetrics)
+        self._lock = threading.Lock()
+
+    def _key(self, event_name):
+        # Event names look like 'after-call.sagemaker.DeleteApp'
+        _, service, operation = event_name.split('.', 2)
+        return service, operation
+
+    def _before_call(self, context, **kwargs):
+        context['metrics_started'] = time.monotonic()
+
+    def _after_call(self, event_name, http_response, parsed, context, **kwargs):
+        started = context.get('metrics_started')
+        seconds = time.monotonic() - started if started is not None else 0.0
+        with self._lock:
+            operation = self.operations[self._key(event_name)]
+            operation.observe(seconds)
+            operation.retries += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            if http_response.status_code >= 300:
+                operation.errors += 1
+
+    def _after_call_error(self, event_name, context, **kwargs):
+        # Connection errors and the like, raised before any response was parsed
+        started = context.get('metrics_started')
+        with self._lock:
+            operation = self.operations[self._key(event_name)]
+            operation.observe(time.monotonic() - started if started is not None else 0.0)
+            operation.errors += 1
+
+    def _needs_retry(self, event_name, response=None, **kwargs):
+        if response is None or response[1].get('Error', {}).get('Code') not in THROTTLING_CODES:
+            return
+        with self._lock:
+            self.operations[self._key(event_name)].throttles += 1
+
+    def register(self, client):
+        """
+        Measure every call of a client, boto3 or aiobotocore.
+
+        Args:
+            client: Client whose calls are recorded.
+        """
+        # First, so that the clock also starts for calls answered by another before-call handler
+        client.meta.events.register_first('before-call', self._before_call)
+        client.meta.events.register('after-call', self._after_call)
+        client.meta.events.register('after-call-error', self._after_call_error)
+        client.meta.events.register('needs-retry', self._needs_retry)
+        return client
+
+    def snapshot(self, reset=False):
+        """
+        Return the metrics recorded so far.
+
+        Args:
+            reset (bool): Start counting from zero afterwards, e.g. per Lambda invocation.
+
+        Returns:
+            dict: 'service.Operation' -> counters, total 'seconds' and cumulative
+            latency 'buckets' keyed by upper bound.
+        """
+        with self._lock:
+            operations = {f"{service}.{operation}": metrics.to_dict()
+                          for (service, operation), metrics in sorted(self.operations.items())}
+            if reset:
+                self.operations.clear()
+        return operations
+
+    def prometheus_text(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        operations = self.snapshot()
+        lines = []
+        for name, field, help_text in (
+                ('calls_total', 'calls', "AWS API calls, retries counted once"),
+                ('errors_total', 'errors', "AWS API calls that ended in an error"),
+                ('retries_total', 'retries', "Retry attempts made by botocore"),
+                ('throttles_total', 'throttles', "Attempts rejected with a throttling error")):
+            lines += [f"# HELP {METRIC_PREFIX}_{name} {help_text}.", f"# TYPE {METRIC_PREFIX}_{name} counter"]
+            for key, metrics in operations.items():
+                lines.append(f"{METRIC_PREFIX}_{name}{{{_labels(key)}}} {metrics[field]}")
+        name = f"{METRIC_PREFIX}_call_duration_seconds"
+        lines += [f"# HELP {name} Time callers spent in AWS API calls, retries and rate limiting included.",
+                  f"# TYPE {name} histogram"]
+        for key, metrics in operations.items():
+            for bound, count in metrics['buckets'].items():
+                lines.append(f"{name}_bucket{{{_labels(key)},le=\"{bound}\"}} {count}")
+            lines.append(f"{name}_sum{{{_labels(key)}}} {metrics['seconds']}")
+            lines.append(f"{name}_count{{{_labels(key)}}} {metrics['calls']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path=None):
+        """
+        Atomically write the metrics, as Prometheus text if the path ends in '.prom', else as JSON.
+
+        Args:
+            path (str): Output file; defaults to the path given at construction.
+        """
+        path = path or self.path
+        if not path:
+            return
+        if path.endswith(PROMETHEUS_SUFFIX):
+            content = self.prometheus_text()
+        else:
+            content = json.dumps({'written_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                                  'operations': self.snapshot()}, indent=2)
+        # The textfile collector may read at any moment, so never expose a half-written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        print(f"Wrote AWS API metrics to {path}")
+
+
+def _labels(key):
+    service, operation = key.split('.', 1)
+    return f'service="{service}",operation="{operation}"'
+
+
+def run_metrics(path=None):
+    """
+    Return the run's shared ApiMetrics, created on first use and written at exit.
+
+    Args:
+        path (str): Output file; defaults to $METRICS_OUT.
+
+    Returns:
+        ApiMetrics: The shared collector, or None if no output file is configured.
+    """
+    global _run_metrics
+    path = path or os.getenv('METRICS_OUT')
+    with _run_metrics_lock:
+        if _run_metrics is None:
+            if not path:
+                return None
+            _run_metrics = ApiMetrics(path)
+            atexit.register(_run_metrics.write)
+        elif path:
+            _run_metrics.path = path
+        return _run_metrics
+
+
+def add_metrics_arguments(parser):
+    """Add the --metrics-out option to an argparse parser."""
+    parser.add_argument('--metrics-out', default=os.getenv('METRICS_OUT'), help="Write per-operation AWS API metrics to this file at exit, as a Prometheus textfile if it ends in '.prom', else as JSON (defaults to $METRICS_OUT)")
@@ -0,0 +1,103 @@
+"""
+Teardown plans: what a dry run found, written down so a later run can apply it.
+
+``--dry-run --plan-out plan.json`` lists every domain's resources once and
+writes them, with their dependencies and the order they will be deleted in,
+to a JSON file that can be reviewed. ``--apply plan.json`` rebuilds the
+teardown graphs from that file without listing anything again. Only resources
+whose recorded status was transitional are re-checked before deleting; drift
+on the others shows up as a not-found error on delete, which counts as gone.
+"""
+import datetime
+import json
+
+from inventory import DEFAULT_PAGE_SIZE
+from polling import DELETED_STATUSES
+from teardown_graph import discover_domain_resources, graph_from_resources
+
+PLAN_VERSION = 1
+# Statuses that do not change on their own: SageMaker's, EFS file systems' and mount targets', and ENIs'
+STABLE_STATUSES = ('InService', 'available', 'in-use') + DELETED_STATUSES
+
+
+def domain_plan(client, domain, page_size=DEFAULT_PAGE_SIZE, index=None, snapshot=None):
+    """
+    Discover a domain's resources and describe how they would be torn down.
+
+    Args:
+        client (dict): Boto3 clients keyed by 'sagemaker', 'ec2' and 'efs'.
+        domain (dict): Domain with DomainId and, optionally, DomainName, Region and RoleArn.
+        page_size (int): Number of items requested per list page.
+        index (ResourceIndex): Account-wide index of ENIs and EFS volumes, if any.
+        snapshot (InventorySnapshot): Snapshot to read the domain's listings from, if any.
+
+    Returns:
+        dict: The domain's keys, 'resources' and 'order' (node IDs per wave).
+    """
+    domain_id = domain['DomainId']
+    resources = discover_domain_resources(client, domain_id, page_size, index, snapshot)
+    graph = graph_from_resources(client, domain_id, resources, page_size)
+    return dict(domain, DomainName=domain.get('DomainName'), order=graph.waves(), resources=resources)
+
+
+def write_plan(path, domain_plans, region=None):
+    """
+    Write domain plans to a JSON file.
+
+    Args:
+        path (str): Output file.
+        domain_plans (list): Plans returned by domain_plan.
+        region (str): Default region of the plans; a domain's own Region takes precedence.
+    """
+    plan = {
+        'version': PLAN_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'region': region,
+        'domains': domain_plans,
+    }
+    with open(path, 'w') as f:
+        json.dump(plan, f, indent=2)
+    print(f"Wrote teardown plan for {len(domain_plans)} domains to {path}")
+
+
+def read_plan(path):
+    """
+    Read a plan written by write_plan.
+
+    Raises:
+        ValueError: If the file was written by an incompatible version.
+    """
+    with open(path) as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version {plan.get('version')} in {path}, expected {PLAN_VERSION}")
+    return plan
+
+
+def print_plan(domain_plan):
+    """Print the resources of a domain plan in the order they would be deleted."""
+    print(f"Dry-run: Domain {domain_plan['DomainId']} ({domain_plan['DomainName']}), "
+          f"{len(domain_plan['resources'])} resources")
+    for step, wave in enumerate(domain_plan['order'], 1):
+        for node_id in wave:
+            print(f"  {step}. {node_id}")
+
+
+def graph_from_plan(client, domain_plan, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Rebuild a domain's teardown graph from its plan, re-checking stale statuses.
+
+    Args:
+        client (dict): Boto3 clients keyed by 'sagemaker', 'ec2' and 'efs'.
+        domain_plan (dict): One entry of a plan's 'domains'.
+        page_size (int): Number of items requested per list page while polling.
+
+    Returns:
+        TeardownGraph: Graph ready to run.
+    """
+    graph = graph_from_resources(client, domain_plan['DomainId'], domain_plan['resources'], page_size)
+    drifting = [resource['id'] for resource in domain_plan['resources']
+                if resource['status'] is not None and resource['status'] not in STABLE_STATUSES]
+    if drifting:
+        graph.recheck(drifting)
+    return graph
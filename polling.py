@@ -0,0 +1,186 @@
+"""
+Status polling for SageMaker teardown.
+
+Replaces the ``time.sleep(retry_time); retry_time *= 3`` loops with jittered
+exponential backoff that is capped and bounded by an overall deadline, and
+resolves the status of every pending app, user profile or space of a domain
+from a single list call per tick instead of one describe per resource. EFS
+mount targets are resolved the same way, one describe per file system.
+"""
+import random
+import time
+
+import botocore.exceptions
+
+from inventory import DEFAULT_PAGE_SIZE, iter_apps, iter_spaces, iter_user_profiles, paginate
+
+GONE = 'Gone'
+DELETED_STATUSES = ('Deleted', 'deleted')
+
+DEFAULT_BASE_DELAY = 2
+DEFAULT_MAX_DELAY = 30
+DEFAULT_DEADLINE = 3600
+
+
+class PollTimeout(Exception):
+    """Raised when resources are still pending after the polling deadline."""
+
+
+class Backoff:
+    """Jittered exponential backoff with a cap and an overall deadline."""
+
+    def __init__(self, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, deadline=DEFAULT_DEADLINE):
+        """
+        Args:
+            base_delay (float): Delay in seconds before the first retry.
+            max_delay (float): Upper bound for a single delay.
+            deadline (float): Seconds after which polling gives up, or None.
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expires_at = time.monotonic() + deadline if deadline else None
+        self.attempt = 0
+
+    def reset(self):
+        """Start again from the base delay, e.g. after progress was made."""
+        self.attempt = 0
+
+    def next_delay(self):
+        """Return the next delay, drawn uniformly from the upper half of the window."""
+        delay = min(self.max_delay, self.base_delay * 2 ** self.attempt)
+        self.attempt += 1
+        return random.uniform(delay / 2, delay)
+
+    def next_wait(self):
+        """Return the next delay, cut short at the deadline; raise PollTimeout past it."""
+        delay = self.next_delay()
+        if self.expires_at is not None:
+            remaining = self.expires_at - time.monotonic()
+            if remaining <= 0:
+                raise PollTimeout(f"Resources still pending after deadline (attempt {self.attempt})")
+            delay = min(delay, remaining)
+        return delay
+
+    def sleep(self):
+        """Sleep for the next delay, never past the deadline."""
+        time.sleep(self.next_wait())
+
+
+def drain(list_items, delete_item, delete_statuses, backoff=None):
+    """
+    Delete listed resources and wait until none of them is left deleting.
+
+    Every tick lists the resources once, issues deletes for those in one of
+    ``delete_statuses`` and keeps polling while any of them is 'Deleting'.
+
+    Args:
+        list_items: Callable returning an iterable of resources with a 'Status'.
+        delete_item: Callable issuing the delete call for one resource.
+        delete_statuses: Statuses for which a delete call is issued.
+        backoff (Backoff): Polling schedule; a default one is used if None.
+    """
+    backoff = backoff or Backoff()
+    while True:
+        waiting = False
+        for item in list_items():
+            if item['Status'] in delete_statuses:
+                delete_item(item)
+                waiting = True
+            elif item['Status'] == 'Deleting':
+                waiting = True
+        if not waiting:
+            return
+        backoff.sleep()
+
+
+def wait_deleted(list_items, backoff=None):
+    """
+    Wait until none of the listed resources is left deleting, without deleting any.
+
+    Args:
+        list_items: Callable returning an iterable of resources with a 'Status'.
+        backoff (Backoff): Polling schedule; a default one is used if None.
+    """
+    drain(list_items, None, (), backoff)
+
+
+class DomainStatus:
+    """Statuses of a domain's apps, user profiles and spaces, listed at most once per tick."""
+
+    def __init__(self, client, domain_id, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Args:
+            client: Boto3 SageMaker client.
+            domain_id (str): Domain ID.
+            page_size (int): Number of items requested per list page.
+        """
+        self.client = client
+        self.domain_id = domain_id
+        self.page_size = page_size
+        self._listings = {}
+
+    def refresh(self):
+        """Forget the current listings so the next lookup lists again."""
+        self._listings.clear()
+
+    def _status(self, kind, key):
+        if kind not in self._listings:
+            if kind == 'apps':
+                self._listings[kind] = {
+                    (app.get('SpaceName') or app.get('UserProfileName'), app['AppType'], app['AppName']): app['Status']
+                    for app in iter_apps(self.client, self.domain_id, self.page_size)}
+            elif kind == 'user_profiles':
+                self._listings[kind] = {
+                    user_profile['UserProfileName']: user_profile['Status']
+                    for user_profile in iter_user_profiles(self.client, self.domain_id, self.page_size)}
+            else:
+                self._listings[kind] = {
+                    space['SpaceName']: space['Status']
+                    for space in iter_spaces(self.client, self.domain_id, self.page_size)}
+        status = self._listings[kind].get(key, GONE)
+        return GONE if status in DELETED_STATUSES else status
+
+    def app(self, owner, app_type, app_name):
+        """Return the status of an app owned by a user profile or space."""
+        return self._status('apps', (owner, app_type, app_name))
+
+    def user_profile(self, name):
+        """Return the status of a user profile."""
+        return self._status('user_profiles', name)
+
+    def space(self, name):
+        """Return the status of a space."""
+        return self._status('spaces', name)
+
+
+class MountTargetStatus:
+    """Lifecycle states of EFS mount targets, described at most once per file system and tick."""
+
+    def __init__(self, client, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Args:
+            client: Boto3 EFS client.
+            page_size (int): Number of mount targets requested per page.
+        """
+        self.client = client
+        self.page_size = page_size
+        self._listings = {}
+
+    def refresh(self):
+        """Forget the current listings so the next lookup describes again."""
+        self._listings.clear()
+
+    def mount_target(self, file_system_id, mount_target_id):
+        """Return the lifecycle state of one of a file system's mount targets, or GONE."""
+        if file_system_id not in self._listings:
+            try:
+                self._listings[file_system_id] = {
+                    mount_target['MountTargetId']: mount_target['LifeCycleState']
+                    for mount_target in paginate(self.client, 'describe_mount_targets', 'MountTargets',
+                                                 self.page_size, FileSystemId=file_system_id)}
+            except botocore.exceptions.ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'FileSystemNotFound':
+                    raise
+                self._listings[file_system_id] = {}
+        status = self._listings[file_system_id].get(mount_target_id, GONE)
+        return GONE if status in DELETED_STATUSES else status
@@ -0,0 +1,161 @@
+"""
+Matching many project IDs against the domain inventory at once.
+
+A domain belongs to a project when its name ends with the project ID.
+Decommissioning batches cover hundreds of projects, so instead of one
+endswith() scan of the domain list per project, DomainSuffixIndex stores the
+reversed domain names in a trie. A project ID is walked backwards from the
+root once, and every name below the node it ends on ends with it: the cost
+is the project ID's length plus the names it matches, not the inventory.
+The same index serves a whole batch (match) and project IDs that arrive one
+at a time, e.g. streamed from a manifest (ending_with).
+
+A domain name that ends with several of the project IDs, e.g. 'team-xproj1'
+with both 'proj1' and 'xproj1' in the batch, is an ambiguous suffix
+collision. It is attributed to the longest (most specific) project ID and
+reported, so that a wrong attribution is caught before anything is deleted.
+"""
+import re
+
+# Trie key marking the end of a domain name; never a character
+_END = None
+
+
+class DomainSuffixIndex:
+    """Reversed-name trie over a domain inventory, answering which domains end with a project ID."""
+
+    def __init__(self, domains=()):
+        """
+        Args:
+            domains: Domains as returned by list_domains, with DomainId and DomainName.
+        """
+        self.domains_by_id = {}
+        self._positions = {}
+        self._root = {}
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain):
+        """Add a domain to the index."""
+        domain = {'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']}
+        node = self._root
+        for char in reversed(domain['DomainName']):
+            node = node.setdefault(char, {})
+        node.setdefault(_END, []).append(domain)
+        self.domains_by_id[domain['DomainId']] = domain
+        self._positions.setdefault(domain['DomainId'], len(self._positions))
+
+    def ending_with(self, project_id):
+        """
+        Return the domains whose name ends with a project ID.
+
+        Args:
+            project_id (str): Project ID suffix.
+
+        Returns:
+            list: Domains with DomainId and DomainName.
+        """
+        node = self._root
+        for char in reversed(project_id):
+            node = node.get(char)
+            if node is None:
+                return []
+        # Every name below the project ID's node ends with it
+        domains, stack = [], [node]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key is _END:
+                    domains.extend(child)
+                else:
+                    stack.append(child)
+        return domains
+
+    def match(self, project_ids):
+        """
+        Resolve a batch of project IDs against the indexed domains.
+
+        Args:
+            project_ids: Project IDs to match; blanks and duplicates are ignored.
+
+        Returns:
+            dict: 'domains', the matching domains with DomainId, DomainName and
+            the ProjectId they are attributed to; 'ambiguous', those matching
+            several project IDs with all of them in 'ProjectIds', longest
+            first; and 'unmatched', the project IDs that matched no domain.
+        """
+        project_ids = list(dict.fromkeys(project_id.strip() for project_id in project_ids if project_id.strip()))
+        matches, unmatched = {}, []
+        for project_id in project_ids:
+            domains = self.ending_with(project_id)
+            if not domains:
+                unmatched.append(project_id)
+            for domain in domains:
+                matches.setdefault(domain['DomainId'], (domain, []))[1].append(project_id)
+        matched, ambiguous = [], []
+        # In inventory order, like a scan of the domain list
+        for domain_id in sorted(matches, key=self._positions.get):
+            domain, domain_project_ids = matches[domain_id]
+            domain_project_ids.sort(key=len, reverse=True)
+            match = dict(domain, ProjectId=domain_project_ids[0])
+            matched.append(match)
+            if len(domain_project_ids) > 1:
+                ambiguous.append(dict(match, ProjectIds=domain_project_ids))
+        return {'domains': matched, 'ambiguous': ambiguous, 'unmatched': unmatched}
+
+
+def parse_project_ids(text):
+    """
+    Split a list of project IDs separated by commas, whitespace or newlines.
+
+    Everything after a '#' on a line is a comment.
+
+    Args:
+        text (str): Project IDs, e.g. the contents of a manifest file.
+
+    Returns:
+        list: The project IDs, in order.
+    """
+    project_ids = []
+    for line in text.splitlines():
+        project_ids += [project_id for project_id in re.split(r'[\s,]+', line.split('#', 1)[0]) if project_id]
+    return project_ids
+
+
+def project_ids_from_args(args):
+    """
+    Collect the project IDs named on the command line.
+
+    --project-ids and --project-ids-file take precedence over the single --project-id.
+
+    Returns:
+        list: Project IDs, empty if none was given.
+    """
+    project_ids = parse_project_ids(args.project_ids or '')
+    if args.project_ids_file:
+        with open(args.project_ids_file) as f:
+            project_ids += parse_project_ids(f.read())
+    if not project_ids and args.project_id:
+        project_ids = [args.project_id]
+    return list(dict.fromkeys(project_ids))
+
+
+def add_project_arguments(parser):
+    """Add the batch project ID options to an argparse parser."""
+    parser.add_argument('--project-ids', help="Comma-separated project IDs; domains whose name ends with any of them are torn down")
+    parser.add_argument('--project-ids-file', help="Manifest of project IDs, one or more per line, '#' starts a comment")
+
+
+def print_project_report(result, label=''):
+    """
+    Print the ambiguous and unmatched project IDs of a match.
+
+    Args:
+        result (dict): As returned by DomainSuffixIndex.match.
+        label (str): Prefix of each line, e.g. the account and region.
+    """
+    for domain in result['ambiguous']:
+        print(f"{label}Ambiguous project suffix: domain {domain['DomainName']} ({domain['DomainId']}) ends with "
+              f"{', '.join(domain['ProjectIds'])}; attributed to {domain['ProjectId']}")
+    for project_id in result['unmatched']:
+        print(f"{label}No domains found with project ID '{project_id}' as suffix.")
@@ -0,0 +1,156 @@
+"""
+Client-side rate limiting per AWS service and operation.
+
+Every HTTP request a client sends, retries included, first takes a token
+from the bucket of its account, region and operation, e.g. (None,
+'us-east-1', 'sagemaker', 'DeleteApp'), since AWS throttles each account and
+region separately. A bucket halves its rate when AWS answers with a
+throttling error and grows it back by roughly one request per second every
+second while calls succeed, so parallel workers settle just below the
+operation's real TPS limit instead of all retrying into it.
+
+The scripts only limit their calls when --rate-limit is given; by default
+they rely on botocore's own retries.
+
+The limiter hooks into botocore's event system, so it covers every call a
+client makes without the call sites knowing about it.
+"""
+import asyncio
+import functools
+import threading
+import time
+
+THROTTLING_CODES = (
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'RequestThrottled', 'SlowDown',
+)
+
+DEFAULT_RATE = 5.0
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 50.0
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 1.0
+
+
+class TokenBucket:
+    """Token bucket whose rate adapts to throttling (additive increase, multiplicative decrease)."""
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE):
+        """
+        Args:
+            rate (float): Initial requests per second.
+            min_rate (float): Rate never shrinks below this.
+            max_rate (float): Rate never grows above this.
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.throttles = 0
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._decreased = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            capacity = max(1.0, self.rate)
+            self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def throttled(self):
+        """Shrink the rate after a throttling error, at most once per cooldown."""
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._decreased >= DECREASE_COOLDOWN:
+                self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+                self._decreased = now
+
+    def succeeded(self):
+        """Grow the rate after a successful call."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+
+class RateLimiter:
+    """Token buckets keyed by (account, region, service, operation), shared by every client of a run."""
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE):
+        """
+        Args:
+            rate (float): Initial requests per second of each operation.
+            min_rate (float): Lower bound of an operation's rate.
+            max_rate (float): Upper bound of an operation's rate.
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, account, region, service, operation):
+        """Return the bucket of an operation in an account and region, creating it on first use."""
+        key = (account, region, service, operation)
+        with self._lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(self.rate, self.min_rate, self.max_rate)
+            return self.buckets[key]
+
+    def _bucket_for_event(self, scope, event_name):
+        # Event names look like 'before-send.sagemaker.DeleteApp'
+        _, service, operation = event_name.split('.', 2)
+        return self.bucket(*scope, service, operation)
+
+    def _before_send(self, scope, event_name, **kwargs):
+        time.sleep(self._bucket_for_event(scope, event_name).reserve())
+
+    async def _before_send_async(self, scope, event_name, **kwargs):
+        await asyncio.sleep(self._bucket_for_event(scope, event_name).reserve())
+
+    def _needs_retry(self, scope, event_name, response=None, **kwargs):
+        if response is None:
+            return
+        bucket = self._bucket_for_event(scope, event_name)
+        if response[1].get('Error', {}).get('Code') in THROTTLING_CODES:
+            bucket.throttled()
+        elif response[0].status_code < 400:
+            bucket.succeeded()
+
+    def register(self, client, account=None, asynchronous=False):
+        """
+        Route every request of a client through the limiter.
+
+        Args:
+            client: Boto3 client, or aiobotocore client if ``asynchronous``.
+            account (str): Account the client acts in, or None for the run's own.
+            asynchronous (bool): Wait for tokens with asyncio.sleep instead of blocking.
+        """
+        scope = (account, client.meta.region_name)
+        before_send = self._before_send_async if asynchronous else self._before_send
+        client.meta.events.register('before-send', functools.partial(before_send, scope))
+        client.meta.events.register('needs-retry', functools.partial(self._needs_retry, scope))
+        return client
+
+    def print_report(self):
+        """Print the current rate and throttle count of every throttled operation."""
+        for (account, region, service, operation), bucket in sorted(self.buckets.items(), key=lambda item: str(item[0])):
+            if bucket.throttles:
+                where = f"{account}/{region}" if account else region
+                print(f"  {where} {service}.{operation}: {bucket.rate:.1f} req/s after {bucket.throttles} throttles")
+
+
+def add_rate_limit_arguments(parser):
+    """Add the rate limiter options to an argparse parser."""
+    parser.add_argument('--rate-limit', type=float, default=0, help=f"Initial requests per second per AWS operation, adapted to throttling, e.g. {DEFAULT_RATE:g} (default 0: disabled)")
+    parser.add_argument('--max-rate-limit', type=float, default=DEFAULT_MAX_RATE, help="Highest requests per second an AWS operation may grow to")
+
+
+def rate_limiter_from_args(args):
+    """Create the RateLimiter named on the command line, or return None if disabled."""
+    if not args.rate_limit:
+        return None
+    return RateLimiter(args.rate_limit, min(DEFAULT_MIN_RATE, args.rate_limit), max(args.rate_limit, args.max_rate_limit))
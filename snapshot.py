@@ -0,0 +1,170 @@
+"""
+On-disk inventory snapshot shared by the stages of a teardown pipeline.
+
+The listing job, the dry-run and the real teardown all need the same
+domains, apps, user profiles, spaces, Lambda functions, ENIs and EFS volumes.
+The first stage stores what it listed in a local SQLite file; later stages
+read it back while it is younger than the per-kind TTL instead of calling the
+APIs again. ``--refresh`` ignores the stored listings and rescans.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTLS = {
+    'domains': 900,
+    'apps': 300,
+    'user_profiles': 300,
+    'spaces': 300,
+    'functions': 1800,
+    'network_interfaces': 900,
+    'file_systems': 1800,
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS listings (
+    kind TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (kind, scope)
+);
+CREATE TABLE IF NOT EXISTS items (
+    kind TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (kind, scope, position)
+);
+'''
+
+
+class InventorySnapshot:
+    """SQLite-backed cache of listings, keyed by kind and scope."""
+
+    def __init__(self, path, ttls=None, refresh=False):
+        """
+        Args:
+            path (str): SQLite file, created if missing.
+            ttls (dict): Seconds a listing stays fresh, per kind; merged over DEFAULT_TTLS.
+            refresh (bool): If True, ignore stored listings and overwrite them.
+        """
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def items(self, kind, scope, fetch):
+        """
+        Return a listing from the snapshot if it is fresh, otherwise fetch and store it.
+
+        Args:
+            kind (str): Kind of resource, e.g. 'apps'.
+            scope (str): What the listing covers, e.g. a domain ID or a region.
+            fetch: Callable returning an iterable of JSON-serialisable items.
+
+        Returns:
+            list: The listed items.
+        """
+        if not self.refresh:
+            stored = self._load(kind, scope)
+            if stored is not None:
+                return stored
+        items = list(fetch())
+        self._store(kind, scope, items)
+        return items
+
+    def _load(self, kind, scope):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fetched_at FROM listings WHERE kind = ? AND scope = ?', (kind, scope)).fetchone()
+            if row is None or time.time() - row[0] > self.ttls.get(kind, 0):
+                return None
+            rows = self._db.execute(
+                'SELECT body FROM items WHERE kind = ? AND scope = ? ORDER BY position', (kind, scope)).fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def _store(self, kind, scope, items):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM items WHERE kind = ? AND scope = ?', (kind, scope))
+            self._db.executemany(
+                'INSERT INTO items (kind, scope, position, body) VALUES (?, ?, ?, ?)',
+                ((kind, scope, position, json.dumps(item, default=str)) for position, item in enumerate(items)))
+            self._db.execute(
+                'INSERT OR REPLACE INTO listings (kind, scope, fetched_at) VALUES (?, ?, ?)',
+                (kind, scope, time.time()))
+
+    def invalidate(self, kind=None, scope=None):
+        """Forget stored listings matching the kind and/or scope (all if both are None)."""
+        clauses = [(column, value) for column, value in (('kind', kind), ('scope', scope)) if value is not None]
+        where = ' AND '.join(f'{column} = ?' for column, _ in clauses) or '1'
+        params = [value for _, value in clauses]
+        with self._lock, self._db:
+            self._db.execute(f'DELETE FROM listings WHERE {where}', params)
+            self._db.execute(f'DELETE FROM items WHERE {where}', params)
+
+    def close(self):
+        """Close the SQLite connection."""
+        self._db.close()
+
+
+def cached(snapshot, kind, scope, fetch):
+    """Read a listing through the snapshot, or call ``fetch`` directly if there is none."""
+    if snapshot is None:
+        return fetch()
+    return snapshot.items(kind, scope, fetch)
+
+
+def invalidate_teardown(snapshot, scope, domain_ids=()):
+    """
+    Forget the listings a teardown made stale, so the next run lists again.
+
+    Args:
+        snapshot (InventorySnapshot): Snapshot to invalidate, or None.
+        scope (str): Snapshot scope of the account-wide listings, e.g. the region.
+        domain_ids: IDs of the domains torn down, whose apps, user profiles and spaces are gone.
+    """
+    if snapshot is None:
+        return
+    for domain_id in domain_ids:
+        snapshot.invalidate(scope=domain_id)
+    for kind in ('domains', 'functions', 'file_systems'):
+        snapshot.invalidate(kind, scope)
+    # ENI listings are stored per filter set, so none of them can be trusted any more
+    snapshot.invalidate('network_interfaces')
+
+
+def parse_ttls(values):
+    """
+    Parse ``kind=seconds`` overrides from the command line.
+
+    Args:
+        values (list): Strings such as 'apps=60'.
+
+    Returns:
+        dict: Seconds per kind.
+    """
+    ttls = {}
+    for value in values or []:
+        kind, _, seconds = value.partition('=')
+        if kind not in DEFAULT_TTLS or not seconds.isdigit():
+            raise ValueError(f"Invalid snapshot TTL '{value}', expected one of {sorted(DEFAULT_TTLS)}=<seconds>")
+        ttls[kind] = int(seconds)
+    return ttls
+
+
+def add_snapshot_arguments(parser):
+    """Add the snapshot options to an argparse parser."""
+    parser.add_argument('--snapshot', default=os.getenv('INVENTORY_SNAPSHOT'), help="SQLite inventory snapshot shared by pipeline stages (defaults to $INVENTORY_SNAPSHOT)")
+    parser.add_argument('--snapshot-ttl', action='append', default=[], metavar='KIND=SECONDS', help="Override how long a kind of listing stays fresh")
+    parser.add_argument('--refresh', action='store_true', help="Ignore the snapshot and rescan every service")
+
+
+def snapshot_from_args(args):
+    """Open the snapshot named on the command line, or return None."""
+    if not args.snapshot:
+        return None
+    return InventorySnapshot(args.snapshot, parse_ttls(args.snapshot_ttl), args.refresh)
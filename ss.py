@@ -3,78 +3,293 @@ import sys
 import boto3
 import csp
 import time
+import argparse
+import itertools
+from aws_clients import (add_account_arguments, add_client_arguments, add_region_arguments, factory_from_args, fan_out,
+                         parse_role_arns)
+from credential_cache import cached_login
+from discovery import BACKENDS, SCAN, build_index
+from events import add_event_arguments, events_from_args
+from inventory import DEFAULT_PAGE_SIZE, iter_domains
+from journal import TeardownJournal
+from manifest import add_manifest_arguments, manifest_domains, read_manifest
+from plan import domain_plan, graph_from_plan, print_plan, read_plan, write_plan
+from polling import DEFAULT_DEADLINE, Backoff
+from projects import DomainSuffixIndex, add_project_arguments, print_project_report, project_ids_from_args
+from snapshot import add_snapshot_arguments, cached, invalidate_teardown, snapshot_from_args
+from teardown_graph import discover_domain_resources, graph_from_resources
+from teardown_pool import DEFAULT_WORKERS, print_summary, run_teardowns
 
 os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
 
-def filter_domain_id_with_project_id(client, project_id):
-    filtered_domain_ids = []
-    domains = client.list_domains()
-    for domain in domains['Domains']:
-        if domain['DomainName'].endswith(project_id):
-            filtered_domain_ids.append({'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']})
-    return filtered_domain_ids
+def filter_domain_id_with_project_id(client, project_ids, page_size=DEFAULT_PAGE_SIZE, snapshot=None, scope=''):
+    # Every project ID of the batch is looked up in one suffix index of the domain list, see projects.py
+    index = DomainSuffixIndex(cached(snapshot, 'domains', scope, lambda: iter_domains(client, page_size)))
+    return index.match(project_ids)
 
-def delete_domain(client, domain_id):
-    work_to_do = True
-    retry_time = 5
+def delete_domain(client, domain_id, page_size=DEFAULT_PAGE_SIZE, deadline=DEFAULT_DEADLINE, index=None, snapshot=None, journal=None, events=None):
+    # Apps, user profiles, spaces, the domain, its ENIs and EFS volumes are
+    # deleted in dependency order, each as soon as its predecessors are gone
+    resumed = journal.resumed(domain_id) if journal is not None else None
+    if resumed is not None:
+        # Finished resources are skipped and in-flight deletes go straight back to polling
+        resources = resumed['resources']
+        graph = graph_from_resources(client, domain_id, resources, page_size)
+        graph.restore(resumed['states'])
+    else:
+        resources = discover_domain_resources(client, domain_id, page_size, index, snapshot)
+        if journal is not None:
+            journal.planned(domain_id, resources)
+        graph = graph_from_resources(client, domain_id, resources, page_size)
+    if events is not None:
+        events.discovered(domain_id, resources)
+    return run_graph(graph, domain_id, deadline, snapshot, journal, events)
 
-    while work_to_do:
-        work_to_do = False
-        apps = client.list_apps(DomainIdEquals=domain_id)
-        
-        for app in apps['Apps']:
-            if app['Status'] == 'InService' or app['Status'] == 'Delete_Failed':
-                print(client.delete_app(DomainId=domain_id, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName']))
-            elif app['Status'] == 'Deleting':
-                work_to_do = True
-                time.sleep(retry_time)
-                retry_time *= 3
-
-    work_to_do = True
-    retry_time = 5
-
-    while work_to_do:
-        work_to_do = False
-        user_profiles = client.list_user_profiles(DomainIdEquals=domain_id)
-        
-        for user_profile in user_profiles['UserProfiles']:
-            if user_profile['Status'] == 'InService':
-                print(client.delete_user_profile(DomainId=domain_id, UserProfileName=user_profile['UserProfileName']))
-            elif user_profile['Status'] == 'Deleting':
-                work_to_do = True
-                time.sleep(retry_time)
-                retry_time *= 3
+def apply_domain_plan(client, plan, page_size=DEFAULT_PAGE_SIZE, deadline=DEFAULT_DEADLINE, snapshot=None, journal=None, events=None):
+    # Deletes exactly the resources recorded in the plan, without listing them again
+    graph = graph_from_plan(client, plan, page_size)
+    if journal is not None:
+        journal.planned(plan['DomainId'], plan['resources'])
+    if events is not None:
+        events.discovered(plan['DomainId'], plan['resources'])
+    return run_graph(graph, plan['DomainId'], deadline, snapshot, journal, events)
+
+def run_graph(graph, domain_id, deadline=DEFAULT_DEADLINE, snapshot=None, journal=None, events=None):
+    if journal is not None:
+        graph.listeners.append(journal.listener(domain_id))
+    if events is not None:
+        graph.listeners.append(events.listener(domain_id))
+    result = graph.run(Backoff(deadline=deadline))
+    if snapshot is not None:
+        snapshot.invalidate(scope=domain_id)
+    failed = bool(result['failed'] or result['blocked'])
+    if journal is not None:
+        journal.finished(domain_id, failed)
+    if failed:
+        raise RuntimeError(f"{len(result['failed'])} resources failed, {len(result['blocked'])} blocked: {result['failed']}")
+    return result
 
-    # Uncomment if needed
-    # sm_spaces = client.list_spaces(DomainIdEquals=domain_id)
-    # for sm_space in sm_spaces['Spaces']:
-    #     print(client.delete_space(DomainId=domain_id, SpaceName=sm_space['SpaceName']))
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Delete SageMaker domains for a project")
+    parser.add_argument('--project-id', default=os.getenv('PROJECT_ID'), help="Project ID suffix to filter domains (defaults to $PROJECT_ID)")
+    add_project_arguments(parser)
+    add_manifest_arguments(parser)
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', DEFAULT_WORKERS)), help="Number of domains torn down in parallel")
+    parser.add_argument('--page-size', type=int, default=int(os.getenv('PAGE_SIZE', DEFAULT_PAGE_SIZE)), help="Number of items requested per list page")
+    parser.add_argument('--poll-deadline', type=int, default=DEFAULT_DEADLINE, help="Seconds to wait for a domain's resources to be deleted")
+    parser.add_argument('--discovery', choices=BACKENDS, default=SCAN, help="Find ENIs and EFS volumes by scanning the account ('scan') or through the tagging API ('tags'), which scans as well when a domain has nothing tagged")
+    parser.add_argument('--dry-run', action='store_true', help="List what would be deleted, in dependency order, without deleting anything")
+    parser.add_argument('--plan-out', help="With --dry-run, write the teardown plan to this JSON file")
+    parser.add_argument('--apply', metavar='PLAN', help="Delete exactly the resources in a plan written by --plan-out")
+    parser.add_argument('--journal', default=os.getenv('TEARDOWN_JOURNAL'), help="Append-only journal of the run, used by --resume (defaults to $TEARDOWN_JOURNAL)")
+    parser.add_argument('--resume', action='store_true', help="Continue the run recorded in --journal instead of listing domains again")
+    add_client_arguments(parser)
+    add_region_arguments(parser)
+    add_account_arguments(parser)
+    add_snapshot_arguments(parser)
+    add_event_arguments(parser)
+    args = parser.parse_args()
+    if args.resume and not args.journal:
+        parser.error("--resume requires --journal")
+    if args.resume and (args.apply or args.dry_run):
+        parser.error("--resume cannot be combined with --apply or --dry-run")
+    if args.plan_out and not args.dry_run:
+        parser.error("--plan-out requires --dry-run")
+    if args.apply and args.dry_run:
+        parser.error("--apply cannot be combined with --dry-run")
+    if args.manifest and (args.resume or args.apply):
+        parser.error("--manifest cannot be combined with --resume or --apply")
+    return args
 
-    print(client.delete_domain(DomainId=domain_id, RetentionPolicy={'HomeEfsFileSystem': 'Delete'}))
+SERVICES = ('sagemaker', 'ec2', 'efs', 'resourcegroupstaggingapi')
+# Domains read from a manifest before their ENIs and EFS volumes are discovered together
+MANIFEST_CHUNK_SIZE = 50
+
+def target_of(domain, default_region):
+    # Domains are processed per (role ARN, region); a None role is the current account
+    return (domain.get('RoleArn'), domain.get('Region') or default_region)
+
+def target_label(role_arn, region):
+    # Snapshot scope and report prefix of an account and region
+    return f"{role_arn.split(':')[4]}/{region}" if role_arn else region
+
+def find_domains(factory, target, project_ids, page_size=DEFAULT_PAGE_SIZE, snapshot=None):
+    # A target that cannot be listed is reported and skipped so the others still run
+    role_arn, region = target
+    try:
+        result = filter_domain_id_with_project_id(factory.client('sagemaker', region), project_ids, page_size, snapshot, target_label(*target))
+    except Exception as e:
+        print(f"Error listing domains in {target_label(*target)}: {e}")
+        return {'domains': [], 'ambiguous': [], 'unmatched': list(project_ids)}
+    extra = {'Region': region, 'RoleArn': role_arn} if role_arn else {'Region': region}
+    result['domains'] = [dict(domain, **extra) for domain in result['domains']]
+    return result
+
+def group_by_target(domains, default_region):
+    by_target = {}
+    for domain in domains:
+        by_target.setdefault(target_of(domain, default_region), []).append(domain)
+    return by_target
+
+def finish(summary, factory, domains, snapshot=None):
+    labels = {domain['DomainId']: f"{target_label(*target_of(domain, factory.region))}/" for domain in domains}
+    print_summary(summary, labels)
+    if factory.rate_limiter is not None:
+        factory.rate_limiter.print_report()
+    # Deleted domains and their ENIs/EFS volumes must not be served to the next stage
+    for target in group_by_target(domains, factory.region):
+        invalidate_teardown(snapshot, target_label(*target))
+    exit(1 if summary['failed'] else 0)
 
 if __name__ == '__main__':
+    args = parse_arguments()
+    events = events_from_args(args)
+
     # Assuming csp.login() is defined elsewhere
-    csp.login()
+    cached_login(csp.login)
     
-    client = boto3.client('sagemaker')
-    
-    # Get project ID from environment variable
-    project_id = os.getenv('PROJECT_ID')
-    if project_id is None:
-        print("Error: PROJECT_ID not provided.")
-        exit(1)
-    
-    # Filter domain IDs with project_id as suffix
-    filtered_domains = filter_domain_id_with_project_id(client, project_id)
+    journal = TeardownJournal(args.journal, args.resume) if args.journal and not args.dry_run else None
+    snapshot = snapshot_from_args(args)
+
+    if args.apply:
+        factory = factory_from_args(args, read_plan(args.apply)['region'])
+    elif args.resume:
+        if journal.domains is None:
+            print(f"Error: no run recorded in journal {args.journal}.")
+            exit(1)
+        factory = factory_from_args(args, journal.region)
+    else:
+        factory = factory_from_args(args)
+
+    def factory_for(role_arn):
+        # Other accounts are reached through their role, assumed once and refreshed before expiry
+        return factory.assume_role(role_arn, args.role_session_name) if role_arn else factory
+
+    def clients_for(target):
+        role_arn, region = target
+        return factory_for(role_arn).clients(*SERVICES, region=region)
+
+    if args.apply:
+        plan = read_plan(args.apply)
+        if journal is not None:
+            journal.start(plan['domains'], factory.region)
+
+        def apply(domain):
+            print(f"Applying plan for Domain ID: {domain['DomainId']}, Domain Name: {domain['DomainName']}")
+            return apply_domain_plan(clients_for(target_of(domain, factory.region)), domain, args.page_size,
+                                     args.poll_deadline, snapshot, journal, events)
+
+        finish(run_teardowns(plan['domains'], apply, args.workers), factory, plan['domains'], snapshot)
+
+    if args.resume:
+        # Domains the interrupted run already finished are skipped
+        filtered_domains = journal.pending_domains()
+        if not filtered_domains:
+            print(f"Every domain in journal {args.journal} has already been torn down.")
+            exit(0)
+    elif args.manifest:
+        def list_target_domains(target):
+            role_arn, region = target
+            return cached(snapshot, 'domains', target_label(*target),
+                          lambda: iter_domains(factory_for(role_arn).client('sagemaker', region), args.page_size))
+
+        # Rows are resolved into domains while the manifest is still being read
+        filtered_domains = manifest_domains(read_manifest(args.manifest, args.manifest_format), list_target_domains,
+                                            factory.region)
+    else:
+        project_ids = project_ids_from_args(args)
+        if not project_ids:
+            print("Error: PROJECT_ID not provided.")
+            exit(1)
+
+        def account_targets(role_arn):
+            try:
+                return [(role_arn, region) for region in factory_for(role_arn).regions(args.regions)]
+            except Exception as e:
+                print(f"Error assuming role {role_arn}: {e}")
+                return []
+
+        # Filter domain IDs with the project IDs as suffix, in every account and region at once
+        targets = [target for targets in fan_out(account_targets, parse_role_arns(args.role_arns)).values()
+                   for target in targets]
+        found = fan_out(lambda target: find_domains(factory_for(target[0]), target, project_ids, args.page_size, snapshot), targets)
+        filtered_domains = [domain for target in targets for domain in found[target]['domains']]
+        # A project only counts as unmatched if no account or region has a domain of it
+        print_project_report({'domains': filtered_domains,
+                              'ambiguous': [domain for target in targets for domain in found[target]['ambiguous']],
+                              'unmatched': [project_id for project_id in project_ids
+                                            if all(project_id in found[target]['unmatched'] for target in targets)]})
+        
+        if not filtered_domains:
+            print(f"No domains found with project IDs {', '.join(project_ids)} as suffix in {', '.join(target_label(*target) for target in targets)}.")
+            exit(0)
     
-    if not filtered_domains:
-        print(f"No domains found with project ID '{project_id}' as suffix.")
+    def index_targets(domains):
+        # Discover ENIs and EFS volumes once per account and region for all domains the journal has not planned yet
+        by_target = group_by_target(domains, factory.region)
+
+        def index_target(target):
+            unplanned = [domain for domain in by_target[target] if journal is None or journal.resumed(domain['DomainId']) is None]
+            if not unplanned:
+                return None
+            role_arn, region = target
+            return build_index(clients_for(target),
+                               [factory_for(role_arn).domain_arn(domain['DomainId'], region) for domain in unplanned],
+                               args.discovery, args.page_size, snapshot, target_label(*target))
+
+        return fan_out(index_target, by_target)
+
+    if args.manifest:
+        queued, indexes = [], {}
+
+        def index_chunks(domains):
+            # Each chunk is discovered and handed to the workers before the next one is read
+            while True:
+                chunk = list(itertools.islice(domains, MANIFEST_CHUNK_SIZE))
+                if not chunk:
+                    return
+                chunk_indexes = index_targets(chunk)
+                for domain in chunk:
+                    indexes[domain['DomainId']] = chunk_indexes[target_of(domain, factory.region)]
+                    queued.append(domain)
+                    if journal is not None:
+                        journal.queued(domain)
+                    yield domain
+
+        filtered_domains = index_chunks(filtered_domains)
+        index_of = lambda domain: indexes[domain['DomainId']]
+    else:
+        queued = filtered_domains
+        target_indexes = index_targets(filtered_domains)
+        index_of = lambda domain: target_indexes[target_of(domain, factory.region)]
+
+    if args.dry_run:
+        plans = []
+        for domain in filtered_domains:
+            target = target_of(domain, factory.region)
+            plans.append(domain_plan(clients_for(target), domain, args.page_size, index_of(domain), snapshot))
+        for plan in plans:
+            print_plan(plan)
+            if events is not None:
+                events.discovered(plan['DomainId'], plan['resources'])
+        if args.plan_out:
+            write_plan(args.plan_out, plans, factory.region)
+        print("Dry run completed. No resources were deleted.")
         exit(0)
-    
-    # Proceed with deletion for each filtered domain
-    for domain in filtered_domains:
-        print(f"Deleting Domain ID: {domain['DomainId']}, Domain Name: {domain['DomainName']}")
-        delete_domain(client, domain['DomainId'])
+
+    if journal is not None and not args.resume:
+        # Manifest domains are journalled as they are queued
+        journal.start([] if args.manifest else filtered_domains, factory.region)
+
+    # Proceed with deletion for each filtered domain; domains of all accounts and regions share the worker pool
+    def teardown(domain):
+        target = target_of(domain, factory.region)
+        print(f"Deleting Domain ID: {domain['DomainId']}, Domain Name: {domain['DomainName']}, in {target_label(*target)}")
+        return delete_domain(clients_for(target), domain['DomainId'], args.page_size, args.poll_deadline,
+                             index_of(domain), snapshot, journal, events)
+
+    summary = run_teardowns(filtered_domains, teardown, args.workers)
+    finish(summary, factory, queued, snapshot)
 
 
 sagemaker_create:
@@ -95,6 +310,10 @@ import sys
 import boto3
 import csp
 import time
+from aws_clients import ClientFactory
+from credential_cache import cached_login
+from inventory import DEFAULT_PAGE_SIZE, app_owner, iter_apps, iter_domains, iter_spaces, iter_user_profiles
+from polling import wait_deleted
 
 os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
 
@@ -106,57 +325,67 @@ def list_all_domains(client):
         client: Boto3 SageMaker client.
     """
     print("All Domain IDs and Names:")
-    domains = client.list_domains()
-    for domain in domains['Domains']:
+    for domain in iter_domains(client):
         print(f"Domain ID: {domain['DomainId']}, Domain Name: {domain['DomainName']}")
 
-def filter_domain_id_with_project_id(client, project_id):
+def filter_domain_id_with_project_id(client, project_id, page_size=DEFAULT_PAGE_SIZE):
     """
     Filter domain IDs with the given project ID as suffix.
 
     Args:
         client: Boto3 SageMaker client.
         project_id (str): Project ID suffix.
+        page_size (int): Number of domains requested per page.
 
     Returns:
         list: List of dictionaries containing DomainId and DomainName.
     """
     filtered_domain_ids = []
-    domains = client.list_domains()
-    for domain in domains['Domains']:
+    for domain in iter_domains(client, page_size):
         if domain['DomainName'].endswith(project_id):
             filtered_domain_ids.append({'DomainId': domain['DomainId'], 'DomainName': domain['DomainName']})
     return filtered_domain_ids
 
-def delete_domain(client, domain_id):
+def delete_domain(client, domain_id, page_size=DEFAULT_PAGE_SIZE):
     """
     Delete resources associated with the given domain ID.
 
     Args:
         client: Boto3 SageMaker client.
         domain_id (str): Domain ID to delete.
+        page_size (int): Number of apps, user profiles and spaces requested per page.
     """
     # Delete Apps
-    apps = client.list_apps(DomainIdEquals=domain_id)
-    for app in apps['Apps']:
+    for app in iter_apps(client, domain_id, page_size):
         print(f"Deleting App: {app['AppName']}")
-        client.delete_app(DomainId=domain_id, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName'])
+        client.delete_app(DomainId=domain_id, AppType=app['AppType'], AppName=app['AppName'], **app_owner(app))
+
+    # Like the graph teardown: apps, then spaces, then user profiles, each once the previous are gone
+    wait_deleted(lambda: iter_apps(client, domain_id, page_size))
+
+    # Delete Spaces
+    for space in iter_spaces(client, domain_id, page_size):
+        print(f"Deleting Space: {space['SpaceName']}")
+        client.delete_space(DomainId=domain_id, SpaceName=space['SpaceName'])
+
+    wait_deleted(lambda: iter_spaces(client, domain_id, page_size))
 
     # Delete User Profiles
-    user_profiles = client.list_user_profiles(DomainIdEquals=domain_id)
-    for user_profile in user_profiles['UserProfiles']:
+    for user_profile in iter_user_profiles(client, domain_id, page_size):
         print(f"Deleting User Profile: {user_profile['UserProfileName']}")
         client.delete_user_profile(DomainId=domain_id, UserProfileName=user_profile['UserProfileName'])
 
+    wait_deleted(lambda: iter_user_profiles(client, domain_id, page_size))
+
     # Delete Domain
     print(f"Deleting Domain: {domain_id}")
     client.delete_domain(DomainId=domain_id, RetentionPolicy={'HomeEfsFileSystem': 'Delete'})
 
 if __name__ == '__main__':
     # Assuming csp.login() is defined elsewhere
-    csp.login()
+    cached_login(csp.login)
     
-    client = boto3.client('sagemaker')
+    client = ClientFactory().client('sagemaker')
     
     # List all domain IDs and names
     list_all_domains(client)
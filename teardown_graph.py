@@ -0,0 +1,434 @@
+"""
+Dependency-graph teardown of a SageMaker domain.
+
+A domain is torn down as a graph instead of fixed phases:
+
+    app -> user profile / space -> domain -> EFS mount targets -> network interfaces, EFS volumes
+
+Every node is deleted as soon as its own predecessors are gone, so a user
+profile whose apps are already deleted does not wait on another profile's
+slow JupyterServer app. A file system is only deleted once its mount targets
+are gone, since EFS rejects the delete before that; the mount targets of all
+file systems are deleted side by side and polled with one describe per file
+system.
+"""
+import botocore.exceptions
+
+from discovery import find_efs_volumes, find_mount_targets, find_network_interfaces
+from inventory import DEFAULT_PAGE_SIZE, app_owner, iter_apps, iter_spaces, iter_user_profiles
+from polling import DELETED_STATUSES, GONE, Backoff, DomainStatus, MountTargetStatus, PollTimeout
+from snapshot import cached
+
+PENDING = 'Pending'
+DELETING = 'Deleting'
+FAILED = 'Failed'
+
+RETRY_STATUSES = ('Delete_Failed', 'Failed')
+# EFS reports its life cycle states in lower case
+DELETING_STATUSES = (DELETING, 'deleting')
+NOT_FOUND_CODES = ('ResourceNotFound', 'ResourceNotFoundException', 'InvalidNetworkInterfaceID.NotFound',
+                   'FileSystemNotFound', 'MountTargetNotFound')
+MAX_DELETE_ATTEMPTS = 3
+
+
+def is_not_found(error):
+    """Return True if a botocore ClientError means the resource no longer exists."""
+    return error.response.get('Error', {}).get('Code') in NOT_FOUND_CODES
+
+
+def _describe_status(describe, key):
+    """Call a describe function and return the status under ``key``, or GONE if nothing was described."""
+    try:
+        resource = describe()
+    except botocore.exceptions.ClientError as e:
+        if is_not_found(e):
+            return GONE
+        raise
+    if resource is None or resource[key] in DELETED_STATUSES:
+        return GONE
+    return resource[key]
+
+
+def dependency_waves(after):
+    """
+    Group node IDs in dependency order.
+
+    Every node in a wave only depends on nodes of earlier waves, so the
+    waves are the order in which a run can start the deletes.
+
+    Args:
+        after (dict): Node ID -> IDs of the nodes it waits for.
+
+    Returns:
+        list: Lists of node IDs, one per wave.
+    """
+    remaining = {node_id: {dep for dep in deps if dep in after} for node_id, deps in after.items()}
+    waves = []
+    while remaining:
+        wave = sorted(node_id for node_id, deps in remaining.items() if not deps)
+        if not wave:
+            raise ValueError(f"Dependency cycle between {sorted(remaining)}")
+        waves.append(wave)
+        for node_id in wave:
+            del remaining[node_id]
+        for deps in remaining.values():
+            deps.difference_update(wave)
+    return waves
+
+
+class Node:
+    """A single resource in the teardown graph."""
+
+    def __init__(self, node_id, delete, status, after=(), initial_status=None, kind=None, key=None):
+        self.node_id = node_id
+        self.delete = delete
+        self.status = status
+        self.after = set(after)
+        self.initial_status = initial_status
+        self.kind = kind
+        self.key = key
+        self.state = PENDING
+        self.attempts = 0
+        self.error = None
+
+
+class TeardownGraph:
+    """Deletes resources in dependency order, each as early as possible."""
+
+    def __init__(self):
+        self.nodes = {}
+        self.refreshers = []
+        self.listeners = []
+
+    def add(self, node_id, delete, status, after=(), initial_status=None, kind=None, key=None):
+        """
+        Add a resource to the graph.
+
+        Args:
+            node_id (str): Unique ID such as 'app:alice/JupyterServer/default'.
+            delete: Callable that issues the delete call.
+            status: Callable returning the current status, or GONE.
+            after: Node IDs that must be gone before this node is deleted.
+            initial_status (str): Status seen at discovery time, if known.
+            kind (str): Resource kind, e.g. 'app', kept so the node can be serialised.
+            key (dict): Request parameters identifying the resource.
+
+        Returns:
+            Node: The added node.
+        """
+        node = Node(node_id, delete, status, after, initial_status, kind, key)
+        self.nodes[node_id] = node
+        return node
+
+    def ready(self):
+        """Return pending nodes whose predecessors are all gone."""
+        return [node for node in self.nodes.values()
+                if node.state == PENDING
+                and all(self.nodes[dep].state == GONE for dep in node.after if dep in self.nodes)]
+
+    def waves(self):
+        """Return the node IDs grouped in dependency order, see dependency_waves."""
+        return dependency_waves({node_id: node.after for node_id, node in self.nodes.items()})
+
+    def recheck(self, node_ids):
+        """
+        Replace the discovery-time status of the given nodes with their current status.
+
+        Args:
+            node_ids: IDs of nodes whose recorded status may be stale.
+        """
+        for refresh in self.refreshers:
+            refresh()
+        for node_id in node_ids:
+            node = self.nodes[node_id]
+            node.initial_status = node.status()
+
+    def restore(self, states):
+        """
+        Put nodes back in the state a previous, interrupted run left them in.
+
+        Gone nodes are not touched again and deleting nodes go straight back
+        to polling. Every other node, e.g. one that failed with PollTimeout
+        mid-delete or whose delete was issued just before the run was
+        killed, is rechecked first, so that a delete still in progress is
+        polled instead of being issued again.
+
+        Args:
+            states (dict): Node ID -> last recorded state.
+        """
+        for node_id, state in states.items():
+            if node_id in self.nodes and state in (GONE, DELETING):
+                self.nodes[node_id].state = state
+        pending = [node_id for node_id, node in self.nodes.items() if node.state == PENDING]
+        if pending:
+            self.recheck(pending)
+
+    def _set_state(self, node, state, error=None):
+        node.state = state
+        node.error = error
+        for listener in self.listeners:
+            listener(node)
+
+    def _issue_delete(self, node):
+        node.attempts += 1
+        print(f"Deleting {node.node_id}")
+        try:
+            node.delete()
+            self._set_state(node, DELETING)
+        except botocore.exceptions.ClientError as e:
+            if is_not_found(e):
+                self._set_state(node, GONE)
+            else:
+                self._set_state(node, FAILED, str(e))
+
+    def _start(self, node):
+        if node.initial_status == GONE or node.initial_status in DELETED_STATUSES:
+            self._set_state(node, GONE)
+        elif node.initial_status in DELETING_STATUSES:
+            self._set_state(node, DELETING)
+        else:
+            self._issue_delete(node)
+
+    def _refresh(self, node):
+        """Update a deleting node from its status; return True if it finished."""
+        try:
+            status = node.status()
+        except botocore.exceptions.ClientError as e:
+            self._set_state(node, FAILED, str(e))
+            return True
+        if status == GONE:
+            print(f"Deleted {node.node_id}")
+            self._set_state(node, GONE)
+            return True
+        if status in RETRY_STATUSES:
+            if node.attempts < MAX_DELETE_ATTEMPTS:
+                self._issue_delete(node)
+            else:
+                self._set_state(node, FAILED, f"status {status} after {node.attempts} delete attempts")
+                return True
+        return False
+
+    def run(self, backoff=None):
+        """
+        Delete every node, starting each one as soon as it is unblocked.
+
+        Args:
+            backoff (Backoff): Polling schedule; a default one is used if None.
+                The delay drops back to the base delay whenever a node finishes.
+
+        Returns:
+            dict: 'deleted' node IDs, 'failed' (node ID -> error) and
+            'blocked' node IDs that never started because a predecessor failed.
+        """
+        backoff = backoff or Backoff()
+        while True:
+            for node in self.ready():
+                self._start(node)
+            deleting = [node for node in self.nodes.values() if node.state == DELETING]
+            if not deleting and not self.ready():
+                break
+            if deleting:
+                try:
+                    backoff.sleep()
+                except PollTimeout as e:
+                    for node in deleting:
+                        self._set_state(node, FAILED, str(e))
+                    break
+                for refresh in self.refreshers:
+                    refresh()
+                if any([self._refresh(node) for node in deleting]):
+                    backoff.reset()
+
+        return {
+            'deleted': [node.node_id for node in self.nodes.values() if node.state == GONE],
+            'failed': {node.node_id: node.error for node in self.nodes.values() if node.state == FAILED},
+            'blocked': [node.node_id for node in self.nodes.values() if node.state == PENDING],
+        }
+
+
+def _resource_actions(client, status, kind, key, mount_target_status=None):
+    """Return the delete and status callables for a resource of the given kind."""
+    sagemaker = client['sagemaker']
+    if kind == 'app':
+        owner = key.get('SpaceName') or key.get('UserProfileName')
+        return (lambda: sagemaker.delete_app(**key),
+                lambda: status.app(owner, key['AppType'], key['AppName']))
+    if kind == 'user_profile':
+        return (lambda: sagemaker.delete_user_profile(**key),
+                lambda: status.user_profile(key['UserProfileName']))
+    if kind == 'space':
+        return (lambda: sagemaker.delete_space(**key),
+                lambda: status.space(key['SpaceName']))
+    if kind == 'domain':
+        return (lambda: sagemaker.delete_domain(RetentionPolicy={'HomeEfsFileSystem': 'Delete'}, **key),
+                lambda: _describe_status(lambda: sagemaker.describe_domain(**key), 'Status'))
+    if kind == 'eni':
+        return (lambda: client['ec2'].delete_network_interface(**key),
+                lambda: _describe_status(lambda: next(iter(client['ec2'].describe_network_interfaces(
+                    NetworkInterfaceIds=[key['NetworkInterfaceId']])['NetworkInterfaces']), None), 'Status'))
+    if kind == 'mount_target':
+        return (lambda: client['efs'].delete_mount_target(MountTargetId=key['MountTargetId']),
+                lambda: mount_target_status.mount_target(key['FileSystemId'], key['MountTargetId']))
+    if kind == 'efs':
+        return (lambda: client['efs'].delete_file_system(**key),
+                lambda: _describe_status(lambda: next(iter(client['efs'].describe_file_systems(**key)['FileSystems']), None),
+                                         'LifeCycleState'))
+    if kind == 'lambda':
+        return (lambda: client['lambda'].delete_function(**key),
+                lambda: _describe_status(lambda: client['lambda'].get_function(**key)['Configuration'], 'State'))
+    raise ValueError(f"Unknown resource kind '{kind}'")
+
+
+def domain_resources(domain_id, user_profiles, spaces, apps, interface_ids=(), file_system_ids=(), function_names=(),
+                     mount_targets=()):
+    """
+    Describe a domain's resources and their dependencies from listings already made.
+
+    Args:
+        domain_id (str): Domain ID.
+        user_profiles, spaces, apps: Items as returned by the SageMaker list calls.
+        interface_ids: IDs of the domain's network interfaces.
+        file_system_ids: IDs of the domain's EFS volumes.
+        function_names: Names of the domain's Lambda functions.
+        mount_targets: Mount targets of the domain's EFS volumes, as returned by describe_mount_targets.
+
+    Returns:
+        list: JSON-serialisable resources, each a dictionary with 'id', 'kind',
+        'key' (request parameters), 'after' (node IDs) and 'status' (or None).
+    """
+    resources = {}
+
+    def add(node_id, kind, key, after=(), status=None):
+        resources[node_id] = {'id': node_id, 'kind': kind, 'key': key, 'after': list(after), 'status': status}
+
+    for user_profile in user_profiles:
+        name = user_profile['UserProfileName']
+        add(f"user_profile:{name}", 'user_profile', {'DomainId': domain_id, 'UserProfileName': name},
+            status=user_profile['Status'])
+
+    for space in spaces:
+        name = space['SpaceName']
+        add(f"space:{name}", 'space', {'DomainId': domain_id, 'SpaceName': name}, status=space['Status'])
+        # A private space must be gone before the user profile owning it can be deleted
+        owner = space.get('OwnershipSettingsSummary', {}).get('OwnerUserProfileName')
+        if owner and f"user_profile:{owner}" in resources:
+            resources[f"user_profile:{owner}"]['after'].append(f"space:{name}")
+
+    for app in apps:
+        owner = app_owner(app)
+        owner_name = next(iter(owner.values()))
+        owner_node = f"space:{owner_name}" if 'SpaceName' in owner else f"user_profile:{owner_name}"
+        key = dict(owner, DomainId=domain_id, AppType=app['AppType'], AppName=app['AppName'])
+        app_node = f"app:{owner_name}/{app['AppType']}/{app['AppName']}"
+        add(app_node, 'app', key, status=app['Status'])
+        if owner_node in resources:
+            resources[owner_node]['after'].append(app_node)
+
+    domain_node = f"domain:{domain_id}"
+    owners = [node_id for node_id in resources if not node_id.startswith('app:')]
+    add(domain_node, 'domain', {'DomainId': domain_id}, after=owners)
+
+    mount_target_nodes = {}
+    for mount_target in mount_targets:
+        node_id = f"mount_target:{mount_target['MountTargetId']}"
+        add(node_id, 'mount_target', {'MountTargetId': mount_target['MountTargetId'],
+                                      'FileSystemId': mount_target['FileSystemId']},
+            after=[domain_node], status=mount_target['LifeCycleState'])
+        mount_target_nodes.setdefault(mount_target['FileSystemId'], []).append(node_id)
+
+    # Mount targets own network interfaces of their own, which EFS removes with them
+    all_mount_target_nodes = [node_id for node_ids in mount_target_nodes.values() for node_id in node_ids]
+    for interface_id in interface_ids:
+        add(f"eni:{interface_id}", 'eni', {'NetworkInterfaceId': interface_id},
+            after=[domain_node] + all_mount_target_nodes)
+
+    for file_system_id in file_system_ids:
+        add(f"efs:{file_system_id}", 'efs', {'FileSystemId': file_system_id},
+            after=[domain_node] + mount_target_nodes.get(file_system_id, []))
+
+    for function_name in function_names:
+        add(f"lambda:{function_name}", 'lambda', {'FunctionName': function_name})
+
+    return list(resources.values())
+
+
+def discover_domain_resources(client, domain_id, page_size=DEFAULT_PAGE_SIZE, index=None, snapshot=None):
+    """
+    List a domain's resources and their dependencies.
+
+    Args:
+        client (dict): Boto3 clients keyed by 'sagemaker', 'ec2' and 'efs'; the
+            domain's Lambda functions are included if 'lambda' is present too.
+        domain_id (str): Domain ID.
+        page_size (int): Number of items requested per list page.
+        index (ResourceIndex): Account-wide index used to find the domain's
+            ENIs, EFS volumes and Lambda functions; the account is scanned if None.
+        snapshot (InventorySnapshot): Snapshot to read the domain's listings from, if any.
+
+    Returns:
+        list: Resources as described by domain_resources.
+    """
+    sagemaker = client['sagemaker']
+    user_profiles = cached(snapshot, 'user_profiles', domain_id,
+                           lambda: iter_user_profiles(sagemaker, domain_id, page_size))
+    spaces = cached(snapshot, 'spaces', domain_id, lambda: iter_spaces(sagemaker, domain_id, page_size))
+    apps = cached(snapshot, 'apps', domain_id, lambda: iter_apps(sagemaker, domain_id, page_size))
+
+    function_names = ()
+    if index is not None:
+        interface_ids = index.network_interfaces(domain_id)
+        file_system_ids = index.efs_volumes(domain_id)
+        if 'lambda' in client:
+            function_names = index.lambda_functions(domain_id)
+    else:
+        interface_ids = find_network_interfaces(client['ec2'], domain_id, page_size)
+        file_system_ids = find_efs_volumes(client['efs'], domain_id, page_size)
+    mount_targets = find_mount_targets(client['efs'], file_system_ids, page_size)
+
+    return domain_resources(domain_id, user_profiles, spaces, apps, interface_ids, file_system_ids, function_names,
+                            mount_targets)
+
+
+def graph_from_resources(client, domain_id, resources, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Build a teardown graph from resources listed by discover_domain_resources.
+
+    Args:
+        client (dict): Boto3 clients keyed by 'sagemaker', 'ec2' and 'efs'.
+        domain_id (str): Domain ID.
+        resources (list): Resource dictionaries, e.g. read back from a plan.
+        page_size (int): Number of items requested per list page while polling.
+
+    Returns:
+        TeardownGraph: Graph ready to run.
+    """
+    graph = TeardownGraph()
+    status = DomainStatus(client['sagemaker'], domain_id, page_size)
+    graph.refreshers.append(status.refresh)
+    mount_target_status = MountTargetStatus(client['efs'], page_size) if 'efs' in client else None
+    if mount_target_status is not None:
+        graph.refreshers.append(mount_target_status.refresh)
+    for resource in resources:
+        delete, node_status = _resource_actions(client, status, resource['kind'], resource['key'], mount_target_status)
+        graph.add(resource['id'], delete, node_status, resource['after'], resource['status'],
+                  resource['kind'], resource['key'])
+    return graph
+
+
+def build_domain_graph(client, domain_id, page_size=DEFAULT_PAGE_SIZE, index=None, snapshot=None):
+    """
+    Discover a domain's resources and build its teardown graph.
+
+    Args:
+        client (dict): Boto3 clients keyed by 'sagemaker', 'ec2' and 'efs'.
+        domain_id (str): Domain ID.
+        page_size (int): Number of items requested per list page.
+        index (ResourceIndex): Account-wide index used to find the domain's
+            ENIs and EFS volumes; the account is scanned if None.
+        snapshot (InventorySnapshot): Snapshot to read the domain's listings from, if any.
+
+    Returns:
+        TeardownGraph: Graph ready to run.
+    """
+    resources = discover_domain_resources(client, domain_id, page_size, index, snapshot)
+    return graph_from_resources(client, domain_id, resources, page_size)
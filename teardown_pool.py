@@ -0,0 +1,70 @@
+"""
+Bounded thread pool for tearing down several SageMaker domains at once.
+
+Domains spend most of their teardown waiting on AWS, so running them side by
+side cuts wall time roughly by the number of workers. A failure in one domain
+is recorded in the summary and never stops the others.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_WORKERS = 1
+
+
+def run_teardowns(domains, teardown, workers=DEFAULT_WORKERS):
+    """
+    Run ``teardown(domain)`` for every domain on a bounded worker pool.
+
+    Domains are pulled from the iterable lazily: at most ``workers * 2``
+    are submitted at a time, i.e. ``workers`` running and up to ``workers``
+    more waiting in the executor's queue for a free worker.
+
+    Args:
+        domains: Iterable of dictionaries containing at least DomainId.
+        teardown: Callable invoked with one domain dictionary.
+        workers (int): Maximum number of domains torn down concurrently.
+
+    Returns:
+        dict: Summary with 'succeeded' (DomainId -> teardown result) and
+        'failed' (DomainId -> error message).
+    """
+    workers = max(1, workers)
+    summary = {'succeeded': {}, 'failed': {}}
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            domain_id = pending.pop(future)['DomainId']
+            try:
+                summary['succeeded'][domain_id] = future.result()
+            except Exception as e:
+                print(f"Error tearing down domain {domain_id}: {e}")
+                summary['failed'][domain_id] = str(e)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for domain in domains:
+            # One queued domain per worker keeps every worker busy without draining the iterable
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[executor.submit(teardown, domain)] = domain
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    return summary
+
+
+def print_summary(summary, labels=None):
+    """
+    Print one combined report for a multi-domain teardown.
+
+    Args:
+        summary (dict): Summary returned by run_teardowns.
+        labels (dict): Optional DomainId -> prefix, e.g. the domain's region.
+    """
+    labels = labels or {}
+    print(f"Teardown summary: {len(summary['succeeded'])} succeeded, {len(summary['failed'])} failed")
+    for domain_id in summary['succeeded']:
+        print(f"  OK     {labels.get(domain_id, '')}{domain_id}")
+    for domain_id, error in summary['failed'].items():
+        print(f"  FAILED {labels.get(domain_id, '')}{domain_id}: {error}")
@@ -1,43 +1,33 @@
 import os
 import boto3
-import time
+import csp
 import sys
+import argparse
+from aws_clients import add_client_arguments, factory_from_args
+from inventory import app_owner, iter_apps, iter_spaces, iter_user_profiles
+from polling import drain
+from teardown_pool import DEFAULT_WORKERS, print_summary, run_teardowns
 
 os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
 
-def delete_domain(domain_id):
-    csp.login()  # Assuming csp.login() is defined elsewhere
-    client = boto3.client('sagemaker')
-    
+def delete_domain(client, domain_id):
     try:
         domain = client.describe_domain(DomainId=domain_id)
         print(f"Deleting SageMaker domain: {domain['DomainName']} ({domain['DomainId']})")
 
-        # Deleting apps associated with the domain
-        apps = client.list_apps(DomainIdEquals=domain_id)
-        for app in apps['Apps']:
-            if app['Status'] == 'InService' or app['Status'] == 'Delete_Failed':
-                client.delete_app(DomainId=domain_id, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName'])
-            elif app['Status'] == 'Deleting':
-                # Wait until deletion is complete
-                while True:
-                    time.sleep(5)
-                    app_status = client.describe_app(DomainId=domain_id, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName'])['Status']
-                    if app_status != 'Deleting':
-                        break
-
-        # Deleting user profiles associated with the domain
-        user_profiles = client.list_user_profiles(DomainIdEquals=domain_id)
-        for user_profile in user_profiles['UserProfiles']:
-            if user_profile['Status'] == 'InService':
-                client.delete_user_profile(DomainId=domain_id, UserProfileName=user_profile['UserProfileName'])
-            elif user_profile['Status'] == 'Deleting':
-                # Wait until deletion is complete
-                while True:
-                    time.sleep(5)
-                    user_profile_status = client.describe_user_profile(DomainId=domain_id, UserProfileName=user_profile['UserProfileName'])['Status']
-                    if user_profile_status != 'Deleting':
-                        break
+        # Deleting apps associated with the domain, in user profiles and shared
+        # spaces, resolving every pending app from one list call per tick
+        drain(lambda: iter_apps(client, domain_id),
+              lambda app: client.delete_app(DomainId=domain_id, AppType=app['AppType'], AppName=app['AppName'], **app_owner(app)),
+              ('InService', 'Delete_Failed'))
+
+        # Spaces go first, since a user profile cannot be deleted while it owns a private space
+        drain(lambda: iter_spaces(client, domain_id),
+              lambda space: client.delete_space(DomainId=domain_id, SpaceName=space['SpaceName']),
+              ('InService', 'Delete_Failed'))
+        drain(lambda: iter_user_profiles(client, domain_id),
+              lambda user_profile: client.delete_user_profile(DomainId=domain_id, UserProfileName=user_profile['UserProfileName']),
+              ('InService', 'Delete_Failed'))
 
         # Deleting the domain itself
         client.delete_domain(DomainId=domain_id, RetentionPolicy={'HomeEfsFileSystem': 'Delete'})
@@ -45,14 +35,23 @@ def delete_domain(domain_id):
         print(f"SageMaker domain {domain['DomainName']} ({domain['DomainId']}) deleted successfully.")
     except Exception as e:
         print(f"Error deleting SageMaker domain {domain_id}: {e}")
+        raise
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python sagemaker_delete.py <domain_id>")
+    parser = argparse.ArgumentParser(usage="python sagemaker_delete.py <domain_id> [<domain_id> ...] [--workers N]")
+    parser.add_argument('domain_ids', nargs='+', help="Domain IDs to delete")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of domains torn down in parallel")
+    add_client_arguments(parser)
+    args = parser.parse_args()
+
+    csp.login()  # Assuming csp.login() is defined elsewhere
+    client = factory_from_args(args).client('sagemaker')
+
+    summary = run_teardowns(({'DomainId': domain_id} for domain_id in args.domain_ids),
+                            lambda domain: delete_domain(client, domain['DomainId']), args.workers)
+    print_summary(summary)
+    if summary['failed']:
         sys.exit(1)
-    
-    domain_id = sys.argv[1]
-    delete_domain(domain_id)
 
 
 AWS_REGION: us-east-1
@@ -65,14 +64,16 @@ AWS_REGION: us-east-1
 
 import os
 import boto3
-import time
+from aws_clients import ClientFactory
+from inventory import app_owner, iter_apps, iter_spaces, iter_user_profiles
+from polling import drain
 
 os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_REGION', 'us-east-1')
 
 if __name__ == '__main__':
     csp.login()  # Assuming csp.login() is defined elsewhere
     
-    client = boto3.client('sagemaker')
+    client = ClientFactory().client('sagemaker')
     
     domains = client.list_domains()
     
@@ -82,34 +83,15 @@ if __name__ == '__main__':
     
     for domain in domains['Domains']:
         SM_DOMAIN_ID = domain['DomainId']
-        work_to_do = True
-        retry_time = 5
-
-        while work_to_do:
-            work_to_do = False
-            apps = client.list_apps(DomainIdEquals=SM_DOMAIN_ID)
-            
-            for app in apps['Apps']:
-                if app['Status'] == 'InService' or app['Status'] == 'Delete_Failed':
-                    print(client.delete_app(DomainId=SM_DOMAIN_ID, UserProfileName=app['UserProfileName'], AppType=app['AppType'], AppName=app['AppName']))
-                elif app['Status'] == 'Deleting':
-                    work_to_do = True
-                    time.sleep(retry_time)
-                    retry_time *= 3
-
-        work_to_do = True
-        retry_time = 5
-
-        while work_to_do:
-            work_to_do = False
-            user_profiles = client.list_user_profiles(DomainIdEquals=SM_DOMAIN_ID)
-            
-            for user_profile in user_profiles['UserProfiles']:
-                if user_profile['Status'] == 'InService':
-                    print(client.delete_user_profile(DomainId=SM_DOMAIN_ID, UserProfileName=user_profile['UserProfileName']))
-                elif user_profile['Status'] == 'Deleting':
-                    work_to_do = True
-                    time.sleep(retry_time)
-                    retry_time *= 3
+        drain(lambda: iter_apps(client, SM_DOMAIN_ID),
+              lambda app: print(client.delete_app(DomainId=SM_DOMAIN_ID, AppType=app['AppType'], AppName=app['AppName'], **app_owner(app))),
+              ('InService', 'Delete_Failed'))
+
+        drain(lambda: iter_spaces(client, SM_DOMAIN_ID),
+              lambda space: print(client.delete_space(DomainId=SM_DOMAIN_ID, SpaceName=space['SpaceName'])),
+              ('InService', 'Delete_Failed'))
+        drain(lambda: iter_user_profiles(client, SM_DOMAIN_ID),
+              lambda user_profile: print(client.delete_user_profile(DomainId=SM_DOMAIN_ID, UserProfileName=user_profile['UserProfileName'])),
+              ('InService', 'Delete_Failed'))
 
         print(client.delete_domain(DomainId=SM_DOMAIN_ID, RetentionPolicy={'HomeEfsFileSystem': 'Delete'}))
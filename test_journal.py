@@ -0,0 +1,162 @@
+"""
+Resuming a teardown from its journal.
+"""
+import os
+import tempfile
+import unittest
+
+import botocore.exceptions
+
+from journal import TeardownJournal
+from polling import GONE, Backoff, PollTimeout
+from teardown_graph import DELETING, FAILED, PENDING, Node, TeardownGraph, graph_from_resources
+
+DOMAIN = {'DomainId': 'd-abc123def456', 'DomainName': 'team-proj1'}
+RESOURCES = [
+    {'id': 'app:alice/JupyterServer/default', 'kind': 'app', 'key': {}, 'after': [], 'status': 'InService'},
+    {'id': 'user_profile:alice', 'kind': 'user_profile', 'key': {}, 'after': ['app:alice/JupyterServer/default'],
+     'status': 'InService'},
+]
+
+
+class FakeResource:
+    """Delete and status callables of one resource, counting the delete calls."""
+
+    def __init__(self, status):
+        self.current = status
+        self.deletes = 0
+
+    def delete(self):
+        self.deletes += 1
+        self.current = 'Deleting'
+
+    def status(self):
+        return self.current
+
+
+class FakeEc2:
+    """Network interfaces that exist until deleted."""
+
+    def __init__(self, interface_ids):
+        self.interfaces = {interface_id: {'NetworkInterfaceId': interface_id, 'Status': 'in-use'}
+                           for interface_id in interface_ids}
+        self.deletes = []
+
+    def describe_network_interfaces(self, NetworkInterfaceIds):
+        if any(interface_id not in self.interfaces for interface_id in NetworkInterfaceIds):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'InvalidNetworkInterfaceID.NotFound'}}, 'DescribeNetworkInterfaces')
+        return {'NetworkInterfaces': [self.interfaces[interface_id] for interface_id in NetworkInterfaceIds]}
+
+    def delete_network_interface(self, NetworkInterfaceId):
+        self.deletes.append(NetworkInterfaceId)
+        del self.interfaces[NetworkInterfaceId]
+
+
+def build_graph(resources):
+    graph = TeardownGraph()
+    for resource in RESOURCES:
+        fake = resources[resource['id']]
+        graph.add(resource['id'], fake.delete, fake.status, resource['after'], resource['status'],
+                  resource['kind'], resource['key'])
+    return graph
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def interrupted_run(self):
+        """Journal a run whose app delete timed out while the app was still deleting."""
+        journal = TeardownJournal(self.path)
+        journal.start([DOMAIN], 'us-east-1')
+        journal.planned(DOMAIN['DomainId'], RESOURCES)
+        app = FakeResource('InService')
+        graph = build_graph({'app:alice/JupyterServer/default': app, 'user_profile:alice': FakeResource('InService')})
+        graph.listeners.append(journal.listener(DOMAIN['DomainId']))
+        backoff = Backoff(base_delay=0, deadline=None)
+
+        def sleep():
+            raise PollTimeout("Resources still pending after deadline")
+
+        backoff.sleep = sleep
+        result = graph.run(backoff)
+        journal.finished(DOMAIN['DomainId'], failed=True)
+        journal.close()
+        self.assertEqual(app.deletes, 1)
+        self.assertIn('app:alice/JupyterServer/default', result['failed'])
+
+    def test_timed_out_node_is_polled_not_deleted_again(self):
+        self.interrupted_run()
+
+        journal = TeardownJournal(self.path, resume=True)
+        self.addCleanup(journal.close)
+        self.assertEqual(journal.pending_domains(), [DOMAIN])
+        resumed = journal.resumed(DOMAIN['DomainId'])
+        self.assertEqual(resumed['states']['app:alice/JupyterServer/default'], FAILED)
+
+        # The app is still being deleted by the first run's call
+        app, user_profile = FakeResource('Deleting'), FakeResource('InService')
+        graph = build_graph({'app:alice/JupyterServer/default': app, 'user_profile:alice': user_profile})
+        graph.restore(resumed['states'])
+        node = graph.nodes['app:alice/JupyterServer/default']
+        self.assertEqual(node.state, PENDING)
+        self.assertEqual(node.initial_status, 'Deleting')
+
+        backoff = Backoff(base_delay=0, deadline=None)
+
+        def sleep():
+            app.current = GONE
+            user_profile.current = GONE
+
+        backoff.sleep = sleep
+        result = graph.run(backoff)
+        self.assertEqual(app.deletes, 0)
+        self.assertEqual(user_profile.deletes, 1)
+        self.assertEqual(sorted(result['deleted']), ['app:alice/JupyterServer/default', 'user_profile:alice'])
+        self.assertEqual(result['failed'], {})
+
+    def test_deleting_node_goes_straight_back_to_polling(self):
+        journal = TeardownJournal(self.path)
+        journal.start([DOMAIN], 'us-east-1')
+        journal.planned(DOMAIN['DomainId'], RESOURCES)
+        node = Node('app:alice/JupyterServer/default', None, None)
+        node.state = DELETING
+        journal.listener(DOMAIN['DomainId'])(node)
+        journal.close()
+
+        journal = TeardownJournal(self.path, resume=True)
+        self.addCleanup(journal.close)
+        app = FakeResource('Deleting')
+        graph = build_graph({'app:alice/JupyterServer/default': app, 'user_profile:alice': FakeResource('InService')})
+        graph.restore(journal.resumed(DOMAIN['DomainId'])['states'])
+        self.assertEqual(graph.nodes['app:alice/JupyterServer/default'].state, DELETING)
+        self.assertEqual(graph.nodes['user_profile:alice'].initial_status, 'InService')
+
+    def test_pending_eni_is_deleted_on_resume(self):
+        journal = TeardownJournal(self.path)
+        journal.start([DOMAIN], 'us-east-1')
+        journal.planned(DOMAIN['DomainId'], [
+            {'id': 'eni:eni-1', 'kind': 'eni', 'key': {'NetworkInterfaceId': 'eni-1'}, 'after': [], 'status': None}])
+        journal.close()
+
+        journal = TeardownJournal(self.path, resume=True)
+        self.addCleanup(journal.close)
+        resumed = journal.resumed(DOMAIN['DomainId'])
+        ec2 = FakeEc2(['eni-1'])
+        graph = graph_from_resources({'sagemaker': None, 'ec2': ec2}, DOMAIN['DomainId'], resumed['resources'])
+        graph.restore(resumed['states'])
+        self.assertEqual(graph.nodes['eni:eni-1'].initial_status, 'in-use')
+
+        backoff = Backoff(base_delay=0, deadline=None)
+        backoff.sleep = lambda: None
+        result = graph.run(backoff)
+        self.assertEqual(ec2.deletes, ['eni-1'])
+        self.assertEqual(result['deleted'], ['eni:eni-1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+"""
+Dependencies between a domain's resources.
+"""
+import unittest
+
+from teardown_graph import domain_resources
+
+DOMAIN_ID = 'd-abc123def456'
+
+
+class DomainResourcesTest(unittest.TestCase):
+
+    def test_private_space_is_deleted_before_its_owner(self):
+        resources = domain_resources(
+            DOMAIN_ID,
+            user_profiles=[{'UserProfileName': 'alice', 'Status': 'InService'},
+                           {'UserProfileName': 'bob', 'Status': 'InService'}],
+            spaces=[{'SpaceName': 'alice-private', 'Status': 'InService',
+                     'OwnershipSettingsSummary': {'OwnerUserProfileName': 'alice'},
+                     'SpaceSharingSettingsSummary': {'SharingType': 'Private'}},
+                    {'SpaceName': 'team', 'Status': 'InService',
+                     'SpaceSharingSettingsSummary': {'SharingType': 'Shared'}}],
+            apps=[{'SpaceName': 'alice-private', 'AppType': 'JupyterLab', 'AppName': 'default',
+                   'Status': 'InService'}])
+        after = {resource['id']: resource['after'] for resource in resources}
+        self.assertEqual(after['user_profile:alice'], ['space:alice-private'])
+        self.assertEqual(after['user_profile:bob'], [])
+        self.assertEqual(after['space:alice-private'], ['app:alice-private/JupyterLab/default'])
+        self.assertEqual(after['space:team'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()